@@ -0,0 +1,56 @@
+# Times the lead time percentiles and deployment rates of devops_metrics_analytics over a synthetic history,
+# e.g. a year of 20000 deployments with 300000 tickets.
+# Run from the repo root: PYTHONPATH=src python benchmarks/bench_analytics.py --tickets 300000
+import argparse
+import time
+import numpy as np
+from datetime import datetime
+from devops_metrics_analytics import DeploymentDataset, get_deployment_rates, get_lead_time_percentiles
+
+import pytz
+
+DAY = 86400.0
+
+
+def generate_dataset(deployment_count: int, ticket_count: int, seed: int) -> DeploymentDataset:
+    random = np.random.default_rng(seed)
+    deployed = datetime(2019, 1, 1, tzinfo=pytz.utc).timestamp() + random.uniform(0, 365 * DAY, deployment_count)
+    deployment_rows = list(zip(["d{}".format(index) for index in range(deployment_count)],
+                               random.choice(["cvmweb", "modelgen", "shadegen", "measgen"], deployment_count),
+                               deployed))
+    ticket_deployment_index = random.integers(0, deployment_count, ticket_count)
+    created = deployed[ticket_deployment_index] - random.uniform(0, 60 * DAY, ticket_count)
+    ticket_rows = list(zip(["d{}".format(index) for index in ticket_deployment_index],
+                           random.choice(["Story", "Bug", "Task"], ticket_count), random.random(ticket_count) < 0.1,
+                           created, created + random.uniform(0, 10 * DAY, ticket_count)))
+    return DeploymentDataset.from_rows(deployment_rows, ticket_rows)
+
+
+def time_it(function, repeat: int) -> float:
+    best_seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+    return best_seconds
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the analytics aggregations")
+    arg_parser.add_argument("--deployments", type=int, default=20000)
+    arg_parser.add_argument("--tickets", type=int, default=300000)
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Runs per aggregation, the fastest is reported.")
+    arg_parser.add_argument("--seed", type=int, default=7)
+    args = arg_parser.parse_args()
+
+    dataset = generate_dataset(args.deployments, args.tickets, args.seed)
+    results = {
+        "lead time percentiles by app_name, ticket_type, week": time_it(
+            lambda: get_lead_time_percentiles(dataset, ["app_name", "ticket_type"], bucket="week"), args.repeat),
+        "deployment rates by app_name, week": time_it(
+            lambda: get_deployment_rates(dataset, ["app_name"], bucket="week"), args.repeat),
+    }
+
+    print("{} deployments, {} tickets, best of {}".format(args.deployments, args.tickets, args.repeat))
+    for name, seconds in results.items():
+        print("{:<56} {:>8.3f}s".format(name, seconds))
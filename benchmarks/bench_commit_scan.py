@@ -0,0 +1,139 @@
+# Compares the commit scan hot path with the dict records, dateutil parsing, regex email extraction and per-commit
+# cutoff it replaced. The old scan runs once with its regex per Jira project ticket lookup and once with
+# TicketMatcher, so the scan changes and the ticket lookup change are reported separately. Reports CPU time and
+# tracemalloc peak for the scan and for holding every record, as the commit store path does for the commits newer
+# than its cache.
+# Run from the repo root: PYTHONPATH=src:. python benchmarks/bench_commit_scan.py
+import argparse
+import logging
+import random
+import re
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from functools import partial
+
+import pytz
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+from devops_metrics_info import CommitRecord, parse_timestamp
+from devops_metrics_service import DevopsMetricsService
+from devops_metrics_ticket_matcher import TicketMatcher
+
+JIRA_PROJECTS = ["CV", "IMGING", "IQ"]
+
+
+def generate_commits(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    newest = datetime.now(pytz.utc).replace(microsecond=0)
+    authors = ["Robin <robin@batcave.org>", "Bruce Wayne <bruce@batcave.org>", "jenkins <jenkins@batcave.org>"]
+    commits = []
+    for index in range(count):
+        ticket = "{}-{}".format(rng.choice(JIRA_PROJECTS), rng.randint(1, 5000))
+        commits.append({"hash": "{:040x}".format(rng.getrandbits(160)),
+                        "message": "Merged in feature/{} ({}) fix null check".format(ticket, ticket),
+                        "date": (newest - timedelta(seconds=100 * index)).isoformat(),
+                        "author": {"raw": rng.choice(authors)}})
+    return commits
+
+
+# the ticket lookup the scan did before TicketMatcher, one regex per Jira project
+def find_tickets_with_regex_per_project(message: str) -> list:
+    commit_tickets = []
+    for jira_project_str in JIRA_PROJECTS:
+        regex_str = r"[-\(\s\/]?(" + jira_project_str + r"\-[0-9]+)[-\)\s\/]?"
+        tickets_found = re.findall(regex_str, message)
+
+        for ticket_found in tickets_found:
+            commit_tickets.append(ticket_found)
+    return commit_tickets
+
+
+def scan_before(commits: list, retain_records: bool, find_tickets=find_tickets_with_regex_per_project) -> tuple:
+    records = []
+    merge_info_by_ticket = {}
+    for raw_commit in commits:
+        commit = {"hash": raw_commit["hash"], "message": raw_commit["message"], "date": raw_commit["date"],
+                  "author_email": re.findall(r"[^<]*<([^>]*)>", raw_commit["author"]["raw"])[0]}
+        if retain_records:
+            records.append(commit)
+        commit_date = parser.parse(commit["date"])
+        time_based_limit = datetime.now(pytz.utc) - relativedelta(months=3)
+        if commit_date < time_based_limit:
+            break
+        if "jenkins" not in commit["author_email"].lower():
+            for ticket in find_tickets(commit["message"]):
+                if ticket not in merge_info_by_ticket:
+                    merge_info_by_ticket[ticket] = {"date": commit_date, "author": commit["author_email"],
+                                                    "repositories": ["bench_repo"]}
+    return merge_info_by_ticket, records
+
+
+# The service's scan over the raw commits. The service is built and its commit feed replaced once, outside the
+# timed scans, so only the scan itself is measured.
+class ServiceScan:
+    def __init__(self) -> None:
+        self.metrics_service = DevopsMetricsService()
+        self.metrics_service.logger.setLevel(logging.WARNING)
+        self.metrics_service._iter_commits = self._iter_commits
+        self.commits = []
+        self.retain_records = False
+        self.records = []
+
+    def __call__(self, commits: list, retain_records: bool) -> tuple:
+        self.commits = commits
+        self.retain_records = retain_records
+        self.records = []
+        return self.metrics_service.extract_ticket_merge_info_from_commits("bench_repo", ""), self.records
+
+    def _iter_commits(self, repository: str, scan_stats: dict = None):
+        get_author_email = self.metrics_service.commit_source._get_author_email
+        for raw_commit in self.commits:
+            commit = CommitRecord(raw_commit["hash"], raw_commit["message"], parse_timestamp(raw_commit["date"]),
+                                  get_author_email(raw_commit["author"]["raw"]))
+            if self.retain_records:
+                self.records.append(commit)
+            yield commit
+
+
+# CPU time is the fastest of repeat runs, the single runs vary more than the ticket lookup change
+def measure(scan, commits: list, retain_records: bool, repeat: int) -> dict:
+    cpu_seconds = float("inf")
+    for _ in range(repeat):
+        cpu_start = time.process_time()
+        result, _ = scan(commits, retain_records)
+        cpu_seconds = min(cpu_seconds, time.process_time() - cpu_start)
+
+    tracemalloc.start()
+    scan(commits, retain_records)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_seconds": cpu_seconds, "peak_mib": peak_bytes / 2 ** 20, "tickets": len(result)}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the commit scan hot path")
+    arg_parser.add_argument("--commits", type=int, default=50000)
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Timed runs per scan, the fastest is reported.")
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.INFO)
+    raw_commits = generate_commits(args.commits, args.seed)
+    scan_before_with_matcher = partial(scan_before, find_tickets=TicketMatcher(JIRA_PROJECTS).find_tickets)
+    scan_after = ServiceScan()
+    print("{} synthetic commits".format(len(raw_commits)))
+    for retain in (False, True):
+        before = measure(scan_before, raw_commits, retain, args.repeat)
+        before_with_matcher = measure(scan_before_with_matcher, raw_commits, retain, args.repeat)
+        after = measure(scan_after, raw_commits, retain, args.repeat)
+        assert before["tickets"] == before_with_matcher["tickets"] == after["tickets"]
+        label = "scan, records retained" if retain else "scan, streaming"
+        for name, result in (("before", before), ("before, TicketMatcher", before_with_matcher), ("after", after)):
+            print("{:<24} {:<22} cpu={:>7.3f}s peak={:>8.2f}MiB"
+                  .format(label, name, result["cpu_seconds"], result["peak_mib"]))
+        for name, slower, faster in (("ticket lookup", before, before_with_matcher),
+                                     ("scan changes", before_with_matcher, after), ("total", before, after)):
+            print("{:<24} {:<22} cpu {:.2f}x faster, peak memory {:.2f}x smaller"
+                  .format(label, name, slower["cpu_seconds"] / faster["cpu_seconds"],
+                          slower["peak_mib"] / faster["peak_mib"]))
@@ -0,0 +1,258 @@
+# Runs get_devops_metrics_information end to end against a local stand-in for Bitbucket and Jira that generates
+# commit pages, tag pages and Jira search results of a configurable size, with optional latency per request.
+# Each run appends one JSON line to --results_file; runs with the same parameters are compared to the previous
+# one so regressions show up over time.
+# Run from the repo root: PYTHONPATH=src:. python benchmarks/bench_end_to_end.py --repos 8 --commits_per_repo 2000
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytz
+import requests
+
+APP_REPO = "cv-management-web"
+BITBUCKET_PREFIX = "/2.0/repositories/lovelandinnovations/"
+JIRA_PREFIX = "/jira/rest/api/2/"
+RELEASE_SPACING = 100
+RELEASES = 10
+
+
+# Every repo gets commits_per_repo commits an hour apart, newest first, each referencing one ticket. The app repo
+# is tagged 1.0.1 to 1.0.10 every RELEASE_SPACING commits, so the previous release used by a 1.0.10 deployment is
+# 2 * RELEASE_SPACING commits back. Release tickets CV-1..CV-n are spread over the commits made since then.
+class StubData:
+    def __init__(self, repos: int, commits_per_repo: int, tickets_per_release: int) -> None:
+        self.now = datetime.now(pytz.utc).replace(microsecond=0)
+        self.dependency_repos = ["bench-dep-{}".format(index) for index in range(repos)]
+        self.tickets_per_release = tickets_per_release
+        self.commits = {repository: self._generate_commits(repository, commits_per_repo)
+                        for repository in [APP_REPO] + self.dependency_repos}
+        self.commit_index = {repository: {commit["hash"]: index for index, commit in enumerate(commits)}
+                             for repository, commits in self.commits.items()}
+        self.tags = {repository: self._generate_tags(repository) for repository in self.commits}
+
+    def _generate_commits(self, repository: str, count: int) -> list:
+        commits = []
+        for index in range(count):
+            if index < 2 * RELEASE_SPACING and index % 2 == 0:
+                ticket = "CV-{}".format(index // 2 % self.tickets_per_release + 1)
+            else:
+                ticket = "CV-{}".format(100000 + index)
+            commits.append({"hash": hashlib.sha1("{}:{}".format(repository, index).encode()).hexdigest(),
+                            "message": "Merged in feature/{} ({}) change {}".format(ticket, ticket, index),
+                            "date": (self.now - timedelta(hours=index)).isoformat(),
+                            "author": {"raw": "Robin <robin@batcave.org>"}})
+        return commits
+
+    def _generate_tags(self, repository: str) -> list:
+        commits = self.commits[repository]
+        return [{"name": "1.0.{}".format(RELEASES - release),
+                 "target": {"hash": commits[release * RELEASE_SPACING]["hash"],
+                            "date": commits[release * RELEASE_SPACING]["date"]}}
+                for release in range(RELEASES) if release * RELEASE_SPACING < len(commits)]
+
+    def get_issues(self) -> list:
+        created = (self.now - timedelta(days=5)).strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+        return [{"id": str(number), "key": "CV-{}".format(number), "self": "issue/{}".format(number),
+                 "fields": {"issuetype": {"name": "Story"}, "created": created, "updated": created,
+                            "issuelinks": []}}
+                for number in range(1, self.tickets_per_release + 1)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    data: StubData = None
+    latency_seconds = 0.0
+    request_counts = {}
+    request_counts_lock = threading.Lock()
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == "/__stats":
+            self._send_json(self.request_counts)
+            return
+
+        time.sleep(self.latency_seconds)
+        if url.path.startswith(BITBUCKET_PREFIX):
+            kind, body = self._get_bitbucket(url.path[len(BITBUCKET_PREFIX):], query)
+        elif url.path.startswith(JIRA_PREFIX):
+            kind, body = self._get_jira(url.path[len(JIRA_PREFIX):], query)
+        else:
+            kind, body = "unknown", None
+        with self.request_counts_lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+        if body is None:
+            self.send_error(404)
+        else:
+            self._send_json(body)
+
+    def _get_bitbucket(self, path: str, query: dict) -> tuple:
+        repository, _, resource_path = path.partition("/")
+        if repository not in self.data.commits:
+            return "bitbucket_unknown", None
+        if resource_path == "refs/tags":
+            return "bitbucket_tags", self._page(self.data.tags[repository], query, 10)
+        if resource_path.startswith("commits/"):
+            revision = resource_path[len("commits/"):]
+            start = 0 if revision == "master" else self.data.commit_index[repository].get(revision)
+            if start is None:
+                return "bitbucket_commits", None
+            return "bitbucket_commits", self._page(self.data.commits[repository][start:], query, 30)
+        # the range between two tags that app_scan_mode=range reads, master is linear so it is a slice of it
+        if resource_path == "commits" and "include" in query:
+            commit_index = self.data.commit_index[repository]
+            start = commit_index.get(query["include"])
+            end = commit_index.get(query.get("exclude"), len(self.data.commits[repository]))
+            if start is None:
+                return "bitbucket_commit_range", None
+            return "bitbucket_commit_range", self._page(self.data.commits[repository][start:end], query, 30)
+        return "bitbucket_unknown", None
+
+    def _page(self, values: list, query: dict, default_pagelen: int) -> dict:
+        pagelen = int(query.get("pagelen", default_pagelen))
+        page = int(query.get("page", 1))
+        body = {"pagelen": pagelen, "values": values[(page - 1) * pagelen:page * pagelen]}
+        if page * pagelen < len(values):
+            query = dict(query, page=str(page + 1))
+            body["next"] = "http://{}{}?{}".format(self.headers["Host"], urlparse(self.path).path,
+                                                  "&".join("{}={}".format(name, value)
+                                                           for name, value in query.items()))
+        return body
+
+    def _get_jira(self, path: str, query: dict) -> tuple:
+        if path == "serverInfo":
+            return "jira_server_info", {"versionNumbers": [9, 0, 0], "deploymentType": "Server"}
+        if path == "field":
+            return "jira_fields", [{"id": name, "name": name} for name in ["issuetype", "created", "updated",
+                                                                          "issuelinks"]]
+        if path.startswith("project/") and path.endswith("/versions"):
+            return "jira_versions", [{"id": "1", "name": "cvmw-1.0.{}".format(RELEASES), "self": "version/1"}]
+        if path == "search":
+            issues = self.data.get_issues()
+            start_at = int(query.get("startAt", 0))
+            max_results = int(query.get("maxResults", 50))
+            return "jira_search", {"startAt": start_at, "maxResults": max_results, "total": len(issues),
+                                   "issues": issues[start_at:start_at + max_results]}
+        return "jira_unknown", None
+
+    def _send_json(self, body: any) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def serve(port_queue: multiprocessing.Queue, repos: int, commits_per_repo: int, tickets_per_release: int,
+          latency_ms: float) -> None:
+    StubHandler.data = StubData(repos, commits_per_repo, tickets_per_release)
+    StubHandler.latency_seconds = latency_ms / 1000.0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def get_git_revision() -> str:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+def run_benchmark(args: argparse.Namespace, base_url: str) -> dict:
+    os.environ.update({"bitbucket_api_url": base_url + BITBUCKET_PREFIX.rstrip("/"),
+                       "jira_server_url": base_url + "/jira/",
+                       "bitbucket_user_id": "bench", "bitbucket_api_password": "bench",
+                       "jira_user_id": "bench", "jira_api_key": "bench",
+                       # the stand-in has no quota, so don't let the client's rate limit dominate
+                       "bitbucket_requests_per_hour": "100000000"})
+    for setting in args.env:
+        name, _, value = setting.partition("=")
+        os.environ[name] = value
+
+    # imported after the environment is set, as the service reads its configuration on construction
+    from devops_metrics_instrumentation import Instrumentation
+    from devops_metrics_service import DevopsMetricsService
+
+    instrumentation = Instrumentation()
+    metrics_service = DevopsMetricsService(instrumentation)
+    metrics_service.logger.setLevel(logging.WARNING)
+    dependency_repos = ["bench-dep-{}".format(index) for index in range(args.repos)]
+    metrics_service._get_repos_to_check = lambda project_name: dependency_repos
+
+    start = time.perf_counter()
+    metrics_info = metrics_service.get_devops_metrics_information(APP_REPO, "1.0.{}".format(RELEASES),
+                                                                  datetime.now(pytz.utc), "bench")
+    wall_seconds = time.perf_counter() - start
+
+    client_counters = {"{}{}".format(counter["name"], "".join(":" + value for value in counter["labels"].values())):
+                       counter["value"] for counter in instrumentation.to_dict()["counters"]
+                       if counter["name"].startswith("http_")}
+    return {"wall_seconds": round(wall_seconds, 3),
+            "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "deployed_tickets": len(metrics_info.deployed_tickets),
+            "client": client_counters}
+
+
+def compare_with_previous(results_file: str, result: dict) -> None:
+    if not os.path.exists(results_file):
+        return
+    with open(results_file) as file:
+        previous_results = [json.loads(line) for line in file if line.strip()]
+    comparable = [previous for previous in previous_results if previous["parameters"] == result["parameters"]]
+    if len(comparable) == 0:
+        return
+    previous = comparable[-1]
+    print("compared to {} ({}): wall {:+.1f}% requests {:+d} peak_rss {:+.1f}MiB"
+          .format(previous["revision"] or "previous run", previous["timestamp"],
+                  (result["wall_seconds"] / previous["wall_seconds"] - 1) * 100,
+                  result["requests"] - previous["requests"], result["peak_rss_mib"] - previous["peak_rss_mib"]))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="End-to-end benchmark against a local Bitbucket/Jira stand-in")
+    arg_parser.add_argument("--repos", type=int, default=8, help="Dependency repos to scan besides the app repo.")
+    arg_parser.add_argument("--commits_per_repo", type=int, default=2000)
+    arg_parser.add_argument("--tickets_per_release", type=int, default=50)
+    arg_parser.add_argument("--latency_ms", type=float, default=0, help="Delay added to every stub response.")
+    arg_parser.add_argument("--env", action="append", default=[],
+                            help="Service setting as name=value, e.g. pipeline_mode=async. Can be repeated.")
+    arg_parser.add_argument("--label", default="", help="Free text stored with the result.")
+    arg_parser.add_argument("--results_file", default="benchmarks/results.jsonl")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    port_queue = multiprocessing.Queue()
+    stub_server = multiprocessing.Process(target=serve, args=(port_queue, args.repos, args.commits_per_repo,
+                                                              args.tickets_per_release, args.latency_ms),
+                                          daemon=True)
+    stub_server.start()
+    stub_url = "http://127.0.0.1:{}".format(port_queue.get(timeout=60))
+
+    try:
+        run_result = run_benchmark(args, stub_url)
+        request_counts = requests.get(stub_url + "/__stats").json()
+    finally:
+        stub_server.terminate()
+
+    result = {"timestamp": datetime.now(pytz.utc).isoformat(), "revision": get_git_revision(), "label": args.label,
+              "parameters": {"repos": args.repos, "commits_per_repo": args.commits_per_repo,
+                             "tickets_per_release": args.tickets_per_release, "latency_ms": args.latency_ms,
+                             "env": sorted(args.env)},
+              "requests": sum(request_counts.values()), "requests_by_kind": request_counts, **run_result}
+    print(json.dumps(result, indent=2))
+    compare_with_previous(args.results_file, result)
+    with open(args.results_file, "a") as results:
+        results.write(json.dumps(result) + "\n")
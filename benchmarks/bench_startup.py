@@ -0,0 +1,68 @@
+# Measures how fast devops_metrics.py answers a deployment that is already in the DB, the path Rundeck retries and
+# duplicate triggers take. Each run starts a fresh interpreter with -X importtime, like Rundeck does, with the DB
+# check answered in-process so only startup and imports are measured. Exits non-zero when the fast path imports
+# the Jira/Bitbucket stack or goes over --max_ms.
+# Run from the repo root: python benchmarks/bench_startup.py
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FAST_PATH_SCRIPT = """
+import logging
+import devops_metrics
+import sys
+devops_metrics.DevopsMetricsRepository.is_app_version_already_deployed = lambda self, app, version: True
+devops_metrics.main(logging.getLogger(), "cvmweb", "1.0.3", "2020-03-27T00:00:00+00:00", "batman")
+print(",".join(module for module in sorted(sys.modules) if module.split(".")[0] in {}))
+"""
+SCAN_ONLY_MODULES = ["devops_metrics_service", "jira", "requests", "dateutil"]
+
+
+def run_fast_path() -> tuple:
+    environment = dict(os.environ, PYTHONPATH="src")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             FAST_PATH_SCRIPT.format(set(SCAN_ONLY_MODULES))],
+                            env=environment, capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        imports.append((module.strip(), int(self_us), int(cumulative_us)))
+    loaded_scan_modules = [module for module in result.stdout.strip().split(",") if module]
+    return wall_ms, imports, loaded_scan_modules
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Startup benchmark for the already-deployed fast path")
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list.")
+    arg_parser.add_argument("--max_ms", type=float, help="Fail when the median wall time is above this.")
+    args = arg_parser.parse_args()
+
+    runs = [run_fast_path() for _ in range(args.runs)]
+    wall_times = [wall_ms for wall_ms, _, _ in runs]
+    _, last_imports, loaded_scan_modules = runs[-1]
+    import_ms = next(cumulative_us for module, _, cumulative_us in last_imports if module == "devops_metrics") / 1000
+
+    print("fast path wall: median {:.1f}ms min {:.1f}ms over {} runs".format(statistics.median(wall_times),
+                                                                            min(wall_times), args.runs))
+    print("import devops_metrics: {:.1f}ms".format(import_ms))
+    print("slowest imports (self time):")
+    for module, self_us, cumulative_us in sorted(last_imports, key=lambda entry: -entry[1])[:args.top]:
+        print("  {:8.1f}ms {:8.1f}ms cumulative  {}".format(self_us / 1000, cumulative_us / 1000, module))
+
+    failed = False
+    if loaded_scan_modules:
+        print("FAIL: the fast path imported {}".format(", ".join(loaded_scan_modules)))
+        failed = True
+    if args.max_ms is not None and statistics.median(wall_times) > args.max_ms:
+        print("FAIL: median wall time is above {}ms".format(args.max_ms))
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,67 @@
+# Compares the single-pass TicketMatcher with the regex-per-project matching it replaced.
+# Run from the repo root: PYTHONPATH=src python benchmarks/bench_ticket_matcher.py
+import argparse
+import random
+import re
+import time
+from devops_metrics_ticket_matcher import TicketMatcher
+
+JIRA_PROJECTS = ["CV", "IMGING", "IQ"]
+
+
+def find_tickets_with_regex_per_project(message: str) -> list:
+    commit_tickets = []
+    for jira_project_str in JIRA_PROJECTS:
+        regex_str = r"[-\(\s\/]?(" + jira_project_str + r"\-[0-9]+)[-\)\s\/]?"
+        tickets_found = re.findall(regex_str, message)
+
+        for ticket_found in tickets_found:
+            commit_tickets.append(ticket_found)
+    return commit_tickets
+
+
+def generate_messages(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    words = ["fix", "update", "refactor", "add", "remove", "handle", "null", "check", "service", "endpoint",
+             "migration", "test", "cleanup", "bump", "version", "config"]
+    messages = []
+    for _ in range(count):
+        message = " ".join(rng.choice(words) for _ in range(rng.randint(4, 20)))
+        ticket_count = rng.choice([0, 1, 1, 1, 2, 3])
+        tickets = ["{}-{}".format(rng.choice(JIRA_PROJECTS), rng.randint(1, 5000)) for _ in range(ticket_count)]
+        if tickets:
+            message = "Merged in feature/{} ({}) {}".format(tickets[0], ", ".join(tickets), message)
+        messages.append(message)
+    return messages
+
+
+def time_it(function, messages: list) -> float:
+    start = time.perf_counter()
+    function(messages)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark commit message ticket matching")
+    arg_parser.add_argument("--messages", type=int, default=100000)
+    arg_parser.add_argument("--seed", type=int, default=42)
+    args = arg_parser.parse_args()
+
+    messages = generate_messages(args.messages, args.seed)
+    ticket_matcher = TicketMatcher(JIRA_PROJECTS)
+
+    results = {
+        "regex per project": time_it(lambda batch: [find_tickets_with_regex_per_project(message)
+                                                    for message in batch], messages),
+        "TicketMatcher.find_tickets": time_it(lambda batch: [ticket_matcher.find_tickets(message)
+                                                             for message in batch], messages),
+        "TicketMatcher.find_tickets_in_batch": time_it(ticket_matcher.find_tickets_in_batch, messages),
+    }
+
+    assert [sorted(tickets) for tickets in ticket_matcher.find_tickets_in_batch(messages)] == \
+           [sorted(find_tickets_with_regex_per_project(message)) for message in messages]
+
+    baseline = results["regex per project"]
+    print("{} synthetic commit messages".format(len(messages)))
+    for name, seconds in results.items():
+        print("{:<48} {:>8.3f}s {:>6.2f}x".format(name, seconds, baseline / seconds))
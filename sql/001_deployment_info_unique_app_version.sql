@@ -0,0 +1,4 @@
+-- Lets DevopsMetricsRepository insert deployments with ON CONFLICT (app_name, app_version) DO NOTHING, so the
+-- already-deployed check and the insert can't race. Remove any duplicate app versions before applying.
+CREATE UNIQUE INDEX IF NOT EXISTS deployment_info_app_name_app_version_uidx
+    ON deployment_info (app_name, app_version);
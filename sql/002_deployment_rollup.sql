@@ -0,0 +1,119 @@
+-- Per app DORA rollups by UTC day and week, kept up to date by DevopsMetricsRepository in the same transaction as
+-- each deployment insert (maintain_deployment_rollups = "true"). Dashboards read these instead of scanning
+-- deployment_info and deployed_ticket, see deployment_rollup_rates at the bottom.
+--   lead time        = deployed_instant - created_instant of each deployed ticket, bucketed in lead_time_*
+--   merge to deploy  = deployed_instant - merged_instant of each deployed ticket, bucketed in merge_to_deploy_*
+--   failed deployment = a deployment with at least one ticket that has a caused_by ticket
+-- Apply after 001 and before turning maintain_deployment_rollups on; the backfill below covers existing history.
+CREATE TABLE IF NOT EXISTS deployment_rollup (
+    app_name TEXT NOT NULL,
+    period TEXT NOT NULL CHECK (period IN ('day', 'week')),
+    period_start DATE NOT NULL,
+    deployments INTEGER NOT NULL DEFAULT 0,
+    failed_deployments INTEGER NOT NULL DEFAULT 0,
+    tickets INTEGER NOT NULL DEFAULT 0,
+    failure_tickets INTEGER NOT NULL DEFAULT 0,
+    lead_time_seconds_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    lead_time_count INTEGER NOT NULL DEFAULT 0,
+    merge_to_deploy_seconds_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    merge_to_deploy_count INTEGER NOT NULL DEFAULT 0,
+    lead_time_le_1d INTEGER NOT NULL DEFAULT 0,
+    lead_time_le_3d INTEGER NOT NULL DEFAULT 0,
+    lead_time_le_7d INTEGER NOT NULL DEFAULT 0,
+    lead_time_le_14d INTEGER NOT NULL DEFAULT 0,
+    lead_time_le_30d INTEGER NOT NULL DEFAULT 0,
+    lead_time_gt_30d INTEGER NOT NULL DEFAULT 0,
+    merge_to_deploy_le_1d INTEGER NOT NULL DEFAULT 0,
+    merge_to_deploy_le_3d INTEGER NOT NULL DEFAULT 0,
+    merge_to_deploy_le_7d INTEGER NOT NULL DEFAULT 0,
+    merge_to_deploy_le_14d INTEGER NOT NULL DEFAULT 0,
+    merge_to_deploy_le_30d INTEGER NOT NULL DEFAULT 0,
+    merge_to_deploy_gt_30d INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (app_name, period, period_start)
+);
+
+-- rollup tables created before the merge to deploy buckets, the backfill below fills them in
+ALTER TABLE deployment_rollup
+    ADD COLUMN IF NOT EXISTS merge_to_deploy_le_1d INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS merge_to_deploy_le_3d INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS merge_to_deploy_le_7d INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS merge_to_deploy_le_14d INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS merge_to_deploy_le_30d INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS merge_to_deploy_gt_30d INTEGER NOT NULL DEFAULT 0;
+
+-- dashboards filter rollups by period and date range across all apps
+CREATE INDEX IF NOT EXISTS deployment_rollup_period_period_start_idx ON deployment_rollup (period, period_start);
+-- the rollup upsert and ticket drill-downs read a deployment's tickets
+CREATE INDEX IF NOT EXISTS deployed_ticket_deployment_id_idx ON deployed_ticket (deployment_id);
+CREATE INDEX IF NOT EXISTS deployed_ticket_app_name_ticket_id_idx ON deployed_ticket (app_name, ticket_id);
+CREATE INDEX IF NOT EXISTS deployment_info_app_name_deployed_instant_idx
+    ON deployment_info (app_name, deployed_instant);
+
+-- Backfill from existing history, replacing whatever rollups are already there
+BEGIN;
+DELETE FROM deployment_rollup;
+INSERT INTO deployment_rollup
+    (app_name, period, period_start, deployments, failed_deployments, tickets, failure_tickets,
+     lead_time_seconds_sum, lead_time_count, merge_to_deploy_seconds_sum, merge_to_deploy_count,
+     lead_time_le_1d, lead_time_le_3d, lead_time_le_7d, lead_time_le_14d, lead_time_le_30d, lead_time_gt_30d,
+     merge_to_deploy_le_1d, merge_to_deploy_le_3d, merge_to_deploy_le_7d, merge_to_deploy_le_14d,
+     merge_to_deploy_le_30d, merge_to_deploy_gt_30d)
+SELECT app_name, period, period_start, count(*), sum(failed_deployments), sum(tickets), sum(failure_tickets),
+       sum(lead_time_seconds_sum), sum(lead_time_count), sum(merge_to_deploy_seconds_sum),
+       sum(merge_to_deploy_count), sum(lead_time_le_1d), sum(lead_time_le_3d), sum(lead_time_le_7d),
+       sum(lead_time_le_14d), sum(lead_time_le_30d), sum(lead_time_gt_30d), sum(merge_to_deploy_le_1d),
+       sum(merge_to_deploy_le_3d), sum(merge_to_deploy_le_7d), sum(merge_to_deploy_le_14d),
+       sum(merge_to_deploy_le_30d), sum(merge_to_deploy_gt_30d)
+FROM (
+    SELECT d.app_name, p.period, date_trunc(p.period, d.deployed_instant AT TIME ZONE 'UTC')::date AS period_start,
+           CASE WHEN count(t.id) FILTER (WHERE COALESCE(t.caused_by, '') <> '') > 0 THEN 1 ELSE 0 END
+               AS failed_deployments,
+           count(t.id) AS tickets,
+           count(t.id) FILTER (WHERE COALESCE(t.caused_by, '') <> '') AS failure_tickets,
+           COALESCE(sum(EXTRACT(EPOCH FROM d.deployed_instant - t.created_instant)), 0) AS lead_time_seconds_sum,
+           count(t.created_instant) AS lead_time_count,
+           COALESCE(sum(EXTRACT(EPOCH FROM d.deployed_instant - t.merged_instant)), 0)
+               AS merge_to_deploy_seconds_sum,
+           count(t.merged_instant) AS merge_to_deploy_count,
+           count(*) FILTER (WHERE d.deployed_instant - t.created_instant <= INTERVAL '1 day') AS lead_time_le_1d,
+           count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '1 day'
+                            AND d.deployed_instant - t.created_instant <= INTERVAL '3 days') AS lead_time_le_3d,
+           count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '3 days'
+                            AND d.deployed_instant - t.created_instant <= INTERVAL '7 days') AS lead_time_le_7d,
+           count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '7 days'
+                            AND d.deployed_instant - t.created_instant <= INTERVAL '14 days') AS lead_time_le_14d,
+           count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '14 days'
+                            AND d.deployed_instant - t.created_instant <= INTERVAL '30 days') AS lead_time_le_30d,
+           count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '30 days') AS lead_time_gt_30d,
+           count(*) FILTER (WHERE d.deployed_instant - t.merged_instant <= INTERVAL '1 day') AS merge_to_deploy_le_1d,
+           count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '1 day'
+                            AND d.deployed_instant - t.merged_instant <= INTERVAL '3 days') AS merge_to_deploy_le_3d,
+           count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '3 days'
+                            AND d.deployed_instant - t.merged_instant <= INTERVAL '7 days') AS merge_to_deploy_le_7d,
+           count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '7 days'
+                            AND d.deployed_instant - t.merged_instant <= INTERVAL '14 days')
+               AS merge_to_deploy_le_14d,
+           count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '14 days'
+                            AND d.deployed_instant - t.merged_instant <= INTERVAL '30 days')
+               AS merge_to_deploy_le_30d,
+           count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '30 days')
+               AS merge_to_deploy_gt_30d
+    FROM deployment_info d
+    CROSS JOIN (VALUES ('day'), ('week')) AS p(period)
+    LEFT JOIN deployed_ticket t ON t.deployment_id = d.id
+    GROUP BY d.id, d.app_name, p.period, d.deployed_instant
+) AS per_deployment
+GROUP BY app_name, period, period_start;
+COMMIT;
+
+-- Rates per app and period, e.g.
+--   SELECT * FROM deployment_rollup_rates WHERE period = 'week' AND period_start >= now() - INTERVAL '12 weeks'
+CREATE OR REPLACE VIEW deployment_rollup_rates AS
+SELECT app_name, period, period_start, deployments,
+       failed_deployments::DOUBLE PRECISION / NULLIF(deployments, 0) AS change_failure_rate,
+       lead_time_seconds_sum / NULLIF(lead_time_count, 0) AS mean_lead_time_seconds,
+       merge_to_deploy_seconds_sum / NULLIF(merge_to_deploy_count, 0) AS mean_merge_to_deploy_seconds,
+       lead_time_le_1d, lead_time_le_3d, lead_time_le_7d, lead_time_le_14d, lead_time_le_30d, lead_time_gt_30d,
+       merge_to_deploy_le_1d, merge_to_deploy_le_3d, merge_to_deploy_le_7d, merge_to_deploy_le_14d,
+       merge_to_deploy_le_30d, merge_to_deploy_gt_30d
+FROM deployment_rollup;
@@ -0,0 +1,26 @@
+-- Staging for devops_metrics_recompute.py. Workers stage each recomputed deployment and its tickets under the run_id
+-- together with a checkpoint row for its (app_name, app_version), in one transaction per batch. An interrupted run
+-- is resumed by skipping the checkpointed versions, and once every version of the run is staged
+-- DevopsMetricsRepository.swap_in_recompute replaces the recorded deployments in a single transaction.
+-- Apply after 001 (and 002 when rollups are maintained).
+CREATE TABLE IF NOT EXISTS deployment_info_staging (
+    run_id TEXT NOT NULL,
+    LIKE deployment_info INCLUDING DEFAULTS
+);
+
+CREATE TABLE IF NOT EXISTS deployed_ticket_staging (
+    run_id TEXT NOT NULL,
+    LIKE deployed_ticket INCLUDING DEFAULTS
+);
+
+CREATE TABLE IF NOT EXISTS recompute_checkpoint (
+    run_id TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    app_version TEXT NOT NULL,
+    completed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (run_id, app_name, app_version)
+);
+
+-- the swap and clearing a run read and delete the staged rows by run
+CREATE INDEX IF NOT EXISTS deployment_info_staging_run_id_idx ON deployment_info_staging (run_id);
+CREATE INDEX IF NOT EXISTS deployed_ticket_staging_run_id_idx ON deployed_ticket_staging (run_id);
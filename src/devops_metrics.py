@@ -1,37 +1,83 @@
 import argparse
+import cProfile
 import logging
 from dotenv import load_dotenv
 from datetime import datetime
 from devops_metrics_info import DevopsMetricsInfo
+from devops_metrics_instrumentation import Instrumentation
 from devops_metrics_repository import DevopsMetricsRepository
-from devops_metrics_service import DevopsMetricsService
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from devops_metrics_service import DevopsMetricsService
 
 
 def main(logger: logging.Logger, project_name: str, project_version: str, deployed_instant: datetime,
-         deployed_by_user_id: str) -> None:
+         deployed_by_user_id: str, metrics_out: str = None, profile_out: str = None) -> None:
     load_dotenv()
-    metrics_repo: DevopsMetricsRepository = DevopsMetricsRepository(logger)
-    metrics_service: DevopsMetricsService = DevopsMetricsService("INFO")
+    instrumentation = Instrumentation()
+    metrics_repo: DevopsMetricsRepository = DevopsMetricsRepository(logger, instrumentation)
+
+    profiler = cProfile.Profile() if profile_out else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with instrumentation.timer("phase", phase="total"):
+            # Rundeck retries and duplicate triggers end here, before the Jira and Bitbucket stacks are imported
+            project_name = rename_project_if_needed(project_name)
+            if is_already_deployed(logger, metrics_repo, project_name, project_version):
+                return
+            from devops_metrics_service import DevopsMetricsService
+            metrics_service: DevopsMetricsService = DevopsMetricsService(instrumentation)
+            process_new_deployment(logger, metrics_repo, metrics_service, project_name, project_version,
+                                   deployed_instant, deployed_by_user_id)
+    finally:
+        # also written when the run exits on an error, which is when the numbers are most useful
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_out)
+            logger.info("Wrote profile to {}".format(profile_out))
+        if metrics_out:
+            instrumentation.write(metrics_out)
+            logger.info("Wrote run metrics to {}".format(metrics_out))
 
+
+def process_deployment(logger: logging.Logger, metrics_repo: DevopsMetricsRepository,
+                       metrics_service: "DevopsMetricsService", project_name: str, project_version: str,
+                       deployed_instant: datetime, deployed_by_user_id: str) -> bool:
     # Adjust app naming from rundeck to match git repo naming
     project_name = rename_project_if_needed(project_name)
 
     # Check to see if this is a new deploy
-    is_already_deployed: bool = metrics_repo.is_app_version_already_deployed(project_name, project_version)
-    if not is_already_deployed:
-        # Get the metrics info
-        metrics_info: DevopsMetricsInfo = metrics_service.get_devops_metrics_information(project_name, project_version,
-                                                                                         deployed_instant,
-                                                                                         deployed_by_user_id)
-        logger.info("Finished gathering metrics, now inserting them into the DB. metrics_info={}"
-                    .format(metrics_info.to_pretty_str()))
-
-        # Save the metrics in the DB
-        metrics_repo.insert_devops_metrics_info(metrics_info)
-        logger.info("Finished inserting into DB, process completed successfully")
-    else:
+    if is_already_deployed(logger, metrics_repo, project_name, project_version):
+        return False
+    return process_new_deployment(logger, metrics_repo, metrics_service, project_name, project_version,
+                                  deployed_instant, deployed_by_user_id)
+
+
+def is_already_deployed(logger: logging.Logger, metrics_repo: DevopsMetricsRepository, project_name: str,
+                        project_version: str) -> bool:
+    is_deployed: bool = metrics_repo.is_app_version_already_deployed(project_name, project_version)
+    if is_deployed:
         logger.info("This app version has already been deployed. No further work needed. app={} version={}"
                     .format(project_name, project_version))
+    return is_deployed
+
+
+def process_new_deployment(logger: logging.Logger, metrics_repo: DevopsMetricsRepository,
+                           metrics_service: "DevopsMetricsService", project_name: str, project_version: str,
+                           deployed_instant: datetime, deployed_by_user_id: str) -> bool:
+    # Get the metrics info
+    metrics_info: DevopsMetricsInfo = metrics_service.get_devops_metrics_information(project_name, project_version,
+                                                                                     deployed_instant,
+                                                                                     deployed_by_user_id)
+    logger.info("Finished gathering metrics, now inserting them into the DB. metrics_info={}"
+                .format(metrics_info.to_pretty_str()))
+
+    # Save the metrics in the DB
+    is_inserted = metrics_repo.insert_devops_metrics_info(metrics_info)
+    logger.info("Finished inserting into DB, process completed successfully")
+    return is_inserted
 
 
 def rename_project_if_needed(project_name: str) -> str:
@@ -59,6 +105,10 @@ if __name__ == "__main__":
     parser.add_argument("--deployed_instant", help="The name of the project that was just deployed. "
                                                    "The git repo name is preferred.", required=True)
     parser.add_argument("--deployed_by_user_id", help="The id of the user who triggered the deploy.", required=True)
+    parser.add_argument("--metrics_out", "--metrics-out", help="Write phase timings and HTTP/DB counters to this "
+                                                               "file, as a Prometheus textfile when it ends in .prom "
+                                                               "and as JSON otherwise.")
+    parser.add_argument("--profile_out", "--profile-out", help="Write a cProfile dump of the run to this file.")
     args = parser.parse_args()
 
     logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
@@ -69,4 +119,6 @@ if __name__ == "__main__":
          args.project_name,
          args.project_version,
          args.deployed_instant,
-         args.deployed_by_user_id)
+         args.deployed_by_user_id,
+         args.metrics_out,
+         args.profile_out)
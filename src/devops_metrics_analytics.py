@@ -0,0 +1,247 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+import numpy as np
+from datetime import datetime
+from dotenv import load_dotenv
+from typing import List, Sequence
+
+SECONDS_PER_DAY = 86400.0
+BUCKETS = ["all", "day", "week", "month"]
+GROUP_COLUMNS = ["app_name", "ticket_type"]
+# (name, start column, end column) of each lead time stage
+LEAD_TIME_STAGES = [("created_to_merged", "created", "merged"), ("merged_to_deployed", "merged", "deployed"),
+                    ("created_to_deployed", "created", "deployed")]
+
+
+# Stored deployments and their tickets as parallel NumPy columns, instants as epoch seconds with NaN for missing
+# values. Every ticket row points at its deployment through deployment_index.
+class DeploymentDataset:
+    def __init__(self, deployment_ids: np.ndarray, deployment_apps: np.ndarray, deployment_deployed: np.ndarray,
+                 ticket_deployment_index: np.ndarray, ticket_types: np.ndarray, ticket_is_failure: np.ndarray,
+                 ticket_created: np.ndarray, ticket_merged: np.ndarray) -> None:
+        self.deployment_ids = deployment_ids
+        self.deployment_apps = deployment_apps
+        self.deployment_deployed = deployment_deployed
+        self.ticket_deployment_index = ticket_deployment_index
+        self.ticket_types = ticket_types
+        self.ticket_is_failure = ticket_is_failure
+        self.ticket_created = ticket_created
+        self.ticket_merged = ticket_merged
+        self.ticket_apps = deployment_apps[ticket_deployment_index]
+        self.ticket_deployed = deployment_deployed[ticket_deployment_index]
+
+    # deployment_rows: (id, app_name, deployed_epoch)
+    # ticket_rows: (deployment_id, ticket_type, is_failure, created_epoch, merged_epoch) with NaN for missing instants
+    @classmethod
+    def from_rows(cls, deployment_rows: Sequence[tuple], ticket_rows: Sequence[tuple]) -> "DeploymentDataset":
+        deployment_ids, deployment_apps, deployment_deployed = _to_columns(deployment_rows, [str, str, np.float64])
+        ticket_deployment_ids, ticket_types, ticket_is_failure, ticket_created, ticket_merged = \
+            _to_columns(ticket_rows, [str, str, bool, np.float64, np.float64])
+
+        # map each ticket's deployment id to the deployment's row, tickets of deployments not loaded are dropped
+        _, id_codes = np.unique(np.concatenate((deployment_ids, ticket_deployment_ids)), return_inverse=True)
+        id_codes = id_codes.reshape(-1)
+        deployment_index_by_code = np.full(len(id_codes), -1, dtype=np.int64)
+        deployment_index_by_code[id_codes[:len(deployment_ids)]] = np.arange(len(deployment_ids))
+        ticket_deployment_index = deployment_index_by_code[id_codes[len(deployment_ids):]]
+        is_known = ticket_deployment_index >= 0
+
+        return cls(deployment_ids, deployment_apps, deployment_deployed, ticket_deployment_index[is_known],
+                   ticket_types[is_known], ticket_is_failure[is_known], ticket_created[is_known],
+                   ticket_merged[is_known])
+
+    def get_ticket_instants(self, column: str) -> np.ndarray:
+        return {"created": self.ticket_created, "merged": self.ticket_merged, "deployed": self.ticket_deployed}[column]
+
+
+def _to_columns(rows: Sequence[tuple], dtypes: list) -> List[np.ndarray]:
+    if len(rows) == 0:
+        return [np.array([], dtype=dtype) for dtype in dtypes]
+    return [np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)]
+
+
+# Start of the bucket each instant falls in, as datetime64[D]. Weeks start on Monday; the epoch was a Thursday.
+def to_buckets(epochs: np.ndarray, bucket: str) -> np.ndarray:
+    days = np.floor(epochs / SECONDS_PER_DAY)
+    if bucket == "all":
+        return np.zeros(len(epochs), dtype="datetime64[D]")
+    if bucket == "day":
+        return days.astype("datetime64[D]")
+    if bucket == "week":
+        return (days - (days + 3) % 7).astype("datetime64[D]")
+    if bucket == "month":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]")
+    raise ValueError("Unknown bucket {}, expected one of {}".format(bucket, BUCKETS))
+
+
+# Distinct values of a key column and each row's index into them
+def _factorize(key_column: np.ndarray) -> tuple:
+    values, codes = np.unique(key_column, return_inverse=True)
+    return values, codes.reshape(-1)
+
+
+# Combines the factorized key columns into one group id per row, for the rows selected by row_filter. Returns the
+# group ids and a label dict per group, e.g. {"app_name": "cv-management-web", "bucket": "2020-03-23"}.
+def _group(factorized_keys: dict, key_names: List[str], row_filter: np.ndarray) -> tuple:
+    group_codes = np.zeros(int(row_filter.sum()), dtype=np.int64)
+    for key_name in key_names:
+        values, codes = factorized_keys[key_name]
+        group_codes = group_codes * len(values) + codes[row_filter]
+    group_values, group_ids = np.unique(group_codes, return_inverse=True)
+    group_count = len(group_values)
+
+    # undo the mixed radix encoding to find each group's key values
+    value_codes_by_name = {}
+    for key_name in reversed(key_names):
+        values, _ = factorized_keys[key_name]
+        value_codes_by_name[key_name] = group_values % len(values)
+        group_values = group_values // len(values)
+    labels = [{key_name: str(factorized_keys[key_name][0][value_codes_by_name[key_name][index]])
+               for key_name in key_names} for index in range(group_count)]
+    return group_ids.reshape(-1), labels
+
+
+def _get_key_names(group_by: Sequence[str], bucket: str) -> List[str]:
+    unknown_keys = [key_name for key_name in group_by if key_name not in GROUP_COLUMNS]
+    if unknown_keys:
+        raise ValueError("Can't group by {}, expected any of {}".format(unknown_keys, GROUP_COLUMNS))
+    return list(group_by) + (["bucket"] if bucket != "all" else [])
+
+
+# Per group percentiles of a value, interpolated the same way as np.percentile, for all groups at once
+def _grouped_percentiles(group_ids: np.ndarray, values: np.ndarray, group_count: int,
+                         percentiles: Sequence[float]) -> tuple:
+    # sort by value, then stably by group. Much faster than np.lexsort, as a stable sort of 16 bit ints is a radix sort.
+    order = np.argsort(values)
+    group_dtype = np.int16 if group_count < 2 ** 15 else np.int64
+    sorted_values = values[order[np.argsort(group_ids[order].astype(group_dtype), kind="stable")]]
+    counts = np.bincount(group_ids, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    values_by_percentile = {}
+    for percentile in percentiles:
+        positions = starts + percentile / 100.0 * (counts - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        values_by_percentile[percentile] = sorted_values[lower] + \
+            (sorted_values[upper] - sorted_values[lower]) * (positions - lower)
+    return counts, values_by_percentile
+
+
+# Lead time percentiles in days for each stage, grouped by app_name and/or ticket_type and, unless bucket is "all",
+# by the day, week or month the ticket was deployed in
+def get_lead_time_percentiles(dataset: DeploymentDataset, group_by: Sequence[str] = ("app_name",),
+                              bucket: str = "all", percentiles: Sequence[float] = (50, 85, 95)) -> List[dict]:
+    key_names = _get_key_names(group_by, bucket)
+    factorized_keys = {"ticket_type": _factorize(dataset.ticket_types)}
+    # app and bucket come from the deployment, so factorize the far fewer deployment rows and index into them
+    for key_name, deployment_column in [("app_name", dataset.deployment_apps),
+                                        ("bucket", to_buckets(dataset.deployment_deployed, bucket))]:
+        values, deployment_codes = _factorize(deployment_column)
+        factorized_keys[key_name] = (values, deployment_codes[dataset.ticket_deployment_index])
+    rows = []
+    for stage, start_column, end_column in LEAD_TIME_STAGES:
+        lead_days = (dataset.get_ticket_instants(end_column) - dataset.get_ticket_instants(start_column)) \
+            / SECONDS_PER_DAY
+        has_value = ~np.isnan(lead_days)
+        if not has_value.any():
+            continue
+        group_ids, labels = _group(factorized_keys, key_names, has_value)
+        counts, values_by_percentile = _grouped_percentiles(group_ids, lead_days[has_value], len(labels),
+                                                            percentiles)
+        for index, label in enumerate(labels):
+            row = dict(label, stage=stage, tickets=int(counts[index]))
+            row.update({"p{:g}_days".format(percentile): round(float(values[index]), 3)
+                        for percentile, values in values_by_percentile.items()})
+            rows.append(row)
+    return rows
+
+
+# Deployments, failed deployments (ones with at least one caused_by ticket) and deploy frequency per group. Ticket
+# type isn't a property of a deployment, so these can only be grouped by app_name and bucket.
+def get_deployment_rates(dataset: DeploymentDataset, group_by: Sequence[str] = ("app_name",),
+                         bucket: str = "week") -> List[dict]:
+    if "ticket_type" in group_by:
+        raise ValueError("Deployment rates can't be grouped by ticket_type")
+    deployment_count = len(dataset.deployment_ids)
+    if deployment_count == 0:
+        return []
+    key_names = _get_key_names(group_by, bucket)
+    bucket_starts = to_buckets(dataset.deployment_deployed, bucket)
+    factorized_keys = {"app_name": _factorize(dataset.deployment_apps), "bucket": _factorize(bucket_starts)}
+    group_ids, labels = _group(factorized_keys, key_names, np.ones(deployment_count, dtype=bool))
+
+    ticket_failures = dataset.ticket_is_failure.astype(np.float64)
+    is_failed = np.bincount(dataset.ticket_deployment_index, weights=ticket_failures, minlength=deployment_count) > 0
+    deployments = np.bincount(group_ids, minlength=len(labels))
+    failed_deployments = np.bincount(group_ids, weights=is_failed, minlength=len(labels))
+    failure_tickets = np.bincount(group_ids[dataset.ticket_deployment_index], weights=ticket_failures,
+                                  minlength=len(labels))
+    span_days = _get_span_days(group_ids, len(labels), dataset.deployment_deployed, bucket, bucket_starts)
+
+    return [dict(label, deployments=int(deployments[index]), failed_deployments=int(failed_deployments[index]),
+                 failure_tickets=int(failure_tickets[index]),
+                 change_failure_rate=round(float(failed_deployments[index] / deployments[index]), 4),
+                 deployments_per_day=round(float(deployments[index] / span_days[index]), 4))
+            for index, label in enumerate(labels)]
+
+
+# Days each group covers: the bucket's length, or from its first to last deployment (at least a day) without buckets
+def _get_span_days(group_ids: np.ndarray, group_count: int, deployed: np.ndarray, bucket: str,
+                   bucket_starts: np.ndarray) -> np.ndarray:
+    if bucket == "all":
+        first = np.full(group_count, np.inf)
+        last = np.full(group_count, -np.inf)
+        np.minimum.at(first, group_ids, deployed)
+        np.maximum.at(last, group_ids, deployed)
+        return np.maximum((last - first) / SECONDS_PER_DAY, 1.0)
+    first_rows = np.unique(group_ids, return_index=True)[1]
+    bucket_ends = {"day": bucket_starts + 1, "week": bucket_starts + 7,
+                   "month": (bucket_starts.astype("datetime64[M]") + 1).astype("datetime64[D]")}[bucket]
+    return (bucket_ends - bucket_starts)[first_rows].astype(np.float64)
+
+
+def write_rows(rows: List[dict], output_format: str) -> None:
+    if output_format == "json":
+        json.dump(rows, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    writer = csv.DictWriter(sys.stdout, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    from devops_metrics_repository import DevopsMetricsRepository
+
+    parser = argparse.ArgumentParser(description="Lead time and change failure analytics over stored deployments")
+    parser.add_argument("report", choices=["lead_time", "deployment_rates"])
+    parser.add_argument("--group_by", nargs="*", choices=GROUP_COLUMNS, default=["app_name"])
+    parser.add_argument("--bucket", choices=BUCKETS, default="all",
+                        help="Also group by the day, week or month of the deployed instant.")
+    parser.add_argument("--percentiles", nargs="+", type=float, default=[50, 85, 95])
+    parser.add_argument("--since", help="Only deployments at or after this ISO date.")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("INFO")
+
+    load_dotenv()
+    metrics_repo = DevopsMetricsRepository(outer_logger)
+    since = datetime.fromisoformat(args.since) if args.since else None
+    deployment_dataset = DeploymentDataset.from_rows(metrics_repo.get_deployment_rows(since),
+                                                     metrics_repo.get_deployed_ticket_rows(since))
+    metrics_repo.close()
+    outer_logger.info("Loaded {} deployments with {} tickets".format(len(deployment_dataset.deployment_ids),
+                                                                    len(deployment_dataset.ticket_types)))
+
+    if args.report == "lead_time":
+        report_rows = get_lead_time_percentiles(deployment_dataset, args.group_by, args.bucket, args.percentiles)
+    else:
+        report_rows = get_deployment_rates(deployment_dataset, args.group_by, args.bucket)
+    write_rows(report_rows, args.format)
@@ -0,0 +1,109 @@
+import argparse
+import csv
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from devops_metrics import process_deployment
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_repository import DevopsMetricsRepository
+from devops_metrics_service import DevopsMetricsService
+from devops_metrics_tag_index import TagIndex
+from typing import List
+
+DEPLOYMENT_FIELDS = ["project_name", "project_version", "deployed_instant", "deployed_by_user_id"]
+
+
+# Processes many deployments in one process so the HTTP sessions, Jira client, commit/tag caches and DB pool are
+# shared between them instead of being rebuilt for every deployment.
+class DevopsMetricsBatch:
+    def __init__(self, logger: logging.Logger, metrics_repo: DevopsMetricsRepository,
+                 metrics_service: DevopsMetricsService, workers: int = 1, progress_interval_seconds: float = 30) -> None:
+        self.logger = logger
+        self.metrics_repo = metrics_repo
+        self.metrics_service = metrics_service
+        self.workers = workers
+        self.progress_interval_seconds = progress_interval_seconds
+
+    def run(self, deployments: List[dict]) -> dict:
+        summary = {"total": len(deployments), "inserted": 0, "skipped": 0, "failed": 0}
+        start = time.monotonic()
+        last_report = start
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = {executor.submit(self._process, deployment): deployment for deployment in deployments}
+            for future in as_completed(futures):
+                deployment = futures[future]
+                try:
+                    summary["inserted" if future.result() else "skipped"] += 1
+                # the service exits on unrecoverable API errors, which shouldn't end the rest of the batch
+                except (Exception, SystemExit) as error:
+                    summary["failed"] += 1
+                    self.logger.error("Failed processing deployment app={} version={} error={!r}"
+                                      .format(deployment["project_name"], deployment["project_version"], error))
+
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval_seconds:
+                    last_report = now
+                    self._log_progress(summary, now - start)
+
+        summary["elapsed_seconds"] = time.monotonic() - start
+        self._log_progress(summary, summary["elapsed_seconds"])
+        return summary
+
+    def _process(self, deployment: dict) -> bool:
+        return process_deployment(self.logger, self.metrics_repo, self.metrics_service, deployment["project_name"],
+                                  deployment["project_version"], deployment["deployed_instant"],
+                                  deployment["deployed_by_user_id"])
+
+    def _log_progress(self, summary: dict, elapsed_seconds: float) -> None:
+        done = summary["inserted"] + summary["skipped"] + summary["failed"]
+        per_minute = done / elapsed_seconds * 60 if elapsed_seconds > 0 else 0.0
+        self.logger.info("Processed {}/{} deployments inserted={} skipped={} failed={} deployments_per_minute={:.1f}"
+                         .format(done, summary["total"], summary["inserted"], summary["skipped"], summary["failed"],
+                                 per_minute))
+
+
+# Reads a CSV with a header row, or JSONL when the file ends in .jsonl, with the same four fields as the
+# devops_metrics.py arguments
+def read_deployments(batch_file: str) -> List[dict]:
+    with open(batch_file, newline="") as file:
+        if batch_file.endswith(".jsonl"):
+            deployments = [json.loads(line) for line in file if line.strip()]
+        else:
+            deployments = list(csv.DictReader(file))
+
+    for line_number, deployment in enumerate(deployments, start=1):
+        missing_fields = [field for field in DEPLOYMENT_FIELDS if not deployment.get(field)]
+        if missing_fields:
+            raise ValueError("Deployment {} in {} is missing {}".format(line_number, batch_file, missing_fields))
+    return deployments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store devops metrics for a batch of deployments")
+    parser.add_argument("--batch_file", help="CSV (with header) or JSONL file of deployments with project_name, "
+                                             "project_version, deployed_instant and deployed_by_user_id.",
+                        required=True)
+    parser.add_argument("--workers", help="How many deployments to process at once.", type=int, default=1)
+    parser.add_argument("--progress_interval_seconds", help="How often to log progress.", type=float, default=30)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("DEBUG")
+
+    load_dotenv()
+    batch_metrics_repo = DevopsMetricsRepository(outer_logger)
+    batch_metrics_repo.max_connections = max(batch_metrics_repo.max_connections, args.workers)
+    batch_metrics_service = DevopsMetricsService()
+    batch_metrics_service.cache_tags_in_memory = True
+    if batch_metrics_service.commit_store is None:
+        # without an on-disk cache, still share commits between the deployments of this batch
+        batch_metrics_service.commit_store = CommitStore(outer_logger, ":memory:")
+        batch_metrics_service.tag_index = TagIndex(outer_logger, ":memory:")
+
+    DevopsMetricsBatch(outer_logger, batch_metrics_repo, batch_metrics_service, args.workers,
+                       args.progress_interval_seconds).run(read_deployments(args.batch_file))
+    batch_metrics_repo.close()
@@ -0,0 +1,285 @@
+import json
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from devops_metrics_http_cache import CachedResponse, HttpCache
+from devops_metrics_instrumentation import Instrumentation
+
+
+# Refills continuously at rate_per_second up to capacity; acquire() blocks until a token is available
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_second)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait_seconds = (1 - self._tokens) / self.rate_per_second
+            self._sleep(wait_seconds)
+            waited += wait_seconds
+
+
+# A TokenBucket whose tokens are kept in a SQLite db, so every process using the same db (Rundeck runs, batch and
+# recompute workers, the daemon) draws from one budget instead of each getting its own. Refills against the wall
+# clock, since the processes don't share a monotonic one.
+class SharedTokenBucket(TokenBucket):
+    def __init__(self, db_path: str, name: str, rate_per_second: float, capacity: float,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep) -> None:
+        super().__init__(rate_per_second, capacity, clock, sleep)
+        self.name = name
+        # autocommit, each acquire runs its own BEGIN IMMEDIATE so the read and update are atomic across processes
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        with self._lock:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS rate_limit_bucket
+                                     (name TEXT PRIMARY KEY, tokens REAL NOT NULL, last_refill REAL NOT NULL)""")
+
+    def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._connection.execute("BEGIN IMMEDIATE")
+                try:
+                    now = self._clock()
+                    row = self._connection.execute("SELECT tokens, last_refill FROM rate_limit_bucket WHERE name=?",
+                                                   (self.name,)).fetchone()
+                    tokens = self.capacity if row is None else \
+                        min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate_per_second)
+                    wait_seconds = 0.0 if tokens >= 1 else (1 - tokens) / self.rate_per_second
+                    if tokens >= 1:
+                        tokens -= 1
+                    self._connection.execute("INSERT OR REPLACE INTO rate_limit_bucket (name, tokens, last_refill) "
+                                             "VALUES(?, ?, ?)", (self.name, tokens, now))
+                    self._connection.execute("COMMIT")
+                except BaseException:
+                    self._connection.execute("ROLLBACK")
+                    raise
+            if wait_seconds == 0.0:
+                return waited
+            self._sleep(wait_seconds)
+            waited += wait_seconds
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+# Shared HTTP layer for Bitbucket: one keep-alive session, bounded concurrency per host, a rate limit that keeps
+# requests under the hourly API quota, and retries with jittered exponential backoff on 429/5xx, connection
+# errors and timeouts. timeout is the (connect, read) timeout of each request, so a stalled connection is retried
+# instead of hanging. With an http_cache, responses that carry an ETag or Last-Modified are stored and later
+# requested conditionally; a 304 is handed back as the stored 200 response. The rate limit is per process unless a
+# rate_limiter shared between processes, such as a SharedTokenBucket, is given.
+class BitbucketClient:
+    retry_status_codes = {429, 500, 502, 503, 504}
+
+    def __init__(self, logger: logging.Logger, auth_header: dict, max_requests_per_host: int = 4,
+                 requests_per_hour: int = 900, burst_size: int = 30, max_retries: int = 5,
+                 backoff_base_seconds: float = 1.0, backoff_max_seconds: float = 60.0,
+                 sleep: Callable[[float], None] = time.sleep, instrumentation: Instrumentation = None,
+                 http_cache: HttpCache = None, timeout: Tuple[float, float] = (10.0, 60.0),
+                 rate_limiter: TokenBucket = None) -> None:
+        self.logger = logger
+        self.timeout = timeout
+        self.instrumentation = instrumentation or Instrumentation()
+        self.http_cache = http_cache
+        self.max_requests_per_host = max_requests_per_host
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._sleep = sleep
+        self.rate_limiter = rate_limiter or TokenBucket(requests_per_hour / 3600.0, burst_size, sleep=sleep)
+
+        self.session = requests.Session()
+        self.session.headers.update(auth_header)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_requests_per_host)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "bytes": 0, "retries": 0, "rate_limited_seconds": 0.0}
+
+    def get(self, url: str) -> requests.Response:
+        host = urlparse(url).netloc
+        cached_response = self.http_cache.get(url) if self.http_cache is not None else None
+        headers = cached_response.get_conditional_headers() if cached_response is not None else None
+        attempt = 0
+        while True:
+            rate_limited_seconds = self.rate_limiter.acquire()
+            self._add_stat("rate_limited_seconds", rate_limited_seconds)
+            self.instrumentation.record_time("http_rate_limited", rate_limited_seconds, host=host)
+            response = None
+            try:
+                with self._get_host_semaphore(host), self.instrumentation.timer("http_request", host=host):
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+                self._add_stat("requests", 1)
+                self._add_stat("bytes", len(response.content))
+                self.instrumentation.increment("http_requests", host=host)
+                self.instrumentation.increment("http_bytes", len(response.content), host=host)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt >= self.max_retries:
+                    raise
+                self.logger.warning("Connection error or timeout calling={} error={}".format(url, error))
+
+            if response is not None and (response.status_code not in self.retry_status_codes
+                                         or attempt >= self.max_retries):
+                return self._apply_http_cache(url, host, response, cached_response)
+
+            attempt += 1
+            delay = self._get_retry_delay(response, attempt)
+            self.logger.warning("Retrying call={} attempt={} in {:.1f}s status={}"
+                                .format(url, attempt, delay, response.status_code if response is not None else None))
+            self._add_stat("retries", 1)
+            self.instrumentation.increment("http_retries", host=host)
+            self._sleep(delay)
+
+    def _apply_http_cache(self, url: str, host: str, response: requests.Response,
+                          cached_response: Optional[CachedResponse]) -> requests.Response:
+        if self.http_cache is None:
+            return response
+        if response.status_code == 304 and cached_response is not None:
+            self.http_cache.record_hit(cached_response)
+            self.instrumentation.increment("http_cache_hits", host=host)
+            response.status_code = 200
+            response._content = cached_response.body
+            response.cached_response = cached_response
+        elif response.status_code == 200:
+            self.instrumentation.increment("http_cache_misses", host=host)
+            response.cached_response = self.http_cache.put(url, response.headers.get("ETag"),
+                                                           response.headers.get("Last-Modified"), response.content)
+        return response
+
+    # Yields the "values" of every page of a Bitbucket paginated endpoint, following "next" links. With
+    # prefetch_pages > 0 a background thread fetches up to that many pages ahead while the caller works through the
+    # current one. Closing the generator early stops the prefetch. check_response is called with any failed response
+    # before iteration ends, on_page once per page as it is handed to the caller.
+    def iter_paginated(self, url: str, check_response: Callable[[requests.Response], None],
+                       prefetch_pages: int = 1, on_page: Callable[[dict], None] = None) -> Iterator[dict]:
+        if prefetch_pages <= 0:
+            pages = self._iter_pages(url)
+        else:
+            pages = self._iter_prefetched_pages(url, prefetch_pages)
+
+        try:
+            for page in pages:
+                if isinstance(page, requests.Response):
+                    check_response(page)
+                    return
+                self.instrumentation.increment("http_pages", host=urlparse(url).netloc)
+                if on_page is not None:
+                    on_page(page)
+                yield from page["values"]
+        finally:
+            pages.close()
+
+    def _iter_pages(self, url: str, stop_event: threading.Event = None) -> Iterator[any]:
+        while url is not None and (stop_event is None or not stop_event.is_set()):
+            self.logger.info("requesting page at {}".format(url))
+            response = self.get(url)
+            if response.status_code >= 400:
+                yield response
+                return
+            cached_response = getattr(response, "cached_response", None)
+            page = cached_response.get_page() if cached_response is not None else json.loads(response.content)
+            yield page
+            url = page.get("next", None)
+
+    def _iter_prefetched_pages(self, url: str, prefetch_pages: int) -> Iterator[any]:
+        buffered_pages = queue.Queue(maxsize=prefetch_pages)
+        stop_event = threading.Event()
+        end_of_pages = object()
+
+        def fetch_pages() -> None:
+            try:
+                for page in self._iter_pages(url, stop_event):
+                    if not self._put_until_stopped(buffered_pages, page, stop_event):
+                        return
+            except BaseException as error:
+                self._put_until_stopped(buffered_pages, error, stop_event)
+                return
+            self._put_until_stopped(buffered_pages, end_of_pages, stop_event)
+
+        fetcher = threading.Thread(target=fetch_pages, name="bitbucket-prefetch", daemon=True)
+        fetcher.start()
+        try:
+            while True:
+                page = buffered_pages.get()
+                if page is end_of_pages:
+                    return
+                if isinstance(page, BaseException):
+                    raise page
+                yield page
+        finally:
+            stop_event.set()
+            # unblock the fetcher if it is waiting for room in the buffer
+            while not buffered_pages.empty():
+                buffered_pages.get_nowait()
+
+    def _put_until_stopped(self, buffered_pages: queue.Queue, item: any, stop_event: threading.Event) -> bool:
+        while not stop_event.is_set():
+            try:
+                buffered_pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _get_retry_delay(self, response: Optional[requests.Response], attempt: int) -> float:
+        retry_after = self._parse_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max_seconds)
+        # "full jitter" so concurrent scans that failed together don't retry together
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1)))
+
+    def _parse_retry_after(self, response: requests.Response) -> Optional[float]:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is None:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+
+    def _get_host_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_requests_per_host)
+            return self._host_semaphores[host]
+
+    def _add_stat(self, name: str, amount: float) -> None:
+        with self._lock:
+            self.stats[name] += amount
@@ -0,0 +1,76 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import urllib.error
+import urllib.request
+from dotenv import load_dotenv
+
+EXIT_CODES = {"inserted": 0, "skipped": 0, "completed": 0, "failed": 1}
+
+
+# Sends a deployment to devops_metrics_daemon.py. Returns the daemon's result, or None when the daemon isn't
+# running or is too busy to take it, in which case the caller processes the deployment locally. Only the standard
+# library is imported here so handing a deployment to the daemon stays cheap.
+def send_deployment(logger: logging.Logger, daemon_url: str, deployment: dict, timeout_seconds: float) -> str:
+    request = urllib.request.Request(daemon_url.rstrip("/") + "/deployments", data=json.dumps(deployment).encode(),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout_seconds) as response:
+            return json.loads(response.read())["result"]
+    except urllib.error.HTTPError as error:
+        if error.code == 503:
+            logger.warning("Daemon at {} is busy, processing the deployment locally".format(daemon_url))
+            return None
+        logger.error("Daemon at {} rejected the deployment status={} body={}"
+                     .format(daemon_url, error.code, error.read().decode(errors="replace")))
+        return "failed"
+    except urllib.error.URLError as error:
+        # the deployment may already be running in the daemon once it accepted the connection, so only fall back
+        # when it couldn't be reached at all
+        if isinstance(error.reason, ConnectionError):
+            logger.warning("Daemon at {} is not reachable, processing the deployment locally. error={}"
+                           .format(daemon_url, error.reason))
+            return None
+        logger.error("Failed sending deployment to daemon at {} error={}".format(daemon_url, error.reason))
+        return "failed"
+    except TimeoutError:
+        logger.error("Daemon at {} did not finish the deployment within {} seconds"
+                     .format(daemon_url, timeout_seconds))
+        return "failed"
+
+
+# main exits with a non-zero status itself when the deployment fails
+def run_locally(logger: logging.Logger, deployment: dict) -> str:
+    from devops_metrics import main
+    main(logger, deployment["project_name"], deployment["project_version"], deployment["deployed_instant"],
+         deployment["deployed_by_user_id"])
+    return "completed"
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    # same contract as devops_metrics.py so Rundeck jobs only need to change the script name
+    parser = argparse.ArgumentParser(description="Store devops metrics through the devops metrics daemon")
+    parser.add_argument("--project_name", help="The name of the project that was just deployed. "
+                                               "The git repo name is preferred.", required=True)
+    parser.add_argument("--project_version", help="The version of the project that was just deployed.", required=True)
+    parser.add_argument("--deployed_instant", help="The instant the project was deployed.", required=True)
+    parser.add_argument("--deployed_by_user_id", help="The id of the user who triggered the deploy.", required=True)
+    parser.add_argument("--daemon_url", default=os.getenv("daemon_url", "http://127.0.0.1:8765"))
+    parser.add_argument("--timeout_seconds", type=float, default=float(os.getenv("daemon_timeout_seconds", "1800")),
+                        help="How long to wait for the daemon to finish the deployment.")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("DEBUG")
+
+    outer_deployment = {"project_name": args.project_name, "project_version": args.project_version,
+                        "deployed_instant": args.deployed_instant, "deployed_by_user_id": args.deployed_by_user_id}
+    result = send_deployment(outer_logger, args.daemon_url, outer_deployment, args.timeout_seconds)
+    if result is None:
+        result = run_locally(outer_logger, outer_deployment)
+    outer_logger.info("Deployment result={}".format(result))
+    sys.exit(EXIT_CODES.get(result, 1))
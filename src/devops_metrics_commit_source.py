@@ -0,0 +1,168 @@
+import logging
+import os
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from devops_metrics_bitbucket_client import BitbucketClient
+from devops_metrics_info import CommitRecord, parse_author_email, parse_timestamp
+from typing import Callable, Iterator
+
+import requests
+
+
+# Where the service reads commit history and tags from. Commits are yielded newest first from a revision, tags
+# newest first as dicts shaped like Bitbucket's ({"name", "target": {"hash", "date"}}).
+class CommitSource(ABC):
+    @abstractmethod
+    def iter_commits(self, repository: str, revision: str, scan_stats: dict = None) -> Iterator[CommitRecord]:
+        pass
+
+    # Commits reachable from include_hash but not from exclude_hash, newest first
+    @abstractmethod
+    def iter_commit_range(self, repository: str, include_hash: str, exclude_hash: str,
+                          scan_stats: dict = None) -> Iterator[CommitRecord]:
+        pass
+
+    @abstractmethod
+    def iter_tags(self, repository: str, prefetch: bool = True) -> Iterator[dict]:
+        pass
+
+
+class BitbucketCommitSource(CommitSource):
+    commit_fields = "pagelen,values.message,values.date,values.author.raw,values.hash,next"
+    # the most the commits endpoint returns per page
+    max_pagelen = 100
+
+    def __init__(self, logger: logging.Logger, bitbucket_client: BitbucketClient,
+                 check_response: Callable[[requests.Response], None], prefetch_pages: int = 1,
+                 api_url: str = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations") -> None:
+        self.logger = logger
+        self.api_url = api_url
+        self.bitbucket_client = bitbucket_client
+        self.check_response = check_response
+        self.prefetch_pages = prefetch_pages
+
+    def iter_commits(self, repository: str, revision: str, scan_stats: dict = None) -> Iterator[CommitRecord]:
+        commits_url = "{}/{}/commits/{}?fields={}".format(self.api_url, repository, revision, self.commit_fields)
+        return self._iter_commit_pages(commits_url, scan_stats)
+
+    def iter_commit_range(self, repository: str, include_hash: str, exclude_hash: str,
+                          scan_stats: dict = None) -> Iterator[CommitRecord]:
+        commits_url = "{}/{}/commits?include={}&exclude={}&pagelen={}&fields={}".format(
+            self.api_url, repository, include_hash, exclude_hash, self.max_pagelen, self.commit_fields)
+        return self._iter_commit_pages(commits_url, scan_stats)
+
+    def _iter_commit_pages(self, commits_url: str, scan_stats: dict = None) -> Iterator[CommitRecord]:
+        def count_page(page: dict) -> None:
+            if scan_stats is not None:
+                scan_stats["pages_fetched"] += 1
+
+        commits = self.bitbucket_client.iter_paginated(commits_url, self.check_response, self.prefetch_pages,
+                                                       count_page)
+        try:
+            for commit in commits:
+                yield CommitRecord(commit["hash"], commit["message"], parse_timestamp(commit["date"]),
+                                   self._get_author_email(commit["author"]["raw"]))
+        finally:
+            commits.close()
+
+    # a walk that is resumed later shouldn't prefetch, or it would hold a thread while idle
+    def iter_tags(self, repository: str, prefetch: bool = True) -> Iterator[dict]:
+        tags_url = "{}/{}/refs/tags?fields=values.name,values.target.hash,values.target.date,next" \
+                   "&sort=-target.date".format(self.api_url, repository)
+        return self.bitbucket_client.iter_paginated(tags_url, self.check_response,
+                                                    self.prefetch_pages if prefetch else 0)
+
+    def _get_author_email(self, author_raw: str) -> str:
+        return parse_author_email(author_raw)
+
+
+# Reads bare mirrors (git clone --mirror) kept under mirror_dir as <repository>.git or <repository>. With
+# fetch_mirrors each mirror is updated with git fetch the first time it's read by this process. Revisions can be
+# anything git log accepts, including ranges like "1.0.1..master".
+class GitMirrorCommitSource(CommitSource):
+    record_separator = "\x1e"
+    field_separator = "\x1f"
+
+    def __init__(self, logger: logging.Logger, mirror_dir: str, fetch_mirrors: bool = True) -> None:
+        self.logger = logger
+        self.mirror_dir = mirror_dir
+        self.fetch_mirrors = fetch_mirrors
+        self._fetched_repositories = set()
+        self._lock = threading.Lock()
+
+    def iter_commits(self, repository: str, revision: str, scan_stats: dict = None) -> Iterator[CommitRecord]:
+        log_format = self.field_separator.join(["%H", "%aI", "%ae", "%B"]) + self.record_separator
+        process = subprocess.Popen(["git", "log", "--format=" + log_format, revision, "--"],
+                                   cwd=self._get_mirror_path(repository), stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, encoding="utf-8", errors="replace")
+        buffered = ""
+        try:
+            for chunk in iter(lambda: process.stdout.read(65536), ""):
+                records = (buffered + chunk).split(self.record_separator)
+                buffered = records.pop()
+                for record in records:
+                    yield self._to_commit_record(record)
+            process.wait()
+            if process.returncode != 0:
+                self.logger.error("Failure reading git log repo={} revision={} error={}"
+                                  .format(repository, revision, process.stderr.read().strip()))
+                exit(1)
+        finally:
+            # the caller stopped early, e.g. at the previous release
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+    def iter_commit_range(self, repository: str, include_hash: str, exclude_hash: str,
+                          scan_stats: dict = None) -> Iterator[CommitRecord]:
+        return self.iter_commits(repository, "{}..{}".format(exclude_hash, include_hash), scan_stats)
+
+    def iter_tags(self, repository: str, prefetch: bool = True) -> Iterator[dict]:
+        # the "*" fields are the tagged commit of annotated tags, empty for lightweight tags
+        ref_format = self.field_separator.join(["%(refname:strip=2)", "%(objectname)", "%(*objectname)",
+                                                "%(committerdate:iso-strict)", "%(*committerdate:iso-strict)"])
+        output = self._run_git(repository, ["for-each-ref", "--format=" + ref_format, "refs/tags"])
+        tags = []
+        for line in output.splitlines():
+            name, object_hash, tagged_hash, date, tagged_date = line.split(self.field_separator)
+            tags.append({"name": name, "target": {"hash": tagged_hash or object_hash, "date": tagged_date or date}})
+        # newest tagged commit first, the same order as Bitbucket's sort=-target.date
+        tags.sort(key=lambda tag: parse_timestamp(tag["target"]["date"]), reverse=True)
+        yield from tags
+
+    def _to_commit_record(self, record: str) -> CommitRecord:
+        commit_hash, date, author_email, message = record.lstrip("\n").split(self.field_separator, 3)
+        return CommitRecord(commit_hash, message, parse_timestamp(date), author_email)
+
+    def _run_git(self, repository: str, arguments: list) -> str:
+        mirror_path = self._get_mirror_path(repository)
+        result = subprocess.run(["git"] + arguments, cwd=mirror_path, capture_output=True, text=True)
+        if result.returncode != 0:
+            self.logger.error("Failure calling git {} repo={} error={}"
+                              .format(arguments[0], repository, result.stderr.strip()))
+            exit(1)
+        return result.stdout
+
+    def _get_mirror_path(self, repository: str) -> str:
+        mirror_path = os.path.join(self.mirror_dir, repository + ".git")
+        if not os.path.isdir(mirror_path):
+            mirror_path = os.path.join(self.mirror_dir, repository)
+        if not os.path.isdir(mirror_path):
+            self.logger.error("No git mirror for repo={} in {}, create one with git clone --mirror"
+                              .format(repository, self.mirror_dir))
+            exit(1)
+
+        with self._lock:
+            should_fetch = self.fetch_mirrors and repository not in self._fetched_repositories
+            self._fetched_repositories.add(repository)
+        if should_fetch:
+            self.logger.info("Fetching git mirror for repo={}".format(repository))
+            result = subprocess.run(["git", "fetch", "--prune", "--quiet"], cwd=mirror_path, capture_output=True,
+                                    text=True)
+            if result.returncode != 0:
+                self.logger.warning("Failed fetching git mirror repo={} error={}, reading it as is"
+                                    .format(repository, result.stderr.strip()))
+        return mirror_path
@@ -0,0 +1,218 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from devops_metrics_info import CommitRecord
+from typing import Iterator, List, Optional
+
+import pytz
+
+
+# Local copy of the master history of each repo, kept as one contiguous run of commits from the newest cached
+# commit (head) back to the oldest (tail). "ordinal" grows towards the tip so the store can be read newest first.
+# Newer commits from a scan that stopped before it reached the head are kept apart as a segment, joined onto the head
+# once a later scan pages the gap between them.
+class CommitStore:
+    read_batch_size = 500
+
+    def __init__(self, logger: logging.Logger, db_path: str) -> None:
+        self.logger = logger
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS commit_info
+                                    (repository TEXT NOT NULL, hash TEXT NOT NULL, ordinal INTEGER NOT NULL,
+                                    message TEXT NOT NULL, date TEXT NOT NULL, date_epoch REAL NOT NULL,
+                                    author_email TEXT NOT NULL, PRIMARY KEY (repository, hash))""")
+            self._connection.execute("""CREATE INDEX IF NOT EXISTS commit_info_repository_ordinal
+                                    ON commit_info (repository, ordinal)""")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS commit_segment
+                                    (repository TEXT NOT NULL, hash TEXT NOT NULL, ordinal INTEGER NOT NULL,
+                                    message TEXT NOT NULL, date TEXT NOT NULL, date_epoch REAL NOT NULL,
+                                    author_email TEXT NOT NULL, PRIMARY KEY (repository, hash))""")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS commit_history_state
+                                    (repository TEXT PRIMARY KEY, reached_root INTEGER NOT NULL)""")
+
+    def get_head(self, repository: str) -> Optional[str]:
+        return self._get_edge_hash(repository, "DESC")
+
+    def get_tail(self, repository: str) -> Optional[str]:
+        return self._get_edge_hash(repository, "ASC")
+
+    def _get_edge_hash(self, repository: str, order: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT hash FROM commit_info WHERE repository=? ORDER BY ordinal {} LIMIT 1"
+                                           .format(order), (repository,)).fetchone()
+        return row[0] if row is not None else None
+
+    def has_reached_root(self, repository: str) -> bool:
+        with self._lock:
+            row = self._connection.execute("SELECT reached_root FROM commit_history_state WHERE repository=?",
+                                           (repository,)).fetchone()
+        return row is not None and row[0] == 1
+
+    # reads newest first, starting at start_hash when given
+    def iter_commits(self, repository: str, start_hash: str = None) -> Iterator[CommitRecord]:
+        with self._lock:
+            if start_hash is None:
+                row = self._connection.execute("SELECT MAX(ordinal) FROM commit_info WHERE repository=?",
+                                               (repository,)).fetchone()
+            else:
+                row = self._connection.execute("SELECT ordinal FROM commit_info WHERE repository=? AND hash=?",
+                                               (repository, start_hash)).fetchone()
+        if row is None or row[0] is None:
+            return
+
+        next_ordinal = row[0]
+        while True:
+            with self._lock:
+                rows = self._connection.execute("""SELECT hash, message, date, author_email, ordinal FROM commit_info
+                                                WHERE repository=? AND ordinal<=? ORDER BY ordinal DESC LIMIT ?""",
+                                                (repository, next_ordinal, self.read_batch_size)).fetchall()
+            if len(rows) == 0:
+                return
+            for commit_hash, message, date, author_email, ordinal in rows:
+                yield CommitRecord(commit_hash, message, datetime.fromisoformat(date), author_email)
+            next_ordinal = rows[-1][4] - 1
+
+    # commits are given newest first and must lead directly into the current head
+    def add_newer_commits(self, repository: str, commits: List[CommitRecord]) -> None:
+        if len(commits) == 0:
+            return
+        with self._lock, self._connection:
+            max_ordinal = self._connection.execute("SELECT MAX(ordinal) FROM commit_info WHERE repository=?",
+                                                   (repository,)).fetchone()[0] or 0
+            self._insert_commits(repository, commits, max_ordinal + len(commits))
+
+    # Same as add_newer_commits, but only when expected_head is still the newest cached commit, checked in the same
+    # transaction. Returns False without storing anything otherwise.
+    def add_newer_commits_if_head(self, repository: str, expected_head: str, commits: List[CommitRecord]) -> bool:
+        with self._lock, self._connection:
+            row = self._connection.execute("""SELECT hash, ordinal FROM commit_info WHERE repository=?
+                                           ORDER BY ordinal DESC LIMIT 1""", (repository,)).fetchone()
+            if row is None or row[0] != expected_head:
+                return False
+            self._insert_commits(repository, commits, row[1] + len(commits))
+        return True
+
+    # commits are given newest first and must follow directly after the current tail
+    def add_older_commits(self, repository: str, commits: List[CommitRecord], reached_root: bool = False) -> None:
+        with self._lock, self._connection:
+            min_ordinal = self._connection.execute("SELECT MIN(ordinal) FROM commit_info WHERE repository=?",
+                                                   (repository,)).fetchone()[0] or 0
+            self._insert_commits(repository, commits, min_ordinal - 1)
+            self._set_reached_root(repository, reached_root)
+
+    # commits are given newest first and become the whole cached history of the repo
+    def replace_commits(self, repository: str, commits: List[CommitRecord], reached_root: bool = False) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM commit_info WHERE repository=?", (repository,))
+            self._connection.execute("DELETE FROM commit_segment WHERE repository=?", (repository,))
+            self._insert_commits(repository, commits, len(commits))
+            self._set_reached_root(repository, reached_root)
+
+    def get_segment_head(self, repository: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("""SELECT hash FROM commit_segment WHERE repository=?
+                                           ORDER BY ordinal DESC LIMIT 1""", (repository,)).fetchone()
+        return row[0] if row is not None else None
+
+    # the segment is at most the commits of the scans that stopped short since the head was last joined
+    def get_segment(self, repository: str) -> List[CommitRecord]:
+        with self._lock:
+            rows = self._connection.execute("""SELECT hash, message, date, author_email FROM commit_segment
+                                            WHERE repository=? ORDER BY ordinal DESC""", (repository,)).fetchall()
+        return [CommitRecord(commit_hash, message, datetime.fromisoformat(date), author_email)
+                for commit_hash, message, date, author_email in rows]
+
+    # commits are given newest first and become the segment of the repo, not yet joined to the head
+    def replace_segment(self, repository: str, commits: List[CommitRecord]) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM commit_segment WHERE repository=?", (repository,))
+            self._insert_commits(repository, commits, len(commits), "commit_segment")
+
+    # commits are the segment and the gap after it, newest first, and must lead directly into expected_head. Like
+    # add_newer_commits_if_head, nothing is stored and False returned when expected_head is no longer the head.
+    def join_segment_if_head(self, repository: str, expected_head: str, commits: List[CommitRecord]) -> bool:
+        with self._lock, self._connection:
+            row = self._connection.execute("""SELECT hash, ordinal FROM commit_info WHERE repository=?
+                                           ORDER BY ordinal DESC LIMIT 1""", (repository,)).fetchone()
+            if row is None or row[0] != expected_head:
+                return False
+            self._insert_commits(repository, commits, row[1] + len(commits))
+            self._connection.execute("DELETE FROM commit_segment WHERE repository=?", (repository,))
+        return True
+
+    def _insert_commits(self, repository: str, commits: List[CommitRecord], first_ordinal: int,
+                        table: str = "commit_info") -> None:
+        self._connection.executemany("""INSERT OR REPLACE INTO {}
+                                     (repository, hash, ordinal, message, date, date_epoch, author_email)
+                                     VALUES(?, ?, ?, ?, ?, ?, ?)""".format(table),
+                                     [(repository, commit.hash, first_ordinal - index, commit.message,
+                                       commit.date.isoformat(), commit.date.timestamp(), commit.author_email)
+                                      for index, commit in enumerate(commits)])
+
+    def _set_reached_root(self, repository: str, reached_root: bool) -> None:
+        self._connection.execute("INSERT OR REPLACE INTO commit_history_state (repository, reached_root) VALUES(?, ?)",
+                                 (repository, 1 if reached_root else 0))
+
+    # Drops everything from the newest commit older than the cutoff down to the tail, so what remains is still one
+    # contiguous run of history. Keep max_age_days above the service's git_search_timeframe_in_months.
+    def evict_older_than(self, max_age_days: int) -> int:
+        cutoff_epoch = (datetime.now(pytz.utc) - timedelta(days=max_age_days)).timestamp()
+        with self._lock, self._connection:
+            expired_repositories = self._connection.execute("""SELECT DISTINCT repository FROM commit_info
+                                                            WHERE date_epoch<?""", (cutoff_epoch,)).fetchall()
+            cursor = self._connection.execute("""DELETE FROM commit_info WHERE ordinal <= (
+                                              SELECT MAX(expired.ordinal) FROM commit_info expired
+                                              WHERE expired.repository=commit_info.repository
+                                              AND expired.date_epoch<?)""", (cutoff_epoch,))
+            self._connection.executemany("UPDATE commit_history_state SET reached_root=0 WHERE repository=?",
+                                         expired_repositories)
+        self.logger.info("Evicted {} cached commits older than {} days".format(cursor.rowcount, max_age_days))
+        return cursor.rowcount
+
+    # The next scan of a rebuilt repo refetches its history from Bitbucket
+    def rebuild(self, repository: str = None) -> None:
+        with self._lock, self._connection:
+            if repository is None:
+                self._connection.execute("DELETE FROM commit_info")
+                self._connection.execute("DELETE FROM commit_segment")
+                self._connection.execute("DELETE FROM commit_history_state")
+            else:
+                self._connection.execute("DELETE FROM commit_info WHERE repository=?", (repository,))
+                self._connection.execute("DELETE FROM commit_segment WHERE repository=?", (repository,))
+                self._connection.execute("DELETE FROM commit_history_state WHERE repository=?", (repository,))
+        self.logger.info("Cleared cached commits for repository={}".format(repository or "all"))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    arg_parser = argparse.ArgumentParser(description="Maintain the local commit cache")
+    arg_parser.add_argument("--rebuild", action="store_true", help="Clear cached commits so they are refetched.")
+    arg_parser.add_argument("--repository", help="Limit --rebuild to a single repository.")
+    arg_parser.add_argument("--evict_older_than_days", type=int, help="Remove cached commits older than this.")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("INFO")
+
+    load_dotenv()
+    commit_store = CommitStore(outer_logger, os.environ["local_cache_db_path"])
+    if args.rebuild:
+        commit_store.rebuild(args.repository)
+    if args.evict_older_than_days is not None:
+        commit_store.evict_older_than(args.evict_older_than_days)
+    commit_store.close()
@@ -0,0 +1,200 @@
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from devops_metrics import process_deployment
+from devops_metrics_batch import DEPLOYMENT_FIELDS
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_instrumentation import Instrumentation
+from devops_metrics_push_ingest import PushIngester, is_valid_signature
+from devops_metrics_repository import DevopsMetricsRepository
+from devops_metrics_service import DevopsMetricsService
+from devops_metrics_tag_index import TagIndex
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+
+# Long-running process behind devops_metrics_client.py. Deployments are posted to a local HTTP endpoint and
+# processed with the same service and repository every time, so the Jira session, Bitbucket session, DB pool and
+# commit/tag caches stay warm between deploys. At most `workers` deployments run at once and at most
+# `max_queued` wait behind them; past that the daemon answers 503 and the client processes the deployment itself.
+# Bitbucket push webhooks posted to /push are stored in the service's commit store, see PushIngester. /push is only
+# enabled with a push_webhook_secret, as an unsigned push could put made up commits in the cache.
+class DevopsMetricsDaemon:
+    def __init__(self, logger: logging.Logger, metrics_repo: DevopsMetricsRepository,
+                 metrics_service: DevopsMetricsService, workers: int = 2, max_queued: int = 16,
+                 push_webhook_secret: str = None) -> None:
+        self.logger = logger
+        self.metrics_repo = metrics_repo
+        self.metrics_service = metrics_service
+        self.workers = max(1, workers)
+        self.push_ingester = PushIngester(logger, metrics_service.commit_store) \
+            if metrics_service.commit_store is not None and push_webhook_secret else None
+        self.push_webhook_secret = push_webhook_secret
+        if metrics_service.commit_store is not None and not push_webhook_secret:
+            self.logger.warning("No push_webhook_secret set, /push is disabled")
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="deployment")
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, max_queued))
+        self._lock = threading.Lock()
+        self._deployment_locks = {}
+
+    # Returns "inserted", "skipped", "failed" or "busy" when the queue is full
+    def submit(self, deployment: dict) -> str:
+        if not self._slots.acquire(blocking=False):
+            self.logger.warning("Deployment queue is full, rejecting app={} version={}"
+                                .format(deployment["project_name"], deployment["project_version"]))
+            return "busy"
+        try:
+            return self._executor.submit(self._process, deployment).result()
+        finally:
+            self._slots.release()
+
+    def _process(self, deployment: dict) -> str:
+        # Rundeck retries and duplicate triggers for the same version wait for the first one, which then makes them
+        # a cheap already-deployed check instead of a second scan
+        with self._hold_deployment_lock(deployment["project_name"], deployment["project_version"]):
+            try:
+                is_inserted = process_deployment(self.logger, self.metrics_repo, self.metrics_service,
+                                                 deployment["project_name"], deployment["project_version"],
+                                                 deployment["deployed_instant"], deployment["deployed_by_user_id"])
+                return "inserted" if is_inserted else "skipped"
+            # the service exits on unrecoverable API errors, which shouldn't take the daemon down with it
+            except (Exception, SystemExit) as error:
+                self.logger.error("Failed processing deployment app={} version={} error={!r}"
+                                  .format(deployment["project_name"], deployment["project_version"], error))
+                return "failed"
+
+    # The lock of a version is kept only while deployments of it run or wait, so a long-running daemon doesn't keep
+    # one for every version it ever served
+    @contextmanager
+    def _hold_deployment_lock(self, project_name: str, project_version: str) -> Iterator[None]:
+        key = (project_name, project_version)
+        with self._lock:
+            lock_and_holders = self._deployment_locks.setdefault(key, [threading.Lock(), 0])
+            lock_and_holders[1] += 1
+        try:
+            with lock_and_holders[0]:
+                yield
+        finally:
+            with self._lock:
+                lock_and_holders[1] -= 1
+                if lock_and_holders[1] == 0:
+                    del self._deployment_locks[key]
+
+    def create_server(self, host: str, port: int) -> ThreadingHTTPServer:
+        daemon = self
+
+        class DeploymentHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path == "/health":
+                    self._send(200, "application/json", json.dumps({"status": "ok"}))
+                elif self.path == "/metrics":
+                    self._send(200, "text/plain; version=0.0.4",
+                               daemon.metrics_service.instrumentation.to_prometheus())
+                else:
+                    self._send(404, "application/json", json.dumps({"error": "not found"}))
+
+            def do_POST(self) -> None:
+                if self.path not in ["/deployments", "/push"]:
+                    self._send(404, "application/json", json.dumps({"error": "not found"}))
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self._send(400, "application/json", json.dumps({"error": "body is not JSON"}))
+                    return
+                if self.path == "/push":
+                    self._ingest_push(body, payload)
+                else:
+                    self._submit_deployment(payload)
+
+            def _ingest_push(self, body: bytes, payload: dict) -> None:
+                if daemon.push_ingester is None:
+                    self._send(404, "application/json",
+                               json.dumps({"error": "no commit store or push webhook secret configured"}))
+                elif not is_valid_signature(daemon.push_webhook_secret, body, self.headers.get("X-Hub-Signature")):
+                    self._send(401, "application/json", json.dumps({"error": "bad signature"}))
+                else:
+                    try:
+                        summary = daemon.push_ingester.ingest(payload)
+                    except (AttributeError, KeyError, TypeError, ValueError) as error:
+                        self._send(400, "application/json",
+                                   json.dumps({"error": "bad push payload {!r}".format(error)}))
+                        return
+                    self._send(200, "application/json", json.dumps(summary))
+
+            def _submit_deployment(self, deployment: dict) -> None:
+                missing_fields = [field for field in DEPLOYMENT_FIELDS
+                                  if not isinstance(deployment, dict) or not deployment.get(field)]
+                if missing_fields:
+                    self._send(400, "application/json", json.dumps({"error": "missing {}".format(missing_fields)}))
+                    return
+
+                result = daemon.submit(deployment)
+                self._send(503 if result == "busy" else 200, "application/json", json.dumps({"result": result}))
+
+            def _send(self, status: int, content_type: str, body: str) -> None:
+                content = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, message_format: str, *args) -> None:
+                daemon.logger.debug("{} {}".format(self.address_string(), message_format % args))
+
+        server = ThreadingHTTPServer((host, port), DeploymentHandler)
+        server.daemon_threads = True
+        return server
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.metrics_repo.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve devops metrics deployments from a long-running process")
+    parser.add_argument("--host", default=os.getenv("daemon_host", "127.0.0.1"),
+                        help="Address to listen on, keep it local as requests are not authenticated.")
+    parser.add_argument("--port", type=int, default=int(os.getenv("daemon_port", "8765")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("daemon_workers", "2")),
+                        help="How many deployments to process at once.")
+    parser.add_argument("--max_queued", type=int, default=int(os.getenv("daemon_max_queued_deployments", "16")),
+                        help="How many deployments may wait for a worker before new ones are rejected.")
+    parser.add_argument("--push_webhook_secret", default=os.getenv("push_webhook_secret"),
+                        help="Secret of the Bitbucket push webhook, /push is disabled without it.")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("DEBUG")
+
+    instrumentation = Instrumentation()
+    daemon_metrics_repo = DevopsMetricsRepository(outer_logger, instrumentation)
+    daemon_metrics_repo.max_connections = max(daemon_metrics_repo.max_connections, args.workers)
+    daemon_metrics_service = DevopsMetricsService(instrumentation)
+    # cache_tags_in_memory stays off, the in-memory tag walk never sees tags pushed after it started. The tag index
+    # only pages tags newer than the last one it saw, so it stays current at the cost of one request per deploy.
+    if daemon_metrics_service.commit_store is None:
+        # without an on-disk cache, still share commits between the deployments this daemon serves
+        daemon_metrics_service.commit_store = CommitStore(outer_logger, ":memory:")
+        daemon_metrics_service.tag_index = TagIndex(outer_logger, ":memory:")
+
+    metrics_daemon = DevopsMetricsDaemon(outer_logger, daemon_metrics_repo, daemon_metrics_service, args.workers,
+                                         args.max_queued, args.push_webhook_secret)
+    http_server = metrics_daemon.create_server(args.host, args.port)
+    outer_logger.info("Listening for deployments on {}:{}".format(*http_server.server_address))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        metrics_daemon.close()
@@ -0,0 +1,144 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+# A stored response body and the validators to revalidate it with. The decoded JSON is kept with the entry once
+# read, so a 304 is answered without parsing the body again.
+class CachedResponse:
+    __slots__ = ("url", "etag", "last_modified", "body", "_page")
+
+    def __init__(self, url: str, etag: Optional[str], last_modified: Optional[str], body: bytes) -> None:
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+        self._page = None
+
+    def get_conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def get_page(self) -> any:
+        if self._page is None:
+            self._page = json.loads(self.body)
+        return self._page
+
+
+# On-disk cache of GET responses that came with an ETag or Last-Modified, used by BitbucketClient to send
+# conditional requests. The stored bodies are kept under max_bytes by evicting the least recently used, and the
+# most recently used entries are also kept decoded in memory.
+class HttpCache:
+    memory_entries = 256
+
+    def __init__(self, logger: logging.Logger, db_path: str, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.logger = logger
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS http_cache
+                                     (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB NOT NULL,
+                                     size INTEGER NOT NULL, last_used REAL NOT NULL)""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS http_cache_last_used ON http_cache (last_used)")
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            cached_response = self._memory.get(url)
+            if cached_response is not None:
+                self._memory.move_to_end(url)
+            else:
+                row = self._connection.execute("SELECT etag, last_modified, body FROM http_cache WHERE url=?",
+                                               (url,)).fetchone()
+                if row is None:
+                    return None
+                cached_response = CachedResponse(url, row[0], row[1], bytes(row[2]))
+                self._remember(cached_response)
+            return cached_response
+
+    # called when the server confirmed the entry with a 304
+    def record_hit(self, cached_response: CachedResponse) -> None:
+        with self._lock, self._connection:
+            self.stats["hits"] += 1
+            self._connection.execute("UPDATE http_cache SET last_used=? WHERE url=?",
+                                     (time.time(), cached_response.url))
+
+    # Stores a 200 response when it can be revalidated later, returning the entry or None
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], body: bytes) -> Optional[CachedResponse]:
+        with self._lock:
+            self.stats["misses"] += 1
+            if (etag is None and last_modified is None) or len(body) > self.max_bytes:
+                return None
+            cached_response = CachedResponse(url, etag, last_modified, body)
+            with self._connection:
+                self._connection.execute("""INSERT OR REPLACE INTO http_cache
+                                         (url, etag, last_modified, body, size, last_used) VALUES(?, ?, ?, ?, ?, ?)""",
+                                         (url, etag, last_modified, body, len(body), time.time()))
+                self._evict_over_max_bytes()
+            self._remember(cached_response)
+            return cached_response
+
+    def _evict_over_max_bytes(self) -> None:
+        total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted_urls = []
+        for url, size in self._connection.execute("SELECT url, size FROM http_cache ORDER BY last_used"):
+            if total_bytes <= self.max_bytes:
+                break
+            evicted_urls.append(url)
+            total_bytes -= size
+        self._connection.executemany("DELETE FROM http_cache WHERE url=?", [(url,) for url in evicted_urls])
+        for url in evicted_urls:
+            self._memory.pop(url, None)
+        self.stats["evictions"] += len(evicted_urls)
+
+    def _remember(self, cached_response: CachedResponse) -> None:
+        self._memory[cached_response.url] = cached_response
+        self._memory.move_to_end(cached_response.url)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM http_cache")
+            self._memory.clear()
+        self.logger.info("Cleared HTTP cache")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    arg_parser = argparse.ArgumentParser(description="Maintain the local Bitbucket HTTP response cache")
+    arg_parser.add_argument("--clear", action="store_true", help="Remove every cached response.")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("INFO")
+
+    load_dotenv()
+    http_cache = HttpCache(outer_logger, os.environ["local_cache_db_path"])
+    if args.clear:
+        http_cache.clear()
+    http_cache.close()
@@ -4,7 +4,40 @@ from datetime import datetime
 from typing import List
 
 
+# Bitbucket returns ISO-8601 timestamps, which the standard library parses far faster than dateutil
+def parse_timestamp(timestamp: str) -> datetime:
+    try:
+        return datetime.fromisoformat(timestamp)
+    except ValueError:
+        # only loaded for the odd timestamp fromisoformat can't read, it is slow to import
+        from dateutil import parser
+        return parser.parse(timestamp)
+
+
+# "Name <email>" as Bitbucket gives it, falling back to the raw value when there's no email in brackets
+def parse_author_email(author_raw: str) -> str:
+    email_start = author_raw.find("<")
+    email_end = author_raw.find(">", email_start + 1)
+    if email_start == -1 or email_end == -1:
+        return author_raw
+    return author_raw[email_start + 1:email_end]
+
+
+# One commit read while scanning, from Bitbucket, a git mirror or the local commit store
+class CommitRecord:
+    __slots__ = ("hash", "message", "date", "author_email")
+
+    def __init__(self, commit_hash: str, message: str, date: datetime, author_email: str) -> None:
+        self.hash: str = commit_hash
+        self.message: str = message
+        self.date: datetime = date
+        self.author_email: str = author_email
+
+
 class DeployedTicket:
+    __slots__ = ("id", "deployment_id", "app_name", "ticket_id", "ticket_type", "caused_by", "created_instant",
+                 "merged_instant", "merge_author", "repositories_affected")
+
     def __init__(self, deployment_id: uuid, app_name: str, ticket_id: str, ticket_type: str, caused_by: str,
                  created_instant: datetime, merged_instant: datetime, merge_author: str,
                  repositories_affected: List[str]) -> None:
@@ -34,6 +67,8 @@ class DeployedTicket:
 
 
 class DeploymentInfo:
+    __slots__ = ("id", "app_name", "app_version", "deployed_instant", "deployed_by_user_id")
+
     def __init__(self, app_name: str, app_version: str, deployed_instant: datetime, deployed_by_user_id: str) -> None:
         self.id: uuid = uuid.uuid4()
         self.app_name: str = app_name
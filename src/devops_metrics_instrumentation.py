@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, Tuple
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:
+    import requests
+
+
+# Counters and wall-clock timings for one run, shared by the service, the HTTP clients and the repository. Each
+# metric is keyed by name plus labels, e.g. ("http_requests", {"host": "api.bitbucket.org"}).
+class Instrumentation:
+    prefix = "devops_metrics"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self.timings: Dict[Tuple[str, tuple], dict] = {}
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def record_time(self, name: str, seconds: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timing = self.timings.setdefault(key, {"count": 0, "seconds": 0.0})
+            timing["count"] += 1
+            timing["seconds"] += seconds
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - start, **labels)
+
+    # requests response hook, for clients whose session we don't own such as the Jira client
+    def record_response(self, response: "requests.Response", *args, **kwargs) -> None:
+        host = urlparse(response.url).netloc
+        self.increment("http_requests", host=host)
+        self.increment("http_bytes", len(response.content), host=host)
+
+    def get_counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def get_seconds(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self.timings.get((name, tuple(sorted(labels.items()))), {"seconds": 0.0})["seconds"]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "timings": [dict(name=name, labels=dict(labels), **timing)
+                            for (name, labels), timing in sorted(self.timings.items())],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+            }
+
+    # node_exporter textfile collector format
+    def to_prometheus(self) -> str:
+        lines = []
+        metrics = self.to_dict()
+        for name in sorted({timing["name"] for timing in metrics["timings"]}):
+            metric_name = "{}_{}_seconds".format(self.prefix, name)
+            lines.append("# TYPE {} summary".format(metric_name))
+            for timing in metrics["timings"]:
+                if timing["name"] == name:
+                    lines.append("{}_sum{} {}".format(metric_name, self._format_labels(timing["labels"]),
+                                                      timing["seconds"]))
+                    lines.append("{}_count{} {}".format(metric_name, self._format_labels(timing["labels"]),
+                                                        timing["count"]))
+        for name in sorted({counter["name"] for counter in metrics["counters"]}):
+            metric_name = "{}_{}_total".format(self.prefix, name)
+            lines.append("# TYPE {} counter".format(metric_name))
+            for counter in metrics["counters"]:
+                if counter["name"] == name:
+                    lines.append("{}{} {}".format(metric_name, self._format_labels(counter["labels"]),
+                                                  counter["value"]))
+        return "\n".join(lines) + "\n"
+
+    # a path ending in .prom is written as a Prometheus textfile, anything else as JSON
+    def write(self, path: str) -> None:
+        with open(path, "w") as file:
+            if path.endswith(".prom"):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), file, indent=2)
+
+    def _format_labels(self, labels: dict) -> str:
+        if len(labels) == 0:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                              for name, value in sorted(labels.items())) + "}"
@@ -0,0 +1,68 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+
+# Released tickets per Jira project and fixVersion, stored once the version has been found. An entry is served
+# without any Jira call while younger than ttl_seconds; after that it is reused only if the issues in the version
+# and their "updated" timestamps are unchanged.
+class JiraReleaseCache:
+    def __init__(self, logger: logging.Logger, db_path: str, ttl_seconds: int) -> None:
+        self.logger = logger
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS jira_release_cache
+                                     (project TEXT NOT NULL, fix_version TEXT NOT NULL, fetched_epoch REAL NOT NULL,
+                                     issues_updated TEXT NOT NULL, released_tickets TEXT NOT NULL,
+                                     PRIMARY KEY (project, fix_version))""")
+
+    def get(self, project: str, fix_version: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute("""SELECT fetched_epoch, issues_updated, released_tickets
+                                           FROM jira_release_cache WHERE project=? AND fix_version=?""",
+                                           (project, fix_version)).fetchone()
+        if row is None:
+            return None
+        return {"is_fresh": time.time() - row[0] < self.ttl_seconds,
+                "issues_updated": json.loads(row[1]),
+                "released_tickets": self._from_json(row[2])}
+
+    def put(self, project: str, fix_version: str, released_tickets: List[dict], issues_updated: dict) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("""INSERT OR REPLACE INTO jira_release_cache
+                                     (project, fix_version, fetched_epoch, issues_updated, released_tickets)
+                                     VALUES(?, ?, ?, ?, ?)""",
+                                     (project, fix_version, time.time(), json.dumps(issues_updated, sort_keys=True),
+                                      self._to_json(released_tickets)))
+
+    # restarts the TTL of an entry that was revalidated against Jira
+    def touch(self, project: str, fix_version: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jira_release_cache SET fetched_epoch=? WHERE project=? AND fix_version=?",
+                                     (time.time(), project, fix_version))
+
+    def invalidate(self, project: str = None, fix_version: str = None) -> None:
+        with self._lock, self._connection:
+            if project is None:
+                self._connection.execute("DELETE FROM jira_release_cache")
+            else:
+                self._connection.execute("DELETE FROM jira_release_cache WHERE project=? AND fix_version=?",
+                                         (project, fix_version))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _to_json(self, released_tickets: List[dict]) -> str:
+        return json.dumps([dict(ticket, created_datetime=ticket["created_datetime"].isoformat())
+                           for ticket in released_tickets])
+
+    def _from_json(self, released_tickets_json: str) -> List[dict]:
+        return [dict(ticket, created_datetime=datetime.fromisoformat(ticket["created_datetime"]))
+                for ticket in json.loads(released_tickets_json)]
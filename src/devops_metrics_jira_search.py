@@ -0,0 +1,43 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import jira
+
+
+# Runs a JQL search through every page of results instead of only the first. The first page gives the total, then
+# the remaining pages are requested concurrently by startAt offset. Issues are returned as the raw JSON dicts with
+# only the requested fields, in the order of the pages.
+class JiraSearch:
+    def __init__(self, logger: logging.Logger, jira_client: jira.client.JIRA, page_size: int = 100,
+                 max_concurrent_requests: int = 4) -> None:
+        self.logger = logger
+        self.jira_client = jira_client
+        self.page_size = page_size
+        self.max_concurrent_requests = max_concurrent_requests
+
+    def search(self, jql: str, fields: str) -> List[dict]:
+        first_page = self._search_page(jql, fields, 0)
+        issues = list(first_page["issues"])
+        total = first_page["total"]
+        # Jira caps maxResults below what was asked for on some instances, the page it returned is the real size
+        page_size = first_page.get("maxResults") or len(issues)
+        offsets = list(range(page_size, total, page_size)) if page_size > 0 else []
+        if len(offsets) > 0:
+            self.logger.info("Fetching {} more pages of {} issues for jql={}".format(len(offsets), total, jql))
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrent_requests, len(offsets))) as executor:
+                for page in executor.map(lambda offset: self._search_page(jql, fields, offset), offsets):
+                    issues.extend(page["issues"])
+
+        # an issue edited between page requests can move across a page boundary
+        issues_by_key = {}
+        for issue in issues:
+            issues_by_key.setdefault(issue["key"], issue)
+        if len(issues_by_key) < total:
+            self.logger.warning("Jira search returned {} of {} issues for jql={}"
+                                .format(len(issues_by_key), total, jql))
+        return list(issues_by_key.values())
+
+    def _search_page(self, jql: str, fields: str, start_at: int) -> dict:
+        return self.jira_client.search_issues(jql_str=jql, startAt=start_at, maxResults=self.page_size,
+                                              fields=fields, json_result=True)
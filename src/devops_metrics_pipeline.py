@@ -0,0 +1,108 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from devops_metrics_info import DevopsMetricsInfo
+from devops_metrics_service import DevopsMetricsService
+from functools import partial
+from typing import Callable, Dict, List, Tuple
+
+
+# Runs get_devops_metrics_information as a small dependency graph instead of strictly in order. The Jira search,
+# the previous release lookup and the dependency repo scans start together, the app repo scan starts as soon as
+# the previous release is known, and the merge waits for the release tickets and every scan. Dependency scans
+# only wait for Jira when they stop on release tickets, since they need the tickets' created dates. With a ticket
+# index the dependency phases only refresh the index and the merge looks the release tickets up in it.
+class DevopsMetricsPipeline:
+    def __init__(self, metrics_service: DevopsMetricsService, max_workers: int = None) -> None:
+        self.metrics_service = metrics_service
+        self.logger = metrics_service.logger
+        # the Jira search and the tag lookup run next to the configured number of repo scans
+        self.max_workers = max_workers or max(1, metrics_service.max_concurrent_repo_scans) + 2
+        self.phase_timings: Dict[str, dict] = {}
+
+    # as_of is passed on to the scans, see DevopsMetricsService.get_devops_metrics_information
+    def run(self, project_name: str, project_version: str, deployed_instant: datetime,
+            deployed_by_user_id: str, as_of: datetime = None) -> DevopsMetricsInfo:
+        return asyncio.run(self.run_async(project_name, project_version, deployed_instant, deployed_by_user_id,
+                                          as_of))
+
+    async def run_async(self, project_name: str, project_version: str, deployed_instant: datetime,
+                        deployed_by_user_id: str, as_of: datetime = None) -> DevopsMetricsInfo:
+        service = self.metrics_service
+        dependency_repos = service._get_repos_to_check(project_name)
+        wait_for_release_tickets = service.stop_dependency_scans_on_release_tickets
+        use_ticket_index = service.ticket_index is not None and as_of is None
+
+        phases = {
+            "jira": ([], partial(service.get_released_tickets, project_name, project_version)),
+            "previous_release": ([], partial(service.get_last_release_hash, project_name, project_version)),
+            "scan:" + project_name: (["previous_release"],
+                                     partial(service.scan_app_repo, project_name, project_version, as_of=as_of)),
+        }
+        for dependency_repo in dependency_repos:
+            if use_ticket_index:
+                phases["scan:" + dependency_repo] = ([], partial(service.refresh_ticket_index, dependency_repo))
+            elif wait_for_release_tickets:
+                phases["scan:" + dependency_repo] = (["jira"], partial(self._scan_dependency_repo_for_release,
+                                                                       dependency_repo, as_of=as_of))
+            else:
+                phases["scan:" + dependency_repo] = ([], partial(service.extract_ticket_merge_info_from_commits,
+                                                                 dependency_repo, '', as_of=as_of))
+
+        pipeline_start = time.perf_counter()
+        results = await self._run_phases(phases, pipeline_start)
+
+        merge_start = time.perf_counter()
+        released_tickets = results["jira"]
+        released_ticket_ids = {ticket["ticket_id"] for ticket in released_tickets}
+        if use_ticket_index:
+            dependency_results = service._get_indexed_merge_info(dependency_repos, released_ticket_ids)
+        else:
+            dependency_results = [results["scan:" + dependency_repo] for dependency_repo in dependency_repos]
+        merge_info_by_ticket_id = service._merge_ticket_merge_info(results["scan:" + project_name], dependency_repos,
+                                                                   dependency_results, released_ticket_ids)
+        metrics_info = service._build_devops_metrics_info(project_name, project_version, deployed_instant,
+                                                          deployed_by_user_id, released_tickets,
+                                                          merge_info_by_ticket_id)
+        self.phase_timings["merge"] = {"start_seconds": merge_start - pipeline_start,
+                                       "seconds": time.perf_counter() - merge_start}
+        service.instrumentation.record_time("phase", self.phase_timings["merge"]["seconds"], phase="merge")
+
+        self._log_phase_timings(time.perf_counter() - pipeline_start)
+        return metrics_info
+
+    # Phases must be listed after the phases they depend on. Each phase function gets its dependencies' results
+    # as positional arguments and runs on the executor, so blocking HTTP calls overlap.
+    async def _run_phases(self, phases: Dict[str, Tuple[List[str], Callable]], pipeline_start: float) -> dict:
+        loop = asyncio.get_running_loop()
+        tasks = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            async def run_phase(name: str, dependencies: List[str], function: Callable) -> any:
+                dependency_results = [await tasks[dependency] for dependency in dependencies]
+                phase_start = time.perf_counter()
+                result = await loop.run_in_executor(executor, partial(function, *dependency_results))
+                self.phase_timings[name] = {"start_seconds": phase_start - pipeline_start,
+                                            "seconds": time.perf_counter() - phase_start}
+                return result
+
+            for name, (dependencies, function) in phases.items():
+                tasks[name] = asyncio.ensure_future(run_phase(name, dependencies, function))
+            results = await asyncio.gather(*tasks.values())
+
+        return dict(zip(tasks, results))
+
+    def _scan_dependency_repo_for_release(self, repository: str, released_tickets: List,
+                                          as_of: datetime = None) -> dict:
+        return self.metrics_service.extract_ticket_merge_info_from_commits(
+            repository, '', {ticket["ticket_id"] for ticket in released_tickets},
+            self.metrics_service._get_ticket_created_dates(released_tickets), as_of=as_of)
+
+    def _log_phase_timings(self, wall_seconds: float) -> None:
+        serial_seconds = sum(timing["seconds"] for timing in self.phase_timings.values())
+        for name, timing in sorted(self.phase_timings.items(), key=lambda item: item[1]["start_seconds"]):
+            self.logger.info("Phase {} started_at={:.3f}s took={:.3f}s"
+                             .format(name, timing["start_seconds"], timing["seconds"]))
+        self.logger.info("Pipeline finished wall_seconds={:.3f} serial_seconds={:.3f}"
+                         .format(wall_seconds, serial_seconds))
@@ -0,0 +1,95 @@
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+from dotenv import load_dotenv
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_info import CommitRecord, parse_author_email, parse_timestamp
+from typing import List
+
+
+# Appends the commits of Bitbucket repo:push webhook payloads to the commit store as they are pushed, so the
+# history scan at deploy time finds them cached. A push is only stored when it continues exactly from the cached
+# head and Bitbucket listed all of its commits. Anything else (truncated or forced pushes, missed webhooks, a repo
+# that was never cached) is skipped and left to the service, which pages master from Bitbucket until it reaches the
+# cached head as it always has.
+class PushIngester:
+    def __init__(self, logger: logging.Logger, commit_store: CommitStore, branch: str = "master") -> None:
+        self.logger = logger
+        self.commit_store = commit_store
+        self.branch = branch
+
+    def ingest(self, payload: dict) -> dict:
+        summary = {"ingested_commits": 0, "skipped_changes": 0}
+        repository = self._get_repository(payload)
+        for change in payload.get("push", {}).get("changes", []):
+            if not self._is_branch_change(change):
+                continue
+            ingested_commits = self._ingest_change(repository, change)
+            if ingested_commits is None:
+                summary["skipped_changes"] += 1
+            else:
+                summary["ingested_commits"] += ingested_commits
+        return summary
+
+    def _get_repository(self, payload: dict) -> str:
+        # the service refers to repos by slug, the last part of "workspace/slug"
+        repository = payload.get("repository", {})
+        return repository.get("full_name", repository.get("name", "")).split("/")[-1]
+
+    def _is_branch_change(self, change: dict) -> bool:
+        new = change.get("new") or {}
+        return new.get("type") == "branch" and new.get("name") == self.branch
+
+    def _ingest_change(self, repository: str, change: dict) -> int:
+        old = change.get("old") or {}
+        old_hash = old.get("target", {}).get("hash")
+        new_hash = change["new"]["target"]["hash"]
+        commits = change.get("commits", [])
+        if change.get("truncated") or change.get("forced") or old_hash is None or len(commits) == 0 \
+                or commits[0]["hash"] != new_hash:
+            self.logger.info("Push to repo={} doesn't list every new commit, leaving it to the API scan. old={} new={}"
+                             .format(repository, old_hash, new_hash))
+            return None
+
+        commit_records = self._to_commit_records(commits)
+        if not self.commit_store.add_newer_commits_if_head(repository, old_hash, commit_records):
+            self.logger.info("Push to repo={} doesn't continue from the cached head, leaving the gap to the API scan. "
+                             "old={} new={}".format(repository, old_hash, new_hash))
+            return None
+        self.logger.info("Ingested {} pushed commits for repo={} head={}".format(len(commit_records), repository,
+                                                                                 new_hash))
+        return len(commit_records)
+
+    def _to_commit_records(self, commits: List[dict]) -> List[CommitRecord]:
+        return [CommitRecord(commit["hash"], commit.get("message", ""), parse_timestamp(commit["date"]),
+                             parse_author_email(commit.get("author", {}).get("raw", "")))
+                for commit in commits]
+
+
+# Bitbucket signs webhook bodies with the webhook's secret as "sha256=<hex hmac>" in X-Hub-Signature
+def is_valid_signature(secret: str, body: bytes, signature: str) -> bool:
+    expected_signature = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected_signature, signature or "")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store the commits of saved Bitbucket push webhook payloads")
+    parser.add_argument("payload_files", nargs="+", help="JSON payload files, applied in the order given.")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("INFO")
+
+    load_dotenv()
+    if not os.environ.get("local_cache_db_path"):
+        outer_logger.error("local_cache_db_path must be set to ingest pushes into the commit store")
+        exit(1)
+    push_ingester = PushIngester(outer_logger, CommitStore(outer_logger, os.environ["local_cache_db_path"]))
+    for payload_file in args.payload_files:
+        with open(payload_file) as file:
+            outer_logger.info("{}: {}".format(payload_file, push_ingester.ingest(json.load(file))))
+    push_ingester.commit_store.close()
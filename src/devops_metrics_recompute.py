@@ -0,0 +1,226 @@
+import argparse
+import logging
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_info import DevopsMetricsInfo, parse_timestamp
+from devops_metrics_repository import DevopsMetricsRepository
+from devops_metrics_service import DevopsMetricsService, JIRA_VERSION_PREFIXES
+from devops_metrics_tag_index import TagIndex
+from typing import Iterator, List
+
+RECOMPUTE_USER_ID = "recompute"
+
+# the repo and service of a pool worker, built once per process by _init_worker
+_worker_state = {}
+
+
+# Recomputes the metrics of every tagged release of the given apps, e.g. after the merge attribution rules change.
+# The releases are split into shards run on a process pool, each worker process with its own service and DB pool,
+# and staged in batches under run_id (sql/003_recompute_staging.sql). The staged set replaces the recorded
+# deployments only once every release of the run is staged; an interrupted run, or one with failed releases, is
+# resumed by running again with the same run_id.
+class DevopsMetricsRecompute:
+    def __init__(self, logger: logging.Logger, metrics_repo: DevopsMetricsRepository,
+                 metrics_service: DevopsMetricsService, workers: int = 1, shards_per_worker: int = 4,
+                 batch_size: int = 20, progress_interval_seconds: float = 30,
+                 include_undeployed_tags: bool = False) -> None:
+        self.logger = logger
+        self.metrics_repo = metrics_repo
+        self.metrics_service = metrics_service
+        self.workers = workers
+        self.shards_per_worker = shards_per_worker
+        self.batch_size = batch_size
+        self.progress_interval_seconds = progress_interval_seconds
+        self.include_undeployed_tags = include_undeployed_tags
+
+    # Recorded deployments of each app's release tags, oldest first, keeping their deployment id, time and user.
+    # Tags that were never deployed would add deployments to the live tables and skew the deploy rates, so they are
+    # only included with include_undeployed_tags, with the tagged commit's date standing in for the deploy.
+    def list_releases(self, app_names: List[str]) -> List[dict]:
+        deployed_versions = self.metrics_repo.get_deployed_versions(app_names)
+        releases = []
+        for app_name in app_names:
+            for version, tag_date in self.metrics_service.get_release_tags(app_name):
+                deployment = deployed_versions.get((app_name, version))
+                if deployment is not None:
+                    deployment_id, deployed_instant, deployed_by_user_id = deployment
+                elif not self.include_undeployed_tags:
+                    continue
+                elif tag_date is not None:
+                    deployment_id, deployed_instant, deployed_by_user_id = None, parse_timestamp(tag_date), \
+                        RECOMPUTE_USER_ID
+                else:
+                    self.logger.warning("Skipping release with no deployment or tag date. app={} version={}"
+                                        .format(app_name, version))
+                    continue
+                releases.append({"app_name": app_name, "app_version": version, "deployment_id": deployment_id,
+                                 "deployed_instant": deployed_instant, "deployed_by_user_id": deployed_by_user_id})
+        return releases
+
+    def run(self, run_id: str, app_names: List[str], resume: bool = True) -> dict:
+        releases = self.list_releases(app_names)
+        if resume:
+            checkpoints = self.metrics_repo.get_recompute_checkpoints(run_id)
+        else:
+            self.metrics_repo.clear_recompute(run_id)
+            checkpoints = set()
+        pending_releases = [release for release in releases
+                            if (release["app_name"], release["app_version"]) not in checkpoints]
+        summary = {"total": len(releases), "resumed": len(releases) - len(pending_releases), "recomputed": 0,
+                   "failed": 0, "swapped": 0}
+        self.logger.info("Recomputing {} releases of {} apps for run_id={}, {} already staged"
+                         .format(len(pending_releases), len(app_names), run_id, summary["resumed"]))
+
+        shards = split_into_shards(pending_releases, max(1, self.workers) * self.shards_per_worker)
+        start = time.monotonic()
+        last_report = start
+        for shard_summary in self._run_shards(run_id, shards):
+            summary["recomputed"] += shard_summary["recomputed"]
+            summary["failed"] += shard_summary["failed"]
+            now = time.monotonic()
+            if now - last_report >= self.progress_interval_seconds:
+                last_report = now
+                self._log_progress(summary, now - start)
+        summary["elapsed_seconds"] = time.monotonic() - start
+        self._log_progress(summary, summary["elapsed_seconds"])
+
+        if summary["failed"] > 0:
+            self.logger.error("Not swapping in run_id={}, {} releases failed. The staged releases are kept, run "
+                              "again with the same run_id to retry the rest".format(run_id, summary["failed"]))
+            return summary
+        summary["swapped"] = self.metrics_repo.swap_in_recompute(run_id)
+        return summary
+
+    def _run_shards(self, run_id: str, shards: List[List[dict]]) -> Iterator[dict]:
+        if self.workers <= 1:
+            for shard in shards:
+                yield recompute_shard(self.logger, self.metrics_repo, self.metrics_service, run_id, shard,
+                                      self.batch_size)
+            return
+
+        # spawned rather than forked, a forked worker would share this process's DB and cache connections
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker) as executor:
+            futures = {executor.submit(_recompute_shard_in_worker, run_id, shard, self.batch_size): shard
+                       for shard in shards}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                # a worker that exited or died takes its shard with it, the staged part of it is kept
+                except (Exception, SystemExit) as error:
+                    self.logger.error("Failed recompute shard of {} releases error={!r}"
+                                      .format(len(futures[future]), error))
+                    yield {"recomputed": 0, "failed": len(futures[future])}
+
+    def _log_progress(self, summary: dict, elapsed_seconds: float) -> None:
+        done = summary["recomputed"] + summary["failed"]
+        per_minute = done / elapsed_seconds * 60 if elapsed_seconds > 0 else 0.0
+        self.logger.info("Recomputed {}/{} releases failed={} releases_per_minute={:.1f}"
+                         .format(done, summary["total"] - summary["resumed"], summary["failed"], per_minute))
+
+
+# Contiguous shards, so each worker reads the releases of as few apps as possible and reuses its caches
+def split_into_shards(releases: List[dict], shard_count: int) -> List[List[dict]]:
+    if len(releases) == 0:
+        return []
+    shard_size = math.ceil(len(releases) / max(1, shard_count))
+    return [releases[index:index + shard_size] for index in range(0, len(releases), shard_size)]
+
+
+def recompute_shard(logger: logging.Logger, metrics_repo: DevopsMetricsRepository,
+                    metrics_service: DevopsMetricsService, run_id: str, releases: List[dict],
+                    batch_size: int) -> dict:
+    summary = {"recomputed": 0, "failed": 0}
+    staged_infos: List[DevopsMetricsInfo] = []
+    for release in releases:
+        try:
+            # attributed as of the deploy, not with the commits and timeframe of today
+            metrics_info = metrics_service.get_devops_metrics_information(release["app_name"], release["app_version"],
+                                                                          release["deployed_instant"],
+                                                                          release["deployed_by_user_id"],
+                                                                          as_of=release["deployed_instant"])
+        # the service exits on unrecoverable API errors, which shouldn't end the rest of the shard
+        except (Exception, SystemExit) as error:
+            summary["failed"] += 1
+            logger.error("Failed recomputing release app={} version={} error={!r}"
+                         .format(release["app_name"], release["app_version"], error))
+            continue
+
+        if release["deployment_id"] is not None:
+            _keep_deployment_id(metrics_info, release["deployment_id"])
+        staged_infos.append(metrics_info)
+        if len(staged_infos) >= batch_size:
+            metrics_repo.insert_recompute_results(run_id, staged_infos)
+            summary["recomputed"] += len(staged_infos)
+            staged_infos = []
+
+    if len(staged_infos) > 0:
+        metrics_repo.insert_recompute_results(run_id, staged_infos)
+        summary["recomputed"] += len(staged_infos)
+    return summary
+
+
+# anything referring to a recorded deployment by id still finds it after the swap
+def _keep_deployment_id(metrics_info: DevopsMetricsInfo, deployment_id: any) -> None:
+    metrics_info.deployment_info.id = deployment_id
+    for deployed_ticket in metrics_info.deployed_tickets:
+        deployed_ticket.deployment_id = deployment_id
+
+
+def _create_recompute_service() -> DevopsMetricsService:
+    metrics_service = DevopsMetricsService()
+    # past releases are read as the commit range between their tags instead of walking master back to them
+    metrics_service.app_scan_mode = "range"
+    metrics_service.cache_tags_in_memory = True
+    if metrics_service.commit_store is None:
+        # the tag walk without an index counts back from the newest tag, not from the version being recomputed
+        metrics_service.commit_store = CommitStore(metrics_service.logger, ":memory:")
+        metrics_service.tag_index = TagIndex(metrics_service.logger, ":memory:")
+    return metrics_service
+
+
+def _init_worker() -> None:
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    load_dotenv()
+    logger = logging.getLogger(__name__)
+    logger.setLevel("INFO")
+    _worker_state["logger"] = logger
+    _worker_state["metrics_repo"] = DevopsMetricsRepository(logger)
+    _worker_state["metrics_service"] = _create_recompute_service()
+
+
+def _recompute_shard_in_worker(run_id: str, releases: List[dict], batch_size: int) -> dict:
+    return recompute_shard(_worker_state["logger"], _worker_state["metrics_repo"], _worker_state["metrics_service"],
+                           run_id, releases, batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute the devops metrics of every tagged release")
+    parser.add_argument("--run_id", help="Name of the run, used again to resume it.", required=True)
+    parser.add_argument("--apps", help="Apps to recompute, all known apps by default.", nargs="+",
+                        default=list(JIRA_VERSION_PREFIXES))
+    parser.add_argument("--workers", help="How many worker processes to recompute with.", type=int, default=1)
+    parser.add_argument("--batch_size", help="How many releases a worker stages per transaction.", type=int,
+                        default=20)
+    parser.add_argument("--restart", action="store_true", help="Discard what the run has staged and start over.")
+    parser.add_argument("--include_undeployed_tags", action="store_true",
+                        help="Also record release tags that were never deployed, dated by their tagged commit.")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("INFO")
+
+    load_dotenv()
+    recompute_metrics_repo = DevopsMetricsRepository(outer_logger)
+    recompute_summary = DevopsMetricsRecompute(outer_logger, recompute_metrics_repo, _create_recompute_service(),
+                                               args.workers, batch_size=args.batch_size,
+                                               include_undeployed_tags=args.include_undeployed_tags) \
+        .run(args.run_id, args.apps, resume=not args.restart)
+    recompute_metrics_repo.close()
+    if recompute_summary["failed"] > 0:
+        exit(1)
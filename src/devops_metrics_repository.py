@@ -1,70 +1,321 @@
 import json
 import logging
+import math
 import os
+import threading
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+from contextlib import contextmanager
+from datetime import datetime
 from devops_metrics_info import DevopsMetricsInfo, DeploymentInfo, DeployedTicket
+from devops_metrics_instrumentation import Instrumentation
+from typing import Iterator, List, Set, Tuple
+
+psycopg2.extras.register_uuid()
+
+ROLLUP_COUNT_COLUMNS = ["deployments", "failed_deployments", "tickets", "failure_tickets", "lead_time_seconds_sum",
+                        "lead_time_count", "merge_to_deploy_seconds_sum", "merge_to_deploy_count", "lead_time_le_1d",
+                        "lead_time_le_3d", "lead_time_le_7d", "lead_time_le_14d", "lead_time_le_30d",
+                        "lead_time_gt_30d", "merge_to_deploy_le_1d", "merge_to_deploy_le_3d", "merge_to_deploy_le_7d",
+                        "merge_to_deploy_le_14d", "merge_to_deploy_le_30d", "merge_to_deploy_gt_30d"]
 
 
 class DevopsMetricsRepository:
-    def __init__(self, logger: logging.Logger):
+    def __init__(self, logger: logging.Logger, instrumentation: Instrumentation = None):
         self.logger = logger
+        self.instrumentation = instrumentation or Instrumentation()
+        self.max_connections = int(os.getenv("database_pool_max_connections", "4"))
+        self.ticket_insert_page_size = 1000
+        # needs the tables from sql/002_deployment_rollup.sql
+        self.maintain_deployment_rollups = os.getenv("maintain_deployment_rollups", "false").lower() == "true"
+        self._pool = None
+        self._pool_lock = threading.Lock()
 
     def connect(self) -> any:
-        psycopg2.extras.register_uuid()
-        connection = psycopg2.connect(
-            user=os.getenv("database_username"),
-            password=os.getenv("database_password"),
-            host=os.getenv("database_host"),
-            port=os.getenv("database_port"),
-            database=os.getenv("database_name")
-        )
-        self.logger.info("Created connection with database")
-        return connection
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, self.max_connections,
+                    user=os.getenv("database_username"),
+                    password=os.getenv("database_password"),
+                    host=os.getenv("database_host"),
+                    port=os.getenv("database_port"),
+                    database=os.getenv("database_name")
+                )
+                self.logger.info("Created connection pool with database")
+        return self._pool.getconn()
+
+    def release(self, connection: any, discard: bool = False) -> None:
+        self._pool.putconn(connection, close=discard)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    @contextmanager
+    def _pooled_connection(self) -> Iterator[any]:
+        connection = self.connect()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
 
     def is_app_version_already_deployed(self, app_name: str, app_version: str) -> bool:
         version_check_sql = """SELECT 1 FROM deployment_info where app_name=%s and app_version=%s"""
 
-        connection = self.connect()
-        cursor = connection.cursor()
+        with self.instrumentation.timer("db", operation="already_deployed_check"), \
+                self._pooled_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(version_check_sql, (app_name, app_version,))
+                is_deployed = cursor.fetchone() is not None
+            # end the read-only transaction so the connection goes back to the pool idle
+            connection.rollback()
+        self.instrumentation.increment("db_round_trips", 2, operation="already_deployed_check")
+        return is_deployed
 
-        cursor.execute(version_check_sql, (app_name, app_version,))
-        return cursor.fetchone() is not None
+    # Rows for DeploymentDataset.from_rows: (id, app_name, deployed_epoch)
+    def get_deployment_rows(self, since: datetime = None) -> List[tuple]:
+        deployment_sql = """SELECT id::text, app_name, EXTRACT(EPOCH FROM deployed_instant)::float8
+                            FROM deployment_info WHERE %s::timestamptz IS NULL OR deployed_instant >= %s"""
+        return self._fetch_all(deployment_sql, (since, since))
+
+    # Rows for DeploymentDataset.from_rows: (deployment_id, ticket_type, is_failure, created_epoch, merged_epoch)
+    def get_deployed_ticket_rows(self, since: datetime = None) -> List[tuple]:
+        deployed_ticket_sql = """SELECT t.deployment_id::text, COALESCE(t.ticket_type, ''),
+                            COALESCE(t.caused_by, '') <> '',
+                            COALESCE(EXTRACT(EPOCH FROM t.created_instant)::float8, 'NaN'),
+                            COALESCE(EXTRACT(EPOCH FROM t.merged_instant)::float8, 'NaN')
+                            FROM deployed_ticket t JOIN deployment_info d ON d.id = t.deployment_id
+                            WHERE %s::timestamptz IS NULL OR d.deployed_instant >= %s"""
+        return self._fetch_all(deployed_ticket_sql, (since, since))
+
+    def _fetch_all(self, sql: str, params: tuple) -> List[tuple]:
+        with self._pooled_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            connection.rollback()
+        return rows
 
-    def insert_deployment_info(self, cursor: any, deployment_info: DeploymentInfo) -> None:
+    # Commits on success. A failed transaction exits like an insert failure, without returning the connection.
+    @contextmanager
+    def _transaction(self, operation: str) -> Iterator[any]:
+        connection = None
+        is_failed = False
+        try:
+            connection = self.connect()
+            with self.instrumentation.timer("db", operation=operation):
+                with connection.cursor() as cursor:
+                    yield cursor
+                connection.commit()
+            self.instrumentation.increment("db_round_trips", operation="commit")
+        except(Exception, psycopg2.DatabaseError) as error:
+            is_failed = True
+            self.logger.error("Error in database operation={}. Error: {}".format(operation, error))
+            exit(20)
+        finally:
+            if connection is not None:
+                self.release(connection, discard=is_failed)
+
+    # (app_name, app_version) -> (id, deployed_instant, deployed_by_user_id) of the recorded deployments
+    def get_deployed_versions(self, app_names: List[str]) -> dict:
+        deployment_sql = """SELECT app_name, app_version, id, deployed_instant, deployed_by_user_id
+                            FROM deployment_info WHERE app_name = ANY(%s)"""
+        return {(row[0], row[1]): row[2:] for row in self._fetch_all(deployment_sql, (list(app_names),))}
+
+    # Recompute staging, see sql/003_recompute_staging.sql
+    def get_recompute_checkpoints(self, run_id: str) -> Set[Tuple[str, str]]:
+        checkpoint_sql = """SELECT app_name, app_version FROM recompute_checkpoint WHERE run_id=%s"""
+        return {(row[0], row[1]) for row in self._fetch_all(checkpoint_sql, (run_id,))}
+
+    def clear_recompute(self, run_id: str) -> None:
+        with self._transaction("clear_recompute") as cursor:
+            self._delete_recompute_rows(cursor, run_id)
+
+    def _delete_recompute_rows(self, cursor: any, run_id: str) -> None:
+        for table in ["deployed_ticket_staging", "deployment_info_staging", "recompute_checkpoint"]:
+            cursor.execute("DELETE FROM {} WHERE run_id=%s".format(table), (run_id,))
+
+    # Stages a batch of recomputed deployments and checkpoints them in the same transaction, so a resumed run
+    # neither loses nor repeats a release
+    def insert_recompute_results(self, run_id: str, devops_metrics_infos: List[DevopsMetricsInfo]) -> None:
+        deployment_info_sql = """INSERT INTO deployment_info_staging
+                            (run_id, id, app_name, app_version, deployed_instant, deployed_by_user_id) VALUES %s"""
+        deployed_ticket_sql = """INSERT INTO deployed_ticket_staging
+                            (run_id, id, deployment_id, app_name, ticket_id, ticket_type, caused_by,
+                            created_instant, merged_instant, merge_author, repositories_affected)
+                            VALUES %s"""
+        checkpoint_sql = """INSERT INTO recompute_checkpoint (run_id, app_name, app_version) VALUES %s
+                            ON CONFLICT (run_id, app_name, app_version) DO NOTHING"""
+        deployment_infos = [metrics_info.deployment_info for metrics_info in devops_metrics_infos]
+        deployed_tickets = [deployed_ticket for metrics_info in devops_metrics_infos
+                            for deployed_ticket in metrics_info.deployed_tickets]
+
+        with self._transaction("insert_recompute_results") as cursor:
+            psycopg2.extras.execute_values(cursor, deployment_info_sql,
+                                           [(run_id, deployment_info.id, deployment_info.app_name,
+                                             deployment_info.app_version, deployment_info.deployed_instant,
+                                             deployment_info.deployed_by_user_id)
+                                            for deployment_info in deployment_infos],
+                                           page_size=self.ticket_insert_page_size)
+            if len(deployed_tickets) > 0:
+                psycopg2.extras.execute_values(cursor, deployed_ticket_sql,
+                                               [(run_id, deployed_ticket.id, deployed_ticket.deployment_id,
+                                                 deployed_ticket.app_name, deployed_ticket.ticket_id,
+                                                 deployed_ticket.ticket_type, deployed_ticket.caused_by,
+                                                 deployed_ticket.created_instant, deployed_ticket.merged_instant,
+                                                 deployed_ticket.merge_author,
+                                                 json.dumps(deployed_ticket.repositories_affected))
+                                                for deployed_ticket in deployed_tickets],
+                                               page_size=self.ticket_insert_page_size)
+            psycopg2.extras.execute_values(cursor, checkpoint_sql,
+                                           [(run_id, deployment_info.app_name, deployment_info.app_version)
+                                            for deployment_info in deployment_infos],
+                                           page_size=self.ticket_insert_page_size)
+        self.logger.info("Staged {} recomputed deployments with {} tickets for run_id={}"
+                         .format(len(deployment_infos), len(deployed_tickets), run_id))
+
+    # Replaces the recorded deployments of every checkpointed app version with the staged ones in one transaction,
+    # so readers see either the old or the recomputed metrics. Returns how many deployments were swapped in.
+    def swap_in_recompute(self, run_id: str) -> int:
+        with self._transaction("swap_in_recompute") as cursor:
+            # live inserts wait for the swap, reads carry on against the old rows until it commits
+            cursor.execute("LOCK TABLE deployment_info, deployed_ticket IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute("""DELETE FROM deployed_ticket t USING deployment_info d, recompute_checkpoint c
+                           WHERE t.deployment_id = d.id AND d.app_name = c.app_name
+                           AND d.app_version = c.app_version AND c.run_id = %s""", (run_id,))
+            cursor.execute("""DELETE FROM deployment_info d USING recompute_checkpoint c
+                           WHERE d.app_name = c.app_name AND d.app_version = c.app_version AND c.run_id = %s""",
+                           (run_id,))
+            cursor.execute("""INSERT INTO deployment_info (id, app_name, app_version, deployed_instant,
+                           deployed_by_user_id) SELECT id, app_name, app_version, deployed_instant,
+                           deployed_by_user_id FROM deployment_info_staging WHERE run_id = %s""", (run_id,))
+            swapped_deployments = cursor.rowcount
+            cursor.execute("""INSERT INTO deployed_ticket (id, deployment_id, app_name, ticket_id, ticket_type,
+                           caused_by, created_instant, merged_instant, merge_author, repositories_affected)
+                           SELECT id, deployment_id, app_name, ticket_id, ticket_type, caused_by, created_instant,
+                           merged_instant, merge_author, repositories_affected FROM deployed_ticket_staging
+                           WHERE run_id = %s""", (run_id,))
+            if self.maintain_deployment_rollups:
+                # rebuilt from every deployment of the recomputed apps, not only the swapped ones
+                cursor.execute("""DELETE FROM deployment_rollup WHERE app_name IN
+                               (SELECT app_name FROM recompute_checkpoint WHERE run_id = %s)""", (run_id,))
+                cursor.execute("""SELECT id FROM deployment_info WHERE app_name IN
+                               (SELECT app_name FROM recompute_checkpoint WHERE run_id = %s)""", (run_id,))
+                for deployment_id, in cursor.fetchall():
+                    self.upsert_deployment_rollups(cursor, deployment_id)
+            self._delete_recompute_rows(cursor, run_id)
+        self.logger.info("Swapped in {} recomputed deployments for run_id={}".format(swapped_deployments, run_id))
+        return swapped_deployments
+
+    # Relies on the unique index from sql/001_deployment_info_unique_app_version.sql. Returns False when the app
+    # version was already recorded, which makes the insert safe to repeat.
+    def insert_deployment_info(self, cursor: any, deployment_info: DeploymentInfo) -> bool:
         deployment_info_sql = """INSERT INTO deployment_info
                             (id, app_name, app_version, deployed_instant, deployed_by_user_id)
-                            VALUES(%s, %s, %s, %s, %s)"""
+                            VALUES(%s, %s, %s, %s, %s)
+                            ON CONFLICT (app_name, app_version) DO NOTHING
+                            RETURNING id"""
         self.logger.info("Inserting deployment info into DB")
         cursor.execute(deployment_info_sql, (deployment_info.id, deployment_info.app_name, deployment_info.app_version,
                                              deployment_info.deployed_instant, deployment_info.deployed_by_user_id,))
+        self.instrumentation.increment("db_round_trips", operation="insert_deployment_info")
+        return cursor.fetchone() is not None
 
-    def insert_deployed_ticket(self, cursor: any, deployed_ticket: DeployedTicket) -> None:
+    def insert_deployed_tickets(self, cursor: any, deployed_tickets: List[DeployedTicket]) -> None:
         deployed_ticket_sql = """INSERT INTO deployed_ticket
-                            (id, deployment_id, app_name, ticket_id, ticket_type, caused_by, 
+                            (id, deployment_id, app_name, ticket_id, ticket_type, caused_by,
                             created_instant, merged_instant, merge_author, repositories_affected)
-                            VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-        self.logger.info("Inserting deployed ticket info into DB")
-        cursor.execute(deployed_ticket_sql, (deployed_ticket.id, deployed_ticket.deployment_id,
-                                             deployed_ticket.app_name, deployed_ticket.ticket_id,
-                                             deployed_ticket.ticket_type, deployed_ticket.caused_by,
-                                             deployed_ticket.created_instant, deployed_ticket.merged_instant,
-                                             deployed_ticket.merge_author,
-                                             json.dumps(deployed_ticket.repositories_affected),))
-
-    def insert_devops_metrics_info(self, devops_metrics_info: DevopsMetricsInfo) -> None:
+                            VALUES %s"""
+        self.logger.info("Inserting {} deployed tickets into DB".format(len(deployed_tickets)))
+        psycopg2.extras.execute_values(cursor, deployed_ticket_sql,
+                                       [(deployed_ticket.id, deployed_ticket.deployment_id,
+                                         deployed_ticket.app_name, deployed_ticket.ticket_id,
+                                         deployed_ticket.ticket_type, deployed_ticket.caused_by,
+                                         deployed_ticket.created_instant, deployed_ticket.merged_instant,
+                                         deployed_ticket.merge_author,
+                                         json.dumps(deployed_ticket.repositories_affected),)
+                                        for deployed_ticket in deployed_tickets],
+                                       page_size=self.ticket_insert_page_size)
+        self.instrumentation.increment("db_round_trips",
+                                       math.ceil(len(deployed_tickets) / self.ticket_insert_page_size),
+                                       operation="insert_deployed_tickets")
+
+    # Adds one deployment's counts to the day and week rollups of its app, see sql/002_deployment_rollup.sql. Reads the
+    # rows just inserted in this transaction, so it must run after the deployment and its tickets are inserted.
+    def upsert_deployment_rollups(self, cursor: any, deployment_id: any) -> None:
+        deployment_rollup_sql = """INSERT INTO deployment_rollup AS rollup
+                            (app_name, period, period_start, {columns})
+                            SELECT d.app_name, p.period,
+                                date_trunc(p.period, d.deployed_instant AT TIME ZONE 'UTC')::date, 1,
+                                CASE WHEN count(t.id) FILTER (WHERE COALESCE(t.caused_by, '') <> '') > 0
+                                    THEN 1 ELSE 0 END,
+                                count(t.id),
+                                count(t.id) FILTER (WHERE COALESCE(t.caused_by, '') <> ''),
+                                COALESCE(sum(EXTRACT(EPOCH FROM d.deployed_instant - t.created_instant)), 0),
+                                count(t.created_instant),
+                                COALESCE(sum(EXTRACT(EPOCH FROM d.deployed_instant - t.merged_instant)), 0),
+                                count(t.merged_instant),
+                                count(*) FILTER (WHERE d.deployed_instant - t.created_instant <= INTERVAL '1 day'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '1 day'
+                                    AND d.deployed_instant - t.created_instant <= INTERVAL '3 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '3 days'
+                                    AND d.deployed_instant - t.created_instant <= INTERVAL '7 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '7 days'
+                                    AND d.deployed_instant - t.created_instant <= INTERVAL '14 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '14 days'
+                                    AND d.deployed_instant - t.created_instant <= INTERVAL '30 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.created_instant > INTERVAL '30 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.merged_instant <= INTERVAL '1 day'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '1 day'
+                                    AND d.deployed_instant - t.merged_instant <= INTERVAL '3 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '3 days'
+                                    AND d.deployed_instant - t.merged_instant <= INTERVAL '7 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '7 days'
+                                    AND d.deployed_instant - t.merged_instant <= INTERVAL '14 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '14 days'
+                                    AND d.deployed_instant - t.merged_instant <= INTERVAL '30 days'),
+                                count(*) FILTER (WHERE d.deployed_instant - t.merged_instant > INTERVAL '30 days')
+                            FROM deployment_info d
+                            CROSS JOIN (VALUES ('day'), ('week')) AS p(period)
+                            LEFT JOIN deployed_ticket t ON t.deployment_id = d.id
+                            WHERE d.id = %s
+                            GROUP BY d.app_name, p.period, d.deployed_instant
+                            ON CONFLICT (app_name, period, period_start) DO UPDATE SET {updates}""" \
+            .format(columns=", ".join(ROLLUP_COUNT_COLUMNS),
+                    updates=", ".join("{0} = rollup.{0} + EXCLUDED.{0}".format(column)
+                                      for column in ROLLUP_COUNT_COLUMNS))
+        cursor.execute(deployment_rollup_sql, (deployment_id,))
+        self.instrumentation.increment("db_round_trips", operation="upsert_deployment_rollups")
+
+    def insert_devops_metrics_info(self, devops_metrics_info: DevopsMetricsInfo) -> bool:
         connection = None
+        is_failed = False
         try:
             connection = self.connect()
-            cursor = connection.cursor()
-            self.insert_deployment_info(cursor, devops_metrics_info.deployment_info)
-            for deployed_ticket in devops_metrics_info.deployed_tickets:
-                self.insert_deployed_ticket(cursor, deployed_ticket)
-            connection.commit()
-            cursor.close()
+            with self.instrumentation.timer("db", operation="insert_devops_metrics_info"):
+                with connection.cursor() as cursor:
+                    is_inserted = self.insert_deployment_info(cursor, devops_metrics_info.deployment_info)
+                    if is_inserted and len(devops_metrics_info.deployed_tickets) > 0:
+                        self.insert_deployed_tickets(cursor, devops_metrics_info.deployed_tickets)
+                    # only for new deployments, so a repeated insert doesn't count the deployment twice
+                    if is_inserted and self.maintain_deployment_rollups:
+                        self.upsert_deployment_rollups(cursor, devops_metrics_info.deployment_info.id)
+                connection.commit()
+            self.instrumentation.increment("db_round_trips", operation="commit")
+            if not is_inserted:
+                self.logger.info("App version was already recorded by another run. app={} version={}"
+                                 .format(devops_metrics_info.deployment_info.app_name,
+                                         devops_metrics_info.deployment_info.app_version))
+            return is_inserted
         except(Exception, psycopg2.DatabaseError) as error:
+            is_failed = True
             self.logger.error("Error inserting devops metrics into the database. Error: {}".format(error))
             exit(20)
         finally:
             if connection is not None:
-                connection.close()
+                # a failed transaction can't be reused, so don't hand the connection back to the pool
+                self.release(connection, discard=is_failed)
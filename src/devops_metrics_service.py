@@ -1,41 +1,155 @@
 import array
 import base64
 import jira.client
-import json
 import logging
+import math
 import os
 import re
+import threading
+import time
 
 import pytz
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import closing
 from datetime import datetime
-from dateutil import parser
+from functools import partial
 from dateutil.relativedelta import relativedelta
-from src.devops_metrics_info import DevopsMetricsInfo, DeploymentInfo, DeployedTicket
+from devops_metrics_bitbucket_client import BitbucketClient, SharedTokenBucket
+from devops_metrics_commit_source import BitbucketCommitSource, CommitSource, GitMirrorCommitSource
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_http_cache import HttpCache
+from devops_metrics_instrumentation import Instrumentation
+from devops_metrics_jira_cache import JiraReleaseCache
+from devops_metrics_jira_search import JiraSearch
+from devops_metrics_tag_index import TagIndex
+from devops_metrics_ticket_index import TicketIndex
+from devops_metrics_ticket_matcher import TicketMatcher
+from src.devops_metrics_info import CommitRecord, DevopsMetricsInfo, DeploymentInfo, DeployedTicket, parse_timestamp
 from jira import JIRA
-from typing import List
+from typing import Generator, Iterator, List, Optional, Tuple
+
+# Jira fixVersion prefix of each app, the apps this service knows how to process
+JIRA_VERSION_PREFIXES = {
+    "cv-management-web": "cvmw",
+    "cv-management-web-frontend": "cvmwf",
+    "cv-event-listener": "cvel",
+    "model-generator": "modgen",
+    "measurements-generator": "measgen",
+    "shading-analysis-generator": "shadegen",
+    "cv-management-admin-web": "cvmadmin",
+    "cv-management-admin-web-frontend": "cvmadminwf",
+}
 
 
 class DevopsMetricsService:
 
-    def __init__(self) -> None:
+    def __init__(self, instrumentation: Instrumentation = None) -> None:
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel("INFO")
+        self.instrumentation = instrumentation or Instrumentation()
         self.jira_project_str = "CV"
         self.jira_possible_projects = ["CV", "IMGING", "IQ"]
         self.git_search_timeframe_in_months = 3
+        self.ticket_matcher = TicketMatcher(self.jira_possible_projects)
+        # A limit of 1 keeps the original one-repo-at-a-time scan
+        self.max_concurrent_repo_scans = int(os.environ.get("max_concurrent_repo_scans", "1"))
+        self.max_concurrent_requests_per_host = int(os.environ.get("max_concurrent_requests_per_host", "4"))
+        self.cache_tags_in_memory = False
+        self._tag_cache = {}
+        self._tag_cache_lock = threading.Lock()
+        self._jira_client = None
+        self._jira_client_lock = threading.Lock()
+        self.jira_page_size = int(os.environ.get("jira_page_size", "100"))
+        self.jira_max_concurrent_requests = int(os.environ.get("jira_max_concurrent_requests", "4"))
+        self.commit_store = None
+        self.tag_index = None
+        self.jira_release_cache = None
+        self.ticket_index = None
+        self.http_cache = None
+        self.stop_dependency_scans_on_release_tickets = \
+            os.environ.get("stop_dependency_scans_on_release_tickets", "false").lower() == "true"
+        self.scan_stats = {}
+        # "async" overlaps the Jira and Bitbucket phases, see DevopsMetricsPipeline
+        self.pipeline_mode = os.environ.get("pipeline_mode", "serial")
+        # "range" reads only the app repo commits between the previous release and the deployed tag
+        self.app_scan_mode = os.environ.get("app_scan_mode", "walk")
+        if os.environ.get("local_cache_db_path"):
+            self.commit_store = CommitStore(self.logger, os.environ.get("local_cache_db_path"))
+            self.commit_store.evict_older_than(int(os.environ.get("commit_cache_max_age_days", "120")))
+            self.tag_index = TagIndex(self.logger, os.environ.get("local_cache_db_path"))
+            self.jira_release_cache = JiraReleaseCache(self.logger, os.environ.get("local_cache_db_path"),
+                                                       int(os.environ.get("jira_cache_ttl_seconds", "3600")))
+            # dependency repos are looked up in the ticket index instead of being scanned
+            if os.environ.get("use_ticket_index", "false").lower() == "true":
+                self.ticket_index = TicketIndex(self.logger, os.environ.get("local_cache_db_path"))
+            # Bitbucket pages are revalidated with ETag/Last-Modified instead of downloaded again
+            if os.environ.get("bitbucket_http_cache", "false").lower() == "true":
+                self.http_cache = HttpCache(self.logger, os.environ.get("local_cache_db_path"),
+                                            int(os.environ.get("bitbucket_http_cache_max_mb", "64")) * 1024 * 1024)
         self.bitbucket_auth_header = self._get_auth_header(os.environ.get("bitbucket_user_id"),
                                                      os.environ.get("bitbucket_api_password"))
-
+        # (connect, read) seconds, a stalled request is retried instead of hanging the deploy
+        bitbucket_timeout = (float(os.environ.get("bitbucket_connect_timeout_seconds", "10")),
+                             float(os.environ.get("bitbucket_read_timeout_seconds", "60")))
+        requests_per_hour = int(os.environ.get("bitbucket_requests_per_hour", "900"))
+        burst_size = int(os.environ.get("bitbucket_burst_size", "30"))
+        # with a local cache db every process on the host shares the one hourly budget, otherwise each process
+        # gets its own and bitbucket_requests_per_hour has to be divided between the processes that run at once
+        rate_limiter = None
+        if os.environ.get("local_cache_db_path"):
+            rate_limiter = SharedTokenBucket(os.environ.get("local_cache_db_path"), "bitbucket",
+                                             requests_per_hour / 3600.0, burst_size)
+        self.bitbucket_client = BitbucketClient(self.logger, self.bitbucket_auth_header,
+                                                max_requests_per_host=self.max_concurrent_requests_per_host,
+                                                requests_per_hour=requests_per_hour, burst_size=burst_size,
+                                                max_retries=int(os.environ.get("bitbucket_max_retries", "5")),
+                                                instrumentation=self.instrumentation, http_cache=self.http_cache,
+                                                timeout=bitbucket_timeout, rate_limiter=rate_limiter)
+        self.commit_source = self._create_commit_source()
+
+    # "git_mirror" reads commits and tags from local mirrors under git_mirror_dir instead of the Bitbucket API
+    def _create_commit_source(self) -> CommitSource:
+        commit_source = os.environ.get("commit_source", "bitbucket")
+        if commit_source == "git_mirror":
+            return GitMirrorCommitSource(self.logger, os.environ.get("git_mirror_dir", "git_mirrors"),
+                                         os.environ.get("git_mirror_fetch", "true").lower() == "true")
+        if commit_source != "bitbucket":
+            self.logger.error("Unknown commit_source={}, expected bitbucket or git_mirror".format(commit_source))
+            exit(1)
+        # pages of commits/tags fetched ahead of the scan, 0 fetches each page only once the previous one is read
+        return BitbucketCommitSource(self.logger, self.bitbucket_client, self._handle_response,
+                                     int(os.environ.get("bitbucket_prefetch_pages", "1")),
+                                     os.environ.get("bitbucket_api_url",
+                                                    "https://api.bitbucket.org/2.0/repositories/lovelandinnovations"))
+
+    # as_of recomputes a past release as of that instant: commits made after it are ignored and the search
+    # timeframe reaches back from it instead of from now. The ticket index only covers the timeframe back from now,
+    # so the dependency repos are scanned instead.
     def get_devops_metrics_information(self, project_name: str, project_version: str, deployed_instant: datetime,
-                                       deployed_by_user_id: str) -> DevopsMetricsInfo:
+                                       deployed_by_user_id: str, as_of: datetime = None) -> DevopsMetricsInfo:
+        if self.pipeline_mode == "async":
+            from devops_metrics_pipeline import DevopsMetricsPipeline
+            return DevopsMetricsPipeline(self).run(project_name, project_version, deployed_instant,
+                                                   deployed_by_user_id, as_of)
+
         dependency_repos = self._get_repos_to_check(project_name)
         released_tickets = self.get_released_tickets(project_name, project_version)
         released_ticket_ids = [ticket["ticket_id"] for ticket in released_tickets]
 
-        merge_info_by_ticket_id = self._get_ticket_merge_dates(project_name, dependency_repos, project_version,
-                                                              released_ticket_ids)
+        with self.instrumentation.timer("phase", phase="commit_scans"):
+            merge_info_by_ticket_id = self._get_ticket_merge_dates(project_name, dependency_repos, project_version,
+                                                                  released_ticket_ids,
+                                                                  self._get_ticket_created_dates(released_tickets),
+                                                                  as_of)
+
+        return self._build_devops_metrics_info(project_name, project_version, deployed_instant, deployed_by_user_id,
+                                               released_tickets, merge_info_by_ticket_id)
 
+    def _build_devops_metrics_info(self, project_name: str, project_version: str, deployed_instant: datetime,
+                                   deployed_by_user_id: str, released_tickets: List,
+                                   merge_info_by_ticket_id: dict) -> DevopsMetricsInfo:
         deployment_info: DeploymentInfo = DeploymentInfo(project_name, project_version, deployed_instant,
                                                          deployed_by_user_id)
         deployed_tickets: List[DeployedTicket] = []
@@ -71,11 +185,37 @@ class DevopsMetricsService:
 
         return metrics_info
 
+    def _get_ticket_created_dates(self, released_tickets: List) -> Optional[dict]:
+        if not self.stop_dependency_scans_on_release_tickets:
+            return None
+        return {ticket["ticket_id"]: ticket["created_datetime"] for ticket in released_tickets}
+
     def get_released_tickets(self, project_name: str, project_version: str) -> List:
+        with self.instrumentation.timer("phase", phase="jira"):
+            return self._get_released_tickets(project_name, project_version)
 
-        jira: jira.client.JIRA = JIRA(server="https://lovelandinnovations.atlassian.net/",
-                    basic_auth=(os.environ.get("jira_user_id"), os.environ.get("jira_api_key")))
+    def _get_released_tickets(self, project_name: str, project_version: str) -> List:
         jira_version_str = self._get_jira_release_version_str(project_name, project_version)
+        # a fixed order keeps the concurrently fetched pages from overlapping
+        query_str = "project=" + self.jira_project_str + " AND fixVersion=" + jira_version_str + " ORDER BY key"
+
+        cached_release = None
+        if self.jira_release_cache is not None:
+            cached_release = self.jira_release_cache.get(self.jira_project_str, jira_version_str)
+            if cached_release is not None and cached_release["is_fresh"]:
+                self.logger.info("Using cached tickets for project={} and version={}"
+                                 .format(self.jira_project_str, jira_version_str))
+                return cached_release["released_tickets"]
+
+        jira: jira.client.JIRA = self._get_jira_client()
+        if cached_release is not None:
+            issues_updated = self._get_released_issues_updated(jira, query_str)
+            if issues_updated == cached_release["issues_updated"]:
+                self.logger.info("Cached tickets still current for project={} and version={}"
+                                 .format(self.jira_project_str, jira_version_str))
+                self.jira_release_cache.touch(self.jira_project_str, jira_version_str)
+                return cached_release["released_tickets"]
+
         self.logger.info("Pulling tickets for project={} and version={}".format(self.jira_project_str,
                                                                                 jira_version_str))
         version = jira.get_project_version_by_name(self.jira_project_str, jira_version_str)
@@ -84,55 +224,101 @@ class DevopsMetricsService:
                                                                                             jira_version_str))
             exit(1)
 
-        query_str = "project=" + self.jira_project_str + " AND fixVersion=" + jira_version_str
-        released_tickets = jira.search_issues(jql_str=query_str)
-        return self._convert_released_tickets_to_dicts(released_tickets)
+        # the issue links come with the search, so caused-by tickets need no request per bug
+        released_tickets = self._get_jira_search(jira).search(query_str, "issuetype,created,issuelinks,updated")
+        released_ticket_dicts = self._convert_released_tickets_to_dicts(released_tickets)
+        if self.jira_release_cache is not None:
+            self.jira_release_cache.put(self.jira_project_str, jira_version_str, released_ticket_dicts,
+                                        {ticket["key"]: ticket["fields"]["updated"] for ticket in released_tickets})
+        return released_ticket_dicts
+
+    def _get_released_issues_updated(self, jira: jira.client.JIRA, query_str: str) -> dict:
+        issues = self._get_jira_search(jira).search(query_str, "updated")
+        return {issue["key"]: issue["fields"]["updated"] for issue in issues}
 
-    def _convert_released_tickets_to_dicts(self, released_tickets: array):
+    def _get_jira_search(self, jira: jira.client.JIRA) -> JiraSearch:
+        return JiraSearch(self.logger, jira, self.jira_page_size, self.jira_max_concurrent_requests)
+
+    # released_tickets are the issues as returned by the search, see JiraSearch
+    def _convert_released_tickets_to_dicts(self, released_tickets: List[dict]) -> List[dict]:
         released_ticket_dicts = []
-        for ticket in released_tickets:
+        for released_ticket in released_tickets:
+            ticket_fields = released_ticket["fields"]
+            ticket_type = ticket_fields["issuetype"]["name"]
             caused_by_ticket_id = ""
             if ticket_type == "Bug":
-                caused_by_ticket = self._get_caused_by_ticket(released_ticket)
-                caused_by_ticket_id = str(caused_by_ticket) if caused_by_ticket is not "None" else ""
+                caused_by_ticket_id = self._get_caused_by_ticket(released_ticket) or ""
 
             ticket_dict = {
-                "ticket_id": str(ticket),
-                "type": str(released_ticket.fields.issuetype),
-                "created_datetime": parser.parse(released_ticket.fields.created),
+                "ticket_id": released_ticket["key"],
+                "type": ticket_type,
+                "created_datetime": parse_timestamp(ticket_fields["created"]),
                 "caused_by": caused_by_ticket_id
             }
             released_ticket_dicts.append(ticket_dict)
 
         return released_ticket_dicts
 
-    def extract_ticket_merge_info_from_commits(self, repository: str, previous_release_hash: str) -> dict:
-        commits_url = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{}/commits/master?" \
-                      "fields=pagelen,values.message,values.date,values.author.raw,values.hash,next".format(repository)
-
+    # With release_hash the scan reads only the commits reachable from it and not from previous_release_hash,
+    # instead of walking master until the previous release. With as_of, commits made after it are skipped and the
+    # timeframe is measured back from it.
+    def extract_ticket_merge_info_from_commits(self, repository: str, previous_release_hash: str,
+                                               release_tickets: set = None, ticket_created_dates: dict = None,
+                                               release_hash: str = None, as_of: datetime = None) -> dict:
+        scan_start = time.perf_counter()
         merge_info_by_ticket = {}
-
-        while commits_url is not None:
-            self.logger.info("requesting commit info at {}".format(commits_url))
-            response = requests.get(url=commits_url, headers=self.bitbucket_auth_header)
-            self._handle_response(response)
-
-            commits_dict = json.loads(response.content)
-            for commit in commits_dict["values"]:
-                commit_date = parser.parse(commit["date"])
+        commits_without_ticket = 0
+        scan_stats = {"pages_fetched": 0, "commits_read": 0, "estimated_pages_skipped": 0, "stop_reason": "end"}
+        # release tickets not yet found in this repo, oldest first
+        pending_tickets = None
+        if ticket_created_dates is not None and release_tickets is not None:
+            pending_tickets = deque(sorted(release_tickets, key=lambda ticket_id: ticket_created_dates.get(
+                ticket_id, datetime.min.replace(tzinfo=pytz.utc))))
+        time_based_limit = self._get_search_time_limit(as_of)
+        newest_commit_date = None
+
+        if release_hash:
+            commits = self.commit_source.iter_commit_range(repository, release_hash, previous_release_hash,
+                                                           scan_stats)
+        else:
+            commits = self._iter_commits(repository, scan_stats)
+        with closing(commits):
+            for commit in commits:
+                commit_date = commit.date
+                if as_of is not None and commit_date > as_of:
+                    continue
+                newest_commit_date = newest_commit_date or commit_date
                 # short cicuit the loop if we've reached the previous release in our search
-                if self._is_finished_searching_commits(commit, commit_date, previous_release_hash):
+                if self._is_finished_searching_commits(commit, commit_date, previous_release_hash,
+                                                       time_based_limit):
                     self.logger.info("Stopping search in git for ticket matches. "
                                      "repo={} tickets_found={}".format(repository, len(merge_info_by_ticket)))
+                    scan_stats["stop_reason"] = "search_limit"
                     break
 
-                # parse message for the tickets found in the commit message
-                author_raw = commit["author"]["raw"]
-                author_email = re.findall(r"[^<]*<([^>]*)>", author_raw)[0]
-
+                if pending_tickets is not None:
+                    stop_reason = self._get_release_ticket_stop_reason(commit_date, pending_tickets,
+                                                                       merge_info_by_ticket, ticket_created_dates)
+                    if stop_reason is not None:
+                        self.logger.info("Stopping search in git, no release tickets left to find. repo={} reason={} "
+                                         "tickets_found={}".format(repository, stop_reason, len(merge_info_by_ticket)))
+                        scan_stats["stop_reason"] = stop_reason
+                        scan_stats["estimated_pages_skipped"] = self._estimate_pages_skipped(
+                            scan_stats, newest_commit_date, commit_date, time_based_limit)
+                        break
+
+                scan_stats["commits_read"] += 1
                 # ignore commits by jenkins
+                author_email = commit.author_email
                 if "jenkins" not in author_email.lower():
-                    commit_tickets = self._get_tickets_referenced_in_commit(commit)
+                    # parse message for the tickets found in the commit message
+                    commit_tickets = self.ticket_matcher.find_tickets(commit.message)
+                    if len(commit_tickets) == 0:
+                        commits_without_ticket += 1
+                        self.logger.debug("No ticket found in commit with message={} author={}"
+                                          .format(commit.message, author_email))
+                    elif release_tickets is not None:
+                        commit_tickets = [ticket for ticket in commit_tickets if ticket in release_tickets]
                     for ticket in commit_tickets:
                         if ticket not in merge_info_by_ticket:
                             # ignore case if there are later commits with the ticket number, we only want the
@@ -140,44 +326,265 @@ class DevopsMetricsService:
                             merge_info_by_ticket[ticket] = {"date": commit_date, "author": author_email,
                                                             "repositories": [repository]}
 
-            commits_url = commits_dict.get("next", None)
-
+        if commits_without_ticket > 0:
+            self.logger.warning("Commits with no ticket found. repo={} count={}"
+                                .format(repository, commits_without_ticket))
+        self.logger.info("Scan finished. repo={} pages_fetched={} estimated_pages_skipped={} commits_read={} "
+                         "stop_reason={}".format(repository, scan_stats["pages_fetched"],
+                                                 scan_stats["estimated_pages_skipped"], scan_stats["commits_read"],
+                                                 scan_stats["stop_reason"]))
+        self.scan_stats[repository] = scan_stats
+        self.instrumentation.record_time("repo_scan", time.perf_counter() - scan_start, repository=repository)
+        self.instrumentation.increment("commits_parsed", scan_stats["commits_read"], repository=repository)
         return merge_info_by_ticket
 
+    # A ticket can't be referenced by a commit made before the ticket was created, so once the scan is older than
+    # every release ticket this repo hasn't referenced yet, the rest of the window can't change the result
+    def _get_release_ticket_stop_reason(self, commit_date: datetime, pending_tickets: deque,
+                                        merge_info_by_ticket: dict, ticket_created_dates: dict) -> Optional[str]:
+        while len(pending_tickets) > 0 and pending_tickets[0] in merge_info_by_ticket:
+            pending_tickets.popleft()
+        if len(pending_tickets) == 0:
+            return "all_release_tickets_found"
+        oldest_pending_created = ticket_created_dates.get(pending_tickets[0])
+        if oldest_pending_created is not None and commit_date < oldest_pending_created:
+            return "older_than_release_tickets"
+        return None
+
+    # Extrapolates from the pages read so far how many more the time window would have needed
+    def _estimate_pages_skipped(self, scan_stats: dict, newest_commit_date: datetime, stop_commit_date: datetime,
+                                time_based_limit: datetime) -> int:
+        if scan_stats["pages_fetched"] == 0 or scan_stats["commits_read"] == 0 \
+                or stop_commit_date <= time_based_limit or newest_commit_date <= stop_commit_date:
+            return 0
+        commits_per_page = scan_stats["commits_read"] / scan_stats["pages_fetched"]
+        seconds_per_commit = (newest_commit_date - stop_commit_date).total_seconds() / scan_stats["commits_read"]
+        remaining_commits = (stop_commit_date - time_based_limit).total_seconds() / seconds_per_commit
+        return math.ceil(remaining_commits / commits_per_page)
+
+    # Yields the commits on master newest first. With a commit store configured, Bitbucket is only paged until the
+    # newest cached commit is reached, the rest is served from the store and history older than the store's tail is
+    # paged in from Bitbucket only if the caller keeps reading. A scan that stops before the cached head keeps its
+    # commits as a segment, which later scans read from the store and page on from until they reach the head.
+    def _iter_commits(self, repository: str, scan_stats: dict = None) -> Iterator[CommitRecord]:
+        if self.commit_store is None:
+            yield from self.commit_source.iter_commits(repository, "master", scan_stats)
+            return
+
+        cached_head = self.commit_store.get_head(repository)
+        segment_head = self.commit_store.get_segment_head(repository) if cached_head is not None else None
+        new_commits = []
+        reached_hash = None
+        finished_paging = False
+        try:
+            for commit in self.commit_source.iter_commits(repository, "master", scan_stats):
+                if commit.hash in (cached_head, segment_head):
+                    reached_hash = commit.hash
+                    break
+                new_commits.append(commit)
+                yield commit
+            finished_paging = True
+        finally:
+            if reached_hash is not None and reached_hash == cached_head:
+                self._add_newer_commits(repository, cached_head, new_commits)
+            elif reached_hash is None and len(new_commits) > 0:
+                self._store_unjoined_commits(repository, cached_head, new_commits, finished_paging)
+
+        if reached_hash is None:
+            return
+        if reached_hash == segment_head:
+            reached_cached_head = yield from self._iter_segment(repository, cached_head, new_commits, scan_stats)
+            if not reached_cached_head:
+                return
+        self.logger.info("Reached cached commits for repo={} after {} new commits"
+                         .format(repository, len(new_commits)))
+        yield from self.commit_store.iter_commits(repository, cached_head)
+
+        if self.commit_store.has_reached_root(repository):
+            return
+        cached_tail = self.commit_store.get_tail(repository)
+        older_commits = []
+        finished_paging = False
+        try:
+            for commit in self.commit_source.iter_commits(repository, cached_tail, scan_stats):
+                if commit.hash == cached_tail:
+                    continue
+                older_commits.append(commit)
+                yield commit
+            finished_paging = True
+        finally:
+            self.commit_store.add_older_commits(repository, older_commits, reached_root=finished_paging)
+
+    # Yields the segment and then pages on from its tail until the cached head, returning whether it was reached.
+    # Whatever was read is stored again, the segment grown by new_commits and the gap, or joined onto the head.
+    def _iter_segment(self, repository: str, cached_head: str, new_commits: List[CommitRecord],
+                      scan_stats: dict = None) -> Generator[CommitRecord, None, bool]:
+        segment = self.commit_store.get_segment(repository)
+        commits = new_commits + segment
+        reached_cached_head = False
+        finished_paging = False
+        try:
+            yield from segment
+            for commit in self.commit_source.iter_commits(repository, segment[-1].hash, scan_stats):
+                if commit.hash == segment[-1].hash:
+                    continue
+                if commit.hash == cached_head:
+                    reached_cached_head = True
+                    break
+                commits.append(commit)
+                yield commit
+            finished_paging = True
+        finally:
+            if not reached_cached_head:
+                self._store_unjoined_commits(repository, cached_head, commits, finished_paging)
+            elif self.commit_store.join_segment_if_head(repository, cached_head, commits):
+                self.logger.info("Joined {} segment commits to the cached commits of repo={}"
+                                 .format(len(commits), repository))
+            else:
+                self.logger.info("Cached head of repo={} moved during the scan, not joining its segment"
+                                 .format(repository))
+        return reached_cached_head
+
+    # Another scan of the same repo, in a daemon or batch worker sharing the store, may have stored newer commits
+    # since cached_head was read. Those already lead into cached_head, so these are dropped rather than stacked on top.
+    def _add_newer_commits(self, repository: str, cached_head: str, new_commits: List[CommitRecord]) -> None:
+        if len(new_commits) == 0:
+            return
+        if not self.commit_store.add_newer_commits_if_head(repository, cached_head, new_commits):
+            self.logger.info("Cached head of repo={} moved during the scan, not storing its {} new commits"
+                             .format(repository, len(new_commits)))
+
+    # Commits that couldn't be joined to the cached head. Paging all the way to the root without meeting the head
+    # means master was rewritten, so they replace the cached history, otherwise they are kept as the segment.
+    def _store_unjoined_commits(self, repository: str, cached_head: Optional[str], commits: List[CommitRecord],
+                                reached_root: bool) -> None:
+        if cached_head is None or reached_root:
+            self.commit_store.replace_commits(repository, commits, reached_root=reached_root)
+        else:
+            self.commit_store.replace_segment(repository, commits)
+
     def get_last_release_hash(self, repository: str, new_version: str) -> str:
-        tags_url = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{}/refs/tags?" \
-                   "fields=values.name,values.target.hash,values.target.date&sort=-target.date".format(repository)
+        with self.instrumentation.timer("phase", phase="previous_release"):
+            return self._get_last_release_hash(repository, new_version)
+
+    # The tagged commit of the version being deployed, None when it isn't tagged. The tag index was just refreshed
+    # by the previous release lookup.
+    def get_release_hash(self, repository: str, version: str) -> Optional[str]:
+        if self.tag_index is not None:
+            return self.tag_index.get_release_hash(repository, version)
 
         version_pattern = re.compile(r"^\d+\.\d+\.\d+$")
         version_tags_count = 0
-
-        while tags_url is not None:
-            self.logger.info("requesting tag info at {}".format(tags_url))
-            response = requests.get(url=tags_url, headers=self.bitbucket_auth_header)
-            self._handle_response(response)
-
-            tags_dict = json.loads(response.content)
-            for tag in tags_dict["values"]:
+        with closing(self._iter_tags(repository)) as tags:
+            for tag in tags:
+                if tag["name"] == version:
+                    return tag["target"]["hash"]
                 if re.match(version_pattern, tag["name"]):
-                    # go back two release versions to manage overlap on QA window
-                    if tag["name"] != new_version and version_tags_count > 1:
-                        self.logger.info("found next version tag {} at hash={}"
-                                         .format(tag["name"], tag["target"]["hash"]))
-                        return tag["target"]["hash"]
                     version_tags_count += 1
+                    # the deployed version is one of the newest tags, the same window the previous release is in
+                    if version_tags_count > 2:
+                        return None
+        return None
+
+    # Release tags (X.Y.Z) of the repo oldest first as (version, tagged commit date), read the same way as the
+    # previous release lookup
+    def get_release_tags(self, repository: str) -> List[Tuple[str, Optional[str]]]:
+        if self.tag_index is not None:
+            self._refresh_tag_index(repository)
+            tag_dates = self.tag_index.get_tag_dates(repository)
+            return [(version, tag_dates.get(version)) for version in self.tag_index.get_versions(repository)]
 
-            tags_url = tags_dict.get("next", None)
+        version_pattern = re.compile(r"^\d+\.\d+\.\d+$")
+        release_tags = [(tag["name"], tag["target"].get("date")) for tag in self._iter_tags(repository)
+                        if re.match(version_pattern, tag["name"])]
+        return sorted(release_tags, key=lambda release_tag: tuple(int(part) for part in release_tag[0].split(".")))
+
+    def _get_last_release_hash(self, repository: str, new_version: str) -> str:
+        if self.tag_index is not None:
+            self._refresh_tag_index(repository)
+            # go back two release versions to manage overlap on QA window
+            previous_release_hash = self.tag_index.get_release_hash_before(repository, new_version, 2)
+            self.logger.info("found previous release for version {} at hash={}"
+                             .format(new_version, previous_release_hash))
+            return previous_release_hash
+
+        version_pattern = re.compile(r"^\d+\.\d+\.\d+$")
+        version_tags_count = 0
+
+        for tag in self._iter_tags(repository):
+            if re.match(version_pattern, tag["name"]):
+                # go back two release versions to manage overlap on QA window
+                if tag["name"] != new_version and version_tags_count > 1:
+                    self.logger.info("found next version tag {} at hash={}"
+                                     .format(tag["name"], tag["target"]["hash"]))
+                    return tag["target"]["hash"]
+                version_tags_count += 1
+
+    # Pages the date-sorted tags only until the newest tag seen by the previous refresh
+    def _refresh_tag_index(self, repository: str) -> None:
+        with self.tag_index.get_repository_lock(repository):
+            last_seen_tag = self.tag_index.get_last_seen_tag(repository)
+            new_tags = []
+            with closing(self._iter_tags(repository)) as tags:
+                for tag in tags:
+                    if tag["name"] == last_seen_tag:
+                        break
+                    new_tags.append(tag)
+            self.tag_index.add_tags(repository, new_tags)
+
+    # Yields tags newest first. When tag caching is on, the pages read so far are kept per repo so later lookups in
+    # the same process only page past what has already been read.
+    def _iter_tags(self, repository: str) -> Iterator[dict]:
+        if not self.cache_tags_in_memory:
+            with closing(self.commit_source.iter_tags(repository)) as tags:
+                yield from tags
+            return
+
+        with self._tag_cache_lock:
+            # the cached walk is resumed by later lookups
+            tag_cache = self._tag_cache.setdefault(repository, {
+                "tags": [], "pages": self.commit_source.iter_tags(repository, prefetch=False),
+                "lock": threading.Lock()})
+        index = 0
+        while True:
+            with tag_cache["lock"]:
+                if index == len(tag_cache["tags"]):
+                    tag = next(tag_cache["pages"], None)
+                    if tag is None:
+                        return
+                    tag_cache["tags"].append(tag)
+                tag = tag_cache["tags"][index]
+            yield tag
+            index += 1
 
     # Guide search in other repos by tickets associated with the release, limit to most recent 3 months
     # There's an "app" search which is implemented here, then a dependency search for other tickets using the above
     # criteria
+    # When ticket_created_dates is given, each dependency repo scan stops as soon as it can no longer find a
+    # release ticket instead of always reading the full timeframe.
     def _get_ticket_merge_dates(self, repository: str, internal_repos_to_check: array, new_version: str,
-                                release_tickets: array) -> dict:
-
-        previous_release_hash = self.get_last_release_hash(repository, new_version)
-        app_ticket_info_map = self.extract_ticket_merge_info_from_commits(repository, previous_release_hash)
-        for internal_repo in internal_repos_to_check:
-            cur_repo_ticket_info = self.extract_ticket_merge_info_from_commits(internal_repo, '')
+                                release_tickets: array, ticket_created_dates: dict = None,
+                                as_of: datetime = None) -> dict:
+
+        release_tickets = set(release_tickets)
+        scans = [partial(self._extract_app_ticket_merge_info, repository, new_version, release_tickets, as_of)]
+        if self.ticket_index is not None and as_of is None:
+            scans.extend(partial(self.refresh_ticket_index, internal_repo) for internal_repo in internal_repos_to_check)
+            app_ticket_info_map, *_ = self._run_repo_scans(scans)
+            dependency_results = self._get_indexed_merge_info(internal_repos_to_check, release_tickets)
+        else:
+            scans.extend(partial(self.extract_ticket_merge_info_from_commits, internal_repo, '', release_tickets,
+                                 ticket_created_dates, as_of=as_of)
+                         for internal_repo in internal_repos_to_check)
+            app_ticket_info_map, *dependency_results = self._run_repo_scans(scans)
+
+        return self._merge_ticket_merge_info(app_ticket_info_map, internal_repos_to_check, dependency_results,
+                                             release_tickets)
+
+    def _merge_ticket_merge_info(self, app_ticket_info_map: dict, internal_repos_to_check: array,
+                                 dependency_results: List[dict], release_tickets: set) -> dict:
+        # merge in the order the repos are listed so the result doesn't depend on which scan finished first
+        for internal_repo, cur_repo_ticket_info in zip(internal_repos_to_check, dependency_results):
             for ticket_id in cur_repo_ticket_info:
                 if ticket_id in release_tickets:
                     if ticket_id in app_ticket_info_map:
@@ -192,25 +599,59 @@ class DevopsMetricsService:
 
         return app_ticket_info_map
 
+    # Indexes the commits on master made since the previous refresh, reading back no further than the search
+    # timeframe. Jenkins commits are skipped, as they are in a scan.
+    def refresh_ticket_index(self, repository: str) -> None:
+        time_based_limit = self._get_search_time_limit()
+        with self.ticket_index.get_repository_lock(repository):
+            indexed_head = self.ticket_index.get_indexed_head(repository)
+            new_commits = []
+            with closing(self._iter_commits(repository)) as commits:
+                for commit in commits:
+                    if commit.hash == indexed_head or commit.date < time_based_limit:
+                        break
+                    new_commits.append(commit)
+            tickets_by_commit = [[] if "jenkins" in commit.author_email.lower()
+                                 else self.ticket_matcher.find_tickets(commit.message) for commit in new_commits]
+            self.ticket_index.add_commits(repository, new_commits, tickets_by_commit)
+
+    def _get_indexed_merge_info(self, internal_repos_to_check: array, release_tickets: set) -> List[dict]:
+        merge_info_by_repo = self.ticket_index.get_merge_info(internal_repos_to_check, release_tickets,
+                                                              self._get_search_time_limit())
+        return [merge_info_by_repo[internal_repo] for internal_repo in internal_repos_to_check]
+
+    def _get_search_time_limit(self, as_of: datetime = None) -> datetime:
+        return (as_of or datetime.now(pytz.utc)) - relativedelta(months=self.git_search_timeframe_in_months)
+
+    def _extract_app_ticket_merge_info(self, repository: str, new_version: str, release_tickets: set,
+                                       as_of: datetime = None) -> dict:
+        previous_release_hash = self.get_last_release_hash(repository, new_version)
+        return self.scan_app_repo(repository, new_version, previous_release_hash, release_tickets, as_of=as_of)
+
+    # In range mode the scan falls back to walking master when either end of the range isn't known
+    def scan_app_repo(self, repository: str, new_version: str, previous_release_hash: str,
+                      release_tickets: set = None, as_of: datetime = None) -> dict:
+        release_hash = None
+        if self.app_scan_mode == "range" and previous_release_hash:
+            release_hash = self.get_release_hash(repository, new_version)
+            if release_hash is None:
+                self.logger.info("No tag for version {} in repo={}, walking master instead of a range"
+                                 .format(new_version, repository))
+        return self.extract_ticket_merge_info_from_commits(repository, previous_release_hash, release_tickets,
+                                                           release_hash=release_hash, as_of=as_of)
+
+    def _run_repo_scans(self, scans: List) -> List[dict]:
+        if self.max_concurrent_repo_scans <= 1 or len(scans) <= 1:
+            return [scan() for scan in scans]
+
+        self.logger.info("Scanning {} repos with concurrency={}".format(len(scans), self.max_concurrent_repo_scans))
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent_repo_scans, len(scans))) as executor:
+            futures = [executor.submit(scan) for scan in scans]
+            return [future.result() for future in futures]
+
     def _get_jira_release_version_str(self, project_name: str, project_version: str) -> str:
-        prefix: str = ""
-        if project_name == "cv-management-web":
-            prefix = "cvmw"
-        elif project_name == "cv-management-web-frontend":
-            prefix = "cvmwf"
-        elif project_name == "cv-event-listener":
-            prefix = "cvel"
-        elif project_name == "model-generator":
-            prefix = "modgen"
-        elif project_name == "measurements-generator":
-            prefix = "measgen"
-        elif project_name == "shading-analysis-generator":
-            prefix = "shadegen"
-        elif project_name == "cv-management-admin-web":
-            prefix = "cvmadmin"
-        elif project_name == "cv-management-admin-web-frontend":
-            prefix = "cvmadminwf"
-        else:
+        prefix = JIRA_VERSION_PREFIXES.get(project_name)
+        if prefix is None:
             self.logger.error("The project given does not match any known projects. providedProject={}"
                               .format(project_name))
             exit(5)
@@ -219,42 +660,25 @@ class DevopsMetricsService:
 
         return prefix + "-" + jira_version
 
-    def _is_finished_searching_commits(self, commit: dict, commit_date: datetime, previous_release_hash: str) -> bool:
-        time_based_limit = datetime.now(pytz.utc) - relativedelta(months=self.git_search_timeframe_in_months)
-
+    def _is_finished_searching_commits(self, commit: CommitRecord, commit_date: datetime, previous_release_hash: str,
+                                       time_based_limit: datetime) -> bool:
         result = False
-        if commit["hash"] == previous_release_hash:
-            self.logger.info("commit found with hash={}".format(commit["hash"]))
+        if commit.hash == previous_release_hash:
+            self.logger.info("commit found with hash={}".format(commit.hash))
             result = True
         elif not previous_release_hash and commit_date < time_based_limit:
             self.logger.info("commit found from date={}".format(commit_date))
             result = True
         return result
 
-    def _get_tickets_referenced_in_commit(self, commit: dict) -> array:
-        commit_tickets = []
-        for jira_project_str in self.jira_possible_projects:
-            regex_str = r"[-\(\s\/]?(" + jira_project_str + r"\-[0-9]+)[-\)\s\/]?"
-            tickets_found = re.findall(regex_str, commit["message"])
-
-            for ticket_found in tickets_found:
-                commit_tickets.append(ticket_found)
-
-        if len(commit_tickets) == 0:
-            author_raw = commit["author"]["raw"]
-            self.logger.warning("No ticket found in commit with message={} author={}"
-                                .format(commit["message"], author_raw))
-        return commit_tickets
-
-
-    def _get_caused_by_ticket(self, released_ticket: any) -> any:
-        ticket_links = released_ticket.fields.issuelinks
+    def _get_caused_by_ticket(self, released_ticket: dict) -> Optional[str]:
+        ticket_links = released_ticket["fields"].get("issuelinks") or []
         for ticket_link in ticket_links:
             # check if the link is a "Causes" or "Caused by" type of link
-            if ticket_link.type.name == "Problem/Incident":
+            if ticket_link["type"]["name"] == "Problem/Incident":
                 # check if the link is a "Caused by", we only want to capture this end of the relationship
-                if hasattr(ticket_link, "inwardIssue"):
-                    return ticket_link.inwardIssue
+                if "inwardIssue" in ticket_link:
+                    return ticket_link["inwardIssue"]["key"]
 
 
     def _get_repos_to_check(self, project_name: str):
@@ -271,6 +695,15 @@ class DevopsMetricsService:
 
         return dependency_repos
 
+    def _get_jira_client(self) -> jira.client.JIRA:
+        with self._jira_client_lock:
+            if self._jira_client is None:
+                self._jira_client = JIRA(server=os.environ.get("jira_server_url",
+                                                               "https://lovelandinnovations.atlassian.net/"),
+                                         basic_auth=(os.environ.get("jira_user_id"), os.environ.get("jira_api_key")))
+                self._jira_client._session.hooks["response"].append(self.instrumentation.record_response)
+            return self._jira_client
+
     def _get_auth_header(self, user: str, password: str) -> dict:
         basic_auth = "{}:{}".format(user, password)
         basic_bytes = basic_auth.encode("ascii")
@@ -0,0 +1,137 @@
+import argparse
+import bisect
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+# Release tags (X.Y.Z) of each repo kept in semver order, so "N releases before version X" is a bisection instead
+# of a walk over the date-sorted tag pages. last_seen_tag is the newest tag of any kind read from Bitbucket, which
+# is where the next incremental refresh stops paging.
+class TagIndex:
+    version_pattern = re.compile(r"^(\d+)\.(\d+)\.(\d+)$")
+
+    def __init__(self, logger: logging.Logger, db_path: str) -> None:
+        self.logger = logger
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._repository_locks = {}
+        self._sorted_tags_by_repo = {}
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS release_tag
+                                     (repository TEXT NOT NULL, name TEXT NOT NULL, hash TEXT NOT NULL,
+                                     date TEXT, PRIMARY KEY (repository, name))""")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS tag_index_state
+                                     (repository TEXT PRIMARY KEY, last_seen_tag TEXT NOT NULL)""")
+
+    # held while refreshing so concurrent lookups for the same repo don't page the same tags twice
+    def get_repository_lock(self, repository: str) -> threading.Lock:
+        with self._lock:
+            return self._repository_locks.setdefault(repository, threading.Lock())
+
+    def get_last_seen_tag(self, repository: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT last_seen_tag FROM tag_index_state WHERE repository=?",
+                                           (repository,)).fetchone()
+        return row[0] if row is not None else None
+
+    # tags are given newest first, as Bitbucket returns them
+    def add_tags(self, repository: str, tags: List[dict]) -> None:
+        if len(tags) == 0:
+            return
+        release_tags = [(repository, tag["name"], tag["target"]["hash"], tag["target"].get("date"))
+                        for tag in tags if self.version_pattern.match(tag["name"])]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO release_tag (repository, name, hash, date) "
+                                         "VALUES(?, ?, ?, ?)", release_tags)
+            self._connection.execute("INSERT OR REPLACE INTO tag_index_state (repository, last_seen_tag) VALUES(?, ?)",
+                                     (repository, tags[0]["name"]))
+            self._sorted_tags_by_repo.pop(repository, None)
+        self.logger.info("Indexed {} new release tags for repo={}".format(len(release_tags), repository))
+
+    # A version that isn't tagged is treated as the newest release, the same assumption the date-ordered tag walk
+    # made about the version being deployed.
+    def get_release_hash_before(self, repository: str, version: str, releases_back: int) -> Optional[str]:
+        sorted_tags = self._get_sorted_tags(repository)
+        version_key = self._get_version_key(version)
+        position = len(sorted_tags) - 1
+        if version_key is not None:
+            index = bisect.bisect_left(sorted_tags, (version_key,))
+            if index < len(sorted_tags) and sorted_tags[index][0] == version_key:
+                position = index
+
+        if position - releases_back < 0:
+            return None
+        return sorted_tags[position - releases_back][2]
+
+    def get_release_hash(self, repository: str, version: str) -> Optional[str]:
+        sorted_tags = self._get_sorted_tags(repository)
+        version_key = self._get_version_key(version)
+        index = bisect.bisect_left(sorted_tags, (version_key,)) if version_key is not None else len(sorted_tags)
+        if index < len(sorted_tags) and sorted_tags[index][0] == version_key:
+            return sorted_tags[index][2]
+        return None
+
+    def get_versions(self, repository: str) -> List[str]:
+        return [name for _, name, _ in self._get_sorted_tags(repository)]
+
+    # date of each release tag's commit by tag name, None when the tag was indexed without one
+    def get_tag_dates(self, repository: str) -> Dict[str, Optional[str]]:
+        with self._lock:
+            rows = self._connection.execute("SELECT name, date FROM release_tag WHERE repository=?",
+                                            (repository,)).fetchall()
+        return dict(rows)
+
+    def rebuild(self, repository: str = None) -> None:
+        with self._lock, self._connection:
+            if repository is None:
+                self._connection.execute("DELETE FROM release_tag")
+                self._connection.execute("DELETE FROM tag_index_state")
+                self._sorted_tags_by_repo.clear()
+            else:
+                self._connection.execute("DELETE FROM release_tag WHERE repository=?", (repository,))
+                self._connection.execute("DELETE FROM tag_index_state WHERE repository=?", (repository,))
+                self._sorted_tags_by_repo.pop(repository, None)
+        self.logger.info("Cleared tag index for repository={}".format(repository or "all"))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _get_sorted_tags(self, repository: str) -> List[Tuple[Tuple[int, int, int], str, str]]:
+        with self._lock:
+            if repository not in self._sorted_tags_by_repo:
+                rows = self._connection.execute("SELECT name, hash FROM release_tag WHERE repository=?",
+                                                (repository,)).fetchall()
+                self._sorted_tags_by_repo[repository] = sorted((self._get_version_key(name), name, tag_hash)
+                                                               for name, tag_hash in rows)
+            return self._sorted_tags_by_repo[repository]
+
+    def _get_version_key(self, version: str) -> Optional[Tuple[int, int, int]]:
+        match = self.version_pattern.match(version)
+        if match is None:
+            return None
+        return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    arg_parser = argparse.ArgumentParser(description="Maintain the local release tag index")
+    arg_parser.add_argument("--rebuild", action="store_true", help="Clear indexed tags so they are refetched.")
+    arg_parser.add_argument("--repository", help="Limit --rebuild to a single repository.")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("INFO")
+
+    load_dotenv()
+    tag_index = TagIndex(outer_logger, os.environ["local_cache_db_path"])
+    if args.rebuild:
+        tag_index.rebuild(args.repository)
+    tag_index.close()
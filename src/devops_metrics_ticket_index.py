@@ -0,0 +1,136 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from devops_metrics_info import CommitRecord
+from typing import Dict, Iterable, List, Optional
+
+import pytz
+
+
+# Ticket ID -> newest commit referencing it, per repository. Each repo is indexed incrementally: only commits newer
+# than indexed_head are read on a refresh, so finding which dependency repos touched a release's tickets is a
+# lookup rather than a crawl through every repo's history.
+class TicketIndex:
+    lookup_batch_size = 500
+
+    def __init__(self, logger: logging.Logger, db_path: str) -> None:
+        self.logger = logger
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._repository_locks = {}
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS ticket_merge
+                                     (repository TEXT NOT NULL, ticket_id TEXT NOT NULL, hash TEXT NOT NULL,
+                                     date TEXT NOT NULL, date_epoch REAL NOT NULL, author_email TEXT NOT NULL,
+                                     PRIMARY KEY (ticket_id, repository))""")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS ticket_index_state
+                                     (repository TEXT PRIMARY KEY, indexed_head TEXT NOT NULL)""")
+
+    # held while refreshing so concurrent deployments don't index the same commits twice
+    def get_repository_lock(self, repository: str) -> threading.Lock:
+        with self._lock:
+            return self._repository_locks.setdefault(repository, threading.Lock())
+
+    def get_indexed_head(self, repository: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT indexed_head FROM ticket_index_state WHERE repository=?",
+                                           (repository,)).fetchone()
+        return row[0] if row is not None else None
+
+    # Commits are given newest first and must all be newer than what is already indexed for the repo, so the
+    # first commit seen for a ticket replaces any indexed one
+    def add_commits(self, repository: str, commits: List[CommitRecord], tickets_by_commit: List[List[str]]) -> int:
+        if len(commits) == 0:
+            return 0
+        newest_by_ticket = {}
+        for commit, commit_tickets in zip(commits, tickets_by_commit):
+            for ticket_id in commit_tickets:
+                if ticket_id not in newest_by_ticket:
+                    newest_by_ticket[ticket_id] = commit
+
+        with self._lock, self._connection:
+            self._connection.executemany("""INSERT OR REPLACE INTO ticket_merge
+                                         (repository, ticket_id, hash, date, date_epoch, author_email)
+                                         VALUES(?, ?, ?, ?, ?, ?)""",
+                                         [(repository, ticket_id, commit.hash, commit.date.isoformat(),
+                                           commit.date.timestamp(), commit.author_email)
+                                          for ticket_id, commit in newest_by_ticket.items()])
+            self._connection.execute("INSERT OR REPLACE INTO ticket_index_state (repository, indexed_head) "
+                                     "VALUES(?, ?)", (repository, commits[0].hash))
+        self.logger.info("Indexed {} tickets from {} new commits for repo={}"
+                         .format(len(newest_by_ticket), len(commits), repository))
+        return len(newest_by_ticket)
+
+    # Returns {repository: {ticket_id: {"date", "author", "repositories"}}} for the given repos, in the same shape
+    # extract_ticket_merge_info_from_commits returns for a single repo
+    def get_merge_info(self, repositories: List[str], ticket_ids: Iterable[str],
+                       since: datetime = None) -> Dict[str, dict]:
+        merge_info_by_repo = {repository: {} for repository in repositories}
+        ticket_ids = sorted(set(ticket_ids))
+        since_epoch = since.timestamp() if since is not None else float("-inf")
+        for batch_start in range(0, len(ticket_ids), self.lookup_batch_size):
+            batch = ticket_ids[batch_start:batch_start + self.lookup_batch_size]
+            with self._lock:
+                rows = self._connection.execute("""SELECT repository, ticket_id, date, author_email FROM ticket_merge
+                                                WHERE ticket_id IN ({}) AND date_epoch>=?"""
+                                                .format(",".join("?" * len(batch))),
+                                                batch + [since_epoch]).fetchall()
+            for repository, ticket_id, date, author_email in rows:
+                if repository in merge_info_by_repo:
+                    merge_info_by_repo[repository][ticket_id] = {"date": datetime.fromisoformat(date),
+                                                                 "author": author_email,
+                                                                 "repositories": [repository]}
+        return merge_info_by_repo
+
+    # Drops merges older than max_age_days and reclaims the space, keep it above the service's search timeframe
+    def compact(self, max_age_days: int) -> int:
+        cutoff_epoch = (datetime.now(pytz.utc) - timedelta(days=max_age_days)).timestamp()
+        with self._lock:
+            with self._connection:
+                cursor = self._connection.execute("DELETE FROM ticket_merge WHERE date_epoch<?", (cutoff_epoch,))
+            self._connection.execute("VACUUM")
+        self.logger.info("Compacted ticket index, removed {} merges older than {} days"
+                         .format(cursor.rowcount, max_age_days))
+        return cursor.rowcount
+
+    # The next refresh of a rebuilt repo indexes its history again
+    def rebuild(self, repository: str = None) -> None:
+        with self._lock, self._connection:
+            if repository is None:
+                self._connection.execute("DELETE FROM ticket_merge")
+                self._connection.execute("DELETE FROM ticket_index_state")
+            else:
+                self._connection.execute("DELETE FROM ticket_merge WHERE repository=?", (repository,))
+                self._connection.execute("DELETE FROM ticket_index_state WHERE repository=?", (repository,))
+        self.logger.info("Cleared ticket index for repository={}".format(repository or "all"))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    arg_parser = argparse.ArgumentParser(description="Maintain the local ticket to repository index")
+    arg_parser.add_argument("--rebuild", action="store_true", help="Clear indexed tickets so they are reindexed.")
+    arg_parser.add_argument("--repository", help="Limit --rebuild to a single repository.")
+    arg_parser.add_argument("--compact_older_than_days", type=int,
+                            help="Remove merges older than this and reclaim the space.")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    outer_logger = logging.getLogger(__name__)
+    outer_logger.setLevel("INFO")
+
+    load_dotenv()
+    ticket_index = TicketIndex(outer_logger, os.environ["local_cache_db_path"])
+    if args.rebuild:
+        ticket_index.rebuild(args.repository)
+    if args.compact_older_than_days is not None:
+        ticket_index.compact(args.compact_older_than_days)
+    ticket_index.close()
@@ -0,0 +1,17 @@
+import re
+from typing import Iterable, List
+
+
+# Finds the Jira keys for all of the given projects in a single regex pass over a commit message
+class TicketMatcher:
+    def __init__(self, jira_projects: Iterable[str]) -> None:
+        # longest project first so a project that is a suffix of another can't shadow it
+        projects = sorted(set(jira_projects), key=len, reverse=True)
+        self.pattern = re.compile(r"(?:" + "|".join(re.escape(project) for project in projects) + r")-[0-9]+")
+        self._findall = self.pattern.findall
+
+    def find_tickets(self, message: str) -> List[str]:
+        return self._findall(message)
+
+    def find_tickets_in_batch(self, messages: Iterable[str]) -> List[List[str]]:
+        return list(map(self._findall, messages))
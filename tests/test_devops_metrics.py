@@ -0,0 +1,29 @@
+import logging
+import os
+import subprocess
+import sys
+from devops_metrics import main
+
+
+def test_main__when_already_deployed__then_skip_loading_service(mocker):
+    # Arrange
+    is_deployed_check = mocker.patch("devops_metrics.DevopsMetricsRepository.is_app_version_already_deployed",
+                                     return_value=True)
+    process_new_deployment = mocker.patch("devops_metrics.process_new_deployment")
+
+    # Act
+    main(logging.getLogger(__name__), "cvmweb", "1.0.3", "2020-03-27", "batman")
+
+    # Assert
+    is_deployed_check.assert_called_once_with("cv-management-web", "1.0.3")
+    assert process_new_deployment.call_count == 0
+
+
+def test_import__then_leave_jira_and_bitbucket_stack_unloaded():
+    loaded_modules = subprocess.run(
+        [sys.executable, "-c", "import sys, devops_metrics; print(' '.join(sys.modules))"],
+        env={"PYTHONPATH": os.path.join(os.path.dirname(__file__), "..", "src")}, capture_output=True, text=True,
+        check=True).stdout.split()
+
+    assert [module for module in ["devops_metrics_service", "jira", "requests", "dateutil"]
+            if module in loaded_modules] == []
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import pytz
+from datetime import datetime
+from devops_metrics_analytics import DeploymentDataset, get_deployment_rates, get_lead_time_percentiles, to_buckets
+
+DAY = 86400.0
+NAN = float("nan")
+
+
+def _epoch(year: int, month: int, day: int) -> float:
+    return datetime(year, month, day, tzinfo=pytz.utc).timestamp()
+
+
+@pytest.fixture
+def dataset():
+    # Two web deployments in the week of 2020-03-23 and one in the next week, one modelgen deployment
+    deployment_rows = [("d1", "cv-management-web", _epoch(2020, 3, 23)),
+                       ("d2", "cv-management-web", _epoch(2020, 3, 25)),
+                       ("d3", "cv-management-web", _epoch(2020, 3, 31)),
+                       ("d4", "model-generator", _epoch(2020, 3, 24))]
+    ticket_rows = [("d1", "Story", False, _epoch(2020, 3, 13), _epoch(2020, 3, 21)),
+                   ("d1", "Story", False, _epoch(2020, 3, 3), _epoch(2020, 3, 22)),
+                   ("d2", "Bug", True, _epoch(2020, 3, 24), _epoch(2020, 3, 24)),
+                   ("d3", "Story", False, _epoch(2020, 3, 1), NAN),
+                   ("d4", "Story", False, _epoch(2020, 3, 20), _epoch(2020, 3, 23)),
+                   ("unknown", "Story", True, _epoch(2020, 3, 1), _epoch(2020, 3, 2))]
+    return DeploymentDataset.from_rows(deployment_rows, ticket_rows)
+
+
+def test_from_rows__then_link_tickets_to_deployments_and_drop_unknown(dataset):
+    assert list(dataset.ticket_apps) == ["cv-management-web"] * 4 + ["model-generator"]
+    assert list(dataset.ticket_deployed / DAY - dataset.deployment_deployed[0] / DAY) == [0, 0, 2, 8, 1]
+
+
+def test_to_buckets__then_start_weeks_on_monday_and_months_on_the_first():
+    epochs = np.array([_epoch(2020, 3, 29), _epoch(2020, 3, 30)])
+
+    assert [str(bucket) for bucket in to_buckets(epochs, "week")] == ["2020-03-23", "2020-03-30"]
+    assert [str(bucket) for bucket in to_buckets(epochs, "month")] == ["2020-03-01", "2020-03-01"]
+
+
+def test_get_lead_time_percentiles__then_match_numpy_percentile_per_group(dataset):
+    # Act
+    rows = get_lead_time_percentiles(dataset, ["app_name", "ticket_type"], percentiles=[50, 95])
+
+    # Assert
+    rows_by_key = {(row["app_name"], row["ticket_type"], row["stage"]): row for row in rows}
+    web_story_lead_time = rows_by_key[("cv-management-web", "Story", "created_to_deployed")]
+    assert web_story_lead_time["tickets"] == 3
+    assert web_story_lead_time["p50_days"] == pytest.approx(np.percentile([10, 20, 30], 50))
+    assert web_story_lead_time["p95_days"] == pytest.approx(np.percentile([10, 20, 30], 95))
+    # the ticket with no merge only counts towards the stages it has both ends of
+    assert rows_by_key[("cv-management-web", "Story", "merged_to_deployed")]["tickets"] == 2
+    assert rows_by_key[("model-generator", "Story", "created_to_merged")]["p50_days"] == 3
+
+
+def test_get_deployment_rates__when_bucketed_by_week__then_count_failed_deployments_and_frequency(dataset):
+    # Act
+    rows = get_deployment_rates(dataset, ["app_name"], bucket="week")
+
+    # Assert
+    assert rows == [
+        {"app_name": "cv-management-web", "bucket": "2020-03-23", "deployments": 2, "failed_deployments": 1,
+         "failure_tickets": 1, "change_failure_rate": 0.5, "deployments_per_day": round(2 / 7, 4)},
+        {"app_name": "cv-management-web", "bucket": "2020-03-30", "deployments": 1, "failed_deployments": 0,
+         "failure_tickets": 0, "change_failure_rate": 0.0, "deployments_per_day": round(1 / 7, 4)},
+        {"app_name": "model-generator", "bucket": "2020-03-23", "deployments": 1, "failed_deployments": 0,
+         "failure_tickets": 0, "change_failure_rate": 0.0, "deployments_per_day": round(1 / 7, 4)}]
+
+
+def test_get_lead_time_percentiles__when_300k_tickets__then_count_every_ticket_and_deployment():
+    # Arrange
+    random = np.random.default_rng(7)
+    deployment_count = 20000
+    deployed = _epoch(2019, 1, 1) + random.uniform(0, 365 * DAY, deployment_count)
+    deployment_rows = list(zip(["d{}".format(index) for index in range(deployment_count)],
+                               random.choice(["cvmweb", "modelgen", "shadegen", "measgen"], deployment_count),
+                               deployed))
+    ticket_deployment_index = random.integers(0, deployment_count, 300000)
+    created = deployed[ticket_deployment_index] - random.uniform(0, 60 * DAY, 300000)
+    ticket_rows = list(zip(["d{}".format(index) for index in ticket_deployment_index],
+                           random.choice(["Story", "Bug", "Task"], 300000), random.random(300000) < 0.1,
+                           created, created + random.uniform(0, 10 * DAY, 300000)))
+    dataset = DeploymentDataset.from_rows(deployment_rows, ticket_rows)
+
+    # Act
+    lead_time_rows = get_lead_time_percentiles(dataset, ["app_name", "ticket_type"], bucket="week")
+    rate_rows = get_deployment_rates(dataset, ["app_name"], bucket="week")
+
+    # Assert
+    assert sum(row["tickets"] for row in lead_time_rows if row["stage"] == "created_to_deployed") == 300000
+    assert sum(row["deployments"] for row in rate_rows) == deployment_count
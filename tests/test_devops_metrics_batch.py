@@ -0,0 +1,44 @@
+import logging
+import pytest
+from devops_metrics_batch import DevopsMetricsBatch, read_deployments
+
+
+def test_read_deployments__when_csv__then_return_row_per_deployment(tmp_path):
+    batch_file = tmp_path / "deployments.csv"
+    batch_file.write_text("project_name,project_version,deployed_instant,deployed_by_user_id\n"
+                          "cvmweb,1.0.3,2020-03-28T00:00:00+00:00,batman\n"
+                          "modelgen,2.1.0,2020-03-29T00:00:00+00:00,robin\n")
+
+    deployments = read_deployments(str(batch_file))
+
+    assert [deployment["project_version"] for deployment in deployments] == ["1.0.3", "2.1.0"]
+
+
+def test_read_deployments__when_field_missing__then_raise(tmp_path):
+    batch_file = tmp_path / "deployments.jsonl"
+    batch_file.write_text('{"project_name": "cvmweb", "project_version": "1.0.3", "deployed_instant": "2020"}\n')
+
+    with pytest.raises(ValueError):
+        read_deployments(str(batch_file))
+
+
+def test_run__then_share_service_and_repo_across_deployments_and_count_outcomes(mocker):
+    # Arrange
+    metrics_repo = mocker.Mock()
+    metrics_repo.is_app_version_already_deployed.side_effect = lambda app, version: version == "1.0.2"
+    metrics_repo.insert_devops_metrics_info.return_value = True
+    metrics_service = mocker.Mock()
+    metrics_service.get_devops_metrics_information.side_effect = \
+        lambda app, version, *args: exit(1) if version == "1.0.4" else mocker.Mock()
+    deployments = [{"project_name": "cvmweb", "project_version": version, "deployed_instant": "2020-03-28",
+                    "deployed_by_user_id": "batman"} for version in ["1.0.1", "1.0.2", "1.0.3", "1.0.4"]]
+
+    # Act
+    summary = DevopsMetricsBatch(logging.getLogger(__name__), metrics_repo, metrics_service, workers=2) \
+        .run(deployments)
+
+    # Assert
+    assert (summary["inserted"], summary["skipped"], summary["failed"]) == (2, 1, 1)
+    assert metrics_service.get_devops_metrics_information.call_count == 3
+    metrics_service.get_devops_metrics_information.assert_any_call("cv-management-web", "1.0.1", "2020-03-28",
+                                                                   "batman")
@@ -0,0 +1,247 @@
+import gzip
+import logging
+import requests
+import time
+from devops_metrics_bitbucket_client import BitbucketClient, SharedTokenBucket, TokenBucket
+from devops_metrics_http_cache import HttpCache
+from devops_metrics_instrumentation import Instrumentation
+
+TAGS_URL = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations/test_repo/refs/tags"
+
+
+def _get_client(sleeps: list, **kwargs) -> BitbucketClient:
+    return BitbucketClient(logging.getLogger(__name__), {"Authorization": "Basic abc"}, sleep=sleeps.append, **kwargs)
+
+
+def test_get__when_rate_limited__then_retry_after_requested_delay(requests_mock):
+    # Arrange
+    sleeps = []
+    requests_mock.get(TAGS_URL, [{"status_code": 429, "headers": {"Retry-After": "7"}},
+                                 {"status_code": 200, "json": {"values": []}}])
+    bitbucket_client = _get_client(sleeps)
+
+    # Act
+    response = bitbucket_client.get(TAGS_URL)
+
+    # Assert
+    assert response.status_code == 200
+    assert sleeps == [7.0]
+    assert bitbucket_client.get_stats()["requests"] == 2
+    assert bitbucket_client.get_stats()["retries"] == 1
+
+
+def test_get__when_server_keeps_failing__then_return_last_response_after_max_retries(requests_mock):
+    # Arrange
+    sleeps = []
+    requests_mock.get(TAGS_URL, status_code=503)
+    bitbucket_client = _get_client(sleeps, max_retries=3, backoff_base_seconds=1.0)
+
+    # Act
+    response = bitbucket_client.get(TAGS_URL)
+
+    # Assert
+    assert response.status_code == 503
+    assert requests_mock.call_count == 4
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= 2 ** attempt for attempt, delay in enumerate(sleeps))
+
+
+def test_get__when_connection_fails__then_retry(requests_mock):
+    sleeps = []
+    requests_mock.get(TAGS_URL, [{"exc": requests.exceptions.ConnectionError},
+                                 {"status_code": 200, "json": {"values": []}}])
+    bitbucket_client = _get_client(sleeps)
+
+    response = bitbucket_client.get(TAGS_URL)
+
+    assert response.status_code == 200
+    assert bitbucket_client.get_stats()["retries"] == 1
+
+
+def test_get__when_read_times_out__then_retry_with_configured_timeout(requests_mock):
+    # Arrange
+    sleeps = []
+    requests_mock.get(TAGS_URL, [{"exc": requests.exceptions.ReadTimeout},
+                                 {"status_code": 200, "json": {"values": []}}])
+    bitbucket_client = _get_client(sleeps, timeout=(2.0, 5.0))
+
+    # Act
+    response = bitbucket_client.get(TAGS_URL)
+
+    # Assert
+    assert response.status_code == 200
+    assert bitbucket_client.get_stats()["retries"] == 1
+    assert [request.timeout for request in requests_mock.request_history] == [(2.0, 5.0), (2.0, 5.0)]
+
+
+def test_get__then_reuse_session_with_auth_and_gzip_headers(requests_mock):
+    # Arrange
+    body = b'{"values": []}'
+    requests_mock.get(TAGS_URL, content=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    bitbucket_client = _get_client([])
+
+    # Act
+    first_response = bitbucket_client.get(TAGS_URL)
+    bitbucket_client.get(TAGS_URL)
+
+    # Assert
+    assert first_response.json() == {"values": []}
+    assert requests_mock.last_request.headers["Authorization"] == "Basic abc"
+    assert "gzip" in requests_mock.last_request.headers["Accept-Encoding"]
+    assert bitbucket_client.get_stats()["requests"] == 2
+    assert bitbucket_client.get_stats()["bytes"] == 2 * len(body)
+
+
+def test_token_bucket__when_burst_used__then_wait_for_refill():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    token_bucket = TokenBucket(rate_per_second=0.5, capacity=2, clock=lambda: now[0], sleep=sleep)
+
+    waits = [token_bucket.acquire() for _ in range(3)]
+
+    assert waits == [0.0, 0.0, 2.0]
+    assert sleeps == [2.0]
+
+
+def test_shared_token_bucket__when_another_process_used_the_burst__then_wait_for_refill(tmp_path):
+    # Arrange
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    db_path = str(tmp_path / "cache.db")
+    first_bucket = SharedTokenBucket(db_path, "bitbucket", rate_per_second=0.5, capacity=2, clock=lambda: now[0],
+                                     sleep=sleep)
+    second_bucket = SharedTokenBucket(db_path, "bitbucket", rate_per_second=0.5, capacity=2, clock=lambda: now[0],
+                                      sleep=sleep)
+
+    # Act
+    waits = [first_bucket.acquire(), first_bucket.acquire(), second_bucket.acquire()]
+
+    # Assert
+    assert waits == [0.0, 0.0, 2.0]
+    assert sleeps == [2.0]
+
+
+def _mock_tag_pages(requests_mock, page_count: int) -> None:
+    for page in range(1, page_count + 1):
+        tags_page = {"values": [{"name": "1.0.{}".format(page)}]}
+        if page < page_count:
+            tags_page["next"] = "{}?page={}".format(TAGS_URL, page + 1)
+        requests_mock.get(TAGS_URL if page == 1 else "{}?page={}".format(TAGS_URL, page), json=tags_page)
+
+
+def test_iter_paginated__when_prefetching__then_yield_every_page_in_order(requests_mock):
+    # Arrange
+    _mock_tag_pages(requests_mock, 4)
+    pages = []
+    bitbucket_client = _get_client([])
+
+    # Act
+    tags = list(bitbucket_client.iter_paginated(TAGS_URL, lambda response: None, prefetch_pages=2,
+                                                on_page=pages.append))
+
+    # Assert
+    assert [tag["name"] for tag in tags] == ["1.0.1", "1.0.2", "1.0.3", "1.0.4"]
+    assert len(pages) == 4
+
+
+def test_iter_paginated__when_closed_early__then_stop_fetching_ahead(requests_mock):
+    # Arrange
+    _mock_tag_pages(requests_mock, 10)
+    bitbucket_client = _get_client([])
+    tags = bitbucket_client.iter_paginated(TAGS_URL, lambda response: None, prefetch_pages=1)
+
+    # Act
+    first_tag = next(tags)
+    tags.close()
+    time.sleep(0.3)
+
+    # Assert
+    assert first_tag["name"] == "1.0.1"
+    # the page being read, the one buffered and at most one in flight when the caller stopped
+    assert requests_mock.call_count <= 3
+
+
+def test_iter_paginated__when_page_fails__then_pass_response_to_check(requests_mock):
+    failed_responses = []
+    requests_mock.get(TAGS_URL, status_code=404)
+    bitbucket_client = _get_client([])
+
+    tags = list(bitbucket_client.iter_paginated(TAGS_URL, failed_responses.append, prefetch_pages=1))
+
+    assert tags == []
+    assert [response.status_code for response in failed_responses] == [404]
+
+
+def _mock_etag_server(requests_mock, body: dict, etag: str = '"v1"'):
+    def respond(request, context):
+        if request.headers.get("If-None-Match") == etag:
+            context.status_code = 304
+            return None
+        context.headers["ETag"] = etag
+        return body
+
+    requests_mock.get(TAGS_URL, json=respond)
+
+
+def test_get__when_cached_page_unchanged__then_revalidate_and_serve_cached_page(requests_mock, tmp_path):
+    # Arrange
+    _mock_etag_server(requests_mock, {"values": [{"name": "1.0.1"}]})
+    http_cache = HttpCache(logging.getLogger(__name__), str(tmp_path / "cache.db"))
+    instrumentation = Instrumentation()
+    bitbucket_client = _get_client([], http_cache=http_cache, instrumentation=instrumentation)
+
+    # Act
+    first_tags = list(bitbucket_client.iter_paginated(TAGS_URL, lambda response: None, prefetch_pages=0))
+    second_tags = list(bitbucket_client.iter_paginated(TAGS_URL, lambda response: None, prefetch_pages=0))
+
+    # Assert
+    assert first_tags == second_tags == [{"name": "1.0.1"}]
+    assert [request.headers.get("If-None-Match") for request in requests_mock.request_history] == [None, '"v1"']
+    assert instrumentation.get_counter("http_cache_misses", host="api.bitbucket.org") == 1
+    assert instrumentation.get_counter("http_cache_hits", host="api.bitbucket.org") == 1
+    assert http_cache.get_stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_get__when_page_changed__then_replace_cached_page(requests_mock, tmp_path):
+    # Arrange
+    http_cache = HttpCache(logging.getLogger(__name__), str(tmp_path / "cache.db"))
+    _mock_etag_server(requests_mock, {"values": [{"name": "1.0.1"}]})
+    _get_client([], http_cache=http_cache).get(TAGS_URL)
+    _mock_etag_server(requests_mock, {"values": [{"name": "1.0.2"}]}, etag='"v2"')
+
+    reopened_http_cache = HttpCache(logging.getLogger(__name__), str(tmp_path / "cache.db"))
+
+    # Act
+    response = _get_client([], http_cache=reopened_http_cache).get(TAGS_URL)
+
+    # Assert
+    assert requests_mock.last_request.headers["If-None-Match"] == '"v1"'
+    assert response.status_code == 200
+    assert response.json() == {"values": [{"name": "1.0.2"}]}
+    assert reopened_http_cache.get(TAGS_URL).etag == '"v2"'
+
+
+def test_http_cache__when_over_max_bytes__then_evict_least_recently_used(tmp_path):
+    # Arrange
+    http_cache = HttpCache(logging.getLogger(__name__), str(tmp_path / "cache.db"), max_bytes=25)
+    http_cache.put("https://bitbucket.org/a", '"a"', None, b"0123456789")
+    http_cache.put("https://bitbucket.org/b", '"b"', None, b"0123456789")
+    http_cache.record_hit(http_cache.get("https://bitbucket.org/a"))
+
+    # Act
+    http_cache.put("https://bitbucket.org/c", '"c"', None, b"0123456789")
+
+    # Assert
+    assert http_cache.get("https://bitbucket.org/b") is None
+    assert http_cache.get("https://bitbucket.org/a").body == b"0123456789"
+    assert http_cache.get_stats()["evictions"] == 1
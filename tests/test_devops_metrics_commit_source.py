@@ -0,0 +1,115 @@
+import logging
+import os
+import subprocess
+import pytest
+from contextlib import closing
+from devops_metrics_commit_source import CommitSource, GitMirrorCommitSource
+from devops_metrics_service import DevopsMetricsService
+from freezegun import freeze_time
+
+
+def _git(cwd, *arguments, date: str = "2020-03-01T00:00:00+00:00") -> str:
+    environment = dict(os.environ, GIT_AUTHOR_NAME="Robin", GIT_AUTHOR_EMAIL="robin@batcave.org",
+                       GIT_COMMITTER_NAME="Robin", GIT_COMMITTER_EMAIL="robin@batcave.org",
+                       GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+    return subprocess.run(["git"] + list(arguments), cwd=cwd, env=environment, check=True, capture_output=True,
+                          text=True).stdout.strip()
+
+
+def _commit(origin, message: str, date: str) -> str:
+    _git(origin, "commit", "--allow-empty", "-q", "-m", message, date=date)
+    return _git(origin, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def origin(tmp_path):
+    origin_path = tmp_path / "origin"
+    origin_path.mkdir()
+    _git(origin_path, "init", "-q", "-b", "master")
+    _commit(origin_path, "(CV-1) first", "2020-03-01T00:00:00+00:00")
+    _git(origin_path, "tag", "1.0.1")
+    _commit(origin_path, "(CV-2) second", "2020-03-10T00:00:00+00:00")
+    _git(origin_path, "tag", "-a", "1.0.2", "-m", "release 1.0.2", date="2020-03-10T00:00:00+00:00")
+    _commit(origin_path, "(CV-3) third\n\nwith a body mentioning CV-4", "2020-03-20T00:00:00+00:00")
+    _git(origin_path, "tag", "1.0.3")
+    _git(tmp_path, "clone", "-q", "--mirror", str(origin_path), str(tmp_path / "mirrors" / "test_repo.git"))
+    return origin_path
+
+
+@pytest.fixture
+def commit_source(tmp_path, origin):
+    return GitMirrorCommitSource(logging.getLogger(__name__), str(tmp_path / "mirrors"), fetch_mirrors=False)
+
+
+@pytest.fixture
+def devops_metrics_service(commit_source):
+    service = DevopsMetricsService()
+    service.commit_source = commit_source
+    return service
+
+
+def test_iter_commits__then_yield_commits_newest_first(commit_source):
+    commits = list(commit_source.iter_commits("test_repo", "master"))
+
+    assert [commit.message.splitlines()[0] for commit in commits] == ["(CV-3) third", "(CV-2) second",
+                                                                      "(CV-1) first"]
+    assert commits[0].author_email == "robin@batcave.org"
+    assert commits[0].date.isoformat() == "2020-03-20T00:00:00+00:00"
+
+
+def test_iter_commits__when_range_given__then_only_yield_commits_in_range(commit_source):
+    commits = list(commit_source.iter_commits("test_repo", "1.0.1..master"))
+
+    assert [commit.message.splitlines()[0] for commit in commits] == ["(CV-3) third", "(CV-2) second"]
+
+
+def test_iter_commits__when_closed_early__then_stop_git_log(commit_source):
+    with closing(commit_source.iter_commits("test_repo", "master")) as commits:
+        first_commit = next(commits)
+
+    assert first_commit.message.startswith("(CV-3)")
+
+
+def test_iter_tags__then_yield_tagged_commits_newest_first(commit_source, origin):
+    tags = list(commit_source.iter_tags("test_repo"))
+
+    assert [tag["name"] for tag in tags] == ["1.0.3", "1.0.2", "1.0.1"]
+    # annotated tags point at the tagged commit, not the tag object
+    assert tags[1]["target"]["hash"] == _git(origin, "rev-parse", "1.0.2^{commit}")
+
+
+@freeze_time("2020, 3, 27")
+def test_extract_ticket_merge_info_from_commits__when_reading_git_mirror__then_stop_at_previous_release(
+        devops_metrics_service, origin):
+    # Arrange
+    previous_release_hash = devops_metrics_service.get_last_release_hash("test_repo", "1.0.3")
+
+    # Act
+    merge_info_map = devops_metrics_service.extract_ticket_merge_info_from_commits("test_repo",
+                                                                                   previous_release_hash)
+
+    # Assert
+    assert previous_release_hash == _git(origin, "rev-parse", "1.0.1")
+    assert sorted(merge_info_map) == ["CV-2", "CV-3", "CV-4"]
+    assert merge_info_map["CV-3"]["author"] == "robin@batcave.org"
+
+
+def test_iter_commits__when_fetching_mirrors__then_read_new_commits(tmp_path, origin):
+    # Arrange
+    new_commit_hash = _commit(origin, "(CV-5) after mirroring", "2020-03-25T00:00:00+00:00")
+    fetching_source = GitMirrorCommitSource(logging.getLogger(__name__), str(tmp_path / "mirrors"))
+
+    # Act
+    commits = list(fetching_source.iter_commits("test_repo", "master"))
+
+    # Assert
+    assert commits[0].hash == new_commit_hash
+
+
+def test_commit_source__when_range_and_tags_not_implemented__then_refuse_to_instantiate():
+    class CommitsOnlySource(CommitSource):
+        def iter_commits(self, repository: str, revision: str, scan_stats: dict = None):
+            return iter([])
+
+    with pytest.raises(TypeError, match="iter_commit_range, iter_tags"):
+        CommitsOnlySource()
@@ -0,0 +1,149 @@
+import logging
+import pytest
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_info import CommitRecord, parse_timestamp
+from devops_metrics_service import DevopsMetricsService
+from freezegun import freeze_time
+
+BITBUCKET_REPO_URL = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations/test_repo"
+
+
+@pytest.fixture
+def commit_store(tmp_path):
+    store = CommitStore(logging.getLogger(__name__), str(tmp_path / "cache.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def devops_metrics_service(commit_store):
+    service = DevopsMetricsService()
+    service.commit_store = commit_store
+    return service
+
+
+def test_extract_ticket_merge_info_from_commits__when_commits_cached__then_stop_paging_at_cached_head(
+        devops_metrics_service, requests_mock):
+    # Arrange
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master",
+                      json=_get_commit_page(["c3", "c2"], next_url=f"{BITBUCKET_REPO_URL}/commits/master?page=2"))
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master?page=2", json=_get_commit_page(["c1", "c0"]))
+    first_result = devops_metrics_service.extract_ticket_merge_info_from_commits("test_repo", "c0")
+    requests_mock.reset_mock()
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master", json=_get_commit_page(["c4", "c3"]))
+
+    # Act
+    second_result = devops_metrics_service.extract_ticket_merge_info_from_commits("test_repo", "c0")
+
+    # Assert
+    assert requests_mock.call_count == 1
+    assert sorted(first_result) == ["CV-1", "CV-2", "CV-3"]
+    assert sorted(second_result) == ["CV-1", "CV-2", "CV-3", "CV-4"]
+    assert second_result["CV-1"] == first_result["CV-1"]
+
+
+def test_iter_commits__when_another_scan_moves_cached_head__then_leave_its_commits_in_order(
+        devops_metrics_service, commit_store, requests_mock):
+    # Arrange
+    commit_store.replace_commits("test_repo", [_get_commit_record("c1")], reached_root=True)
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master", json=_get_commit_page(["c3", "c2", "c1"]))
+    commits = devops_metrics_service._iter_commits("test_repo")
+    first_commit = next(commits)
+    commit_store.add_newer_commits("test_repo", [_get_commit_record("c4"), _get_commit_record("c3"),
+                                                 _get_commit_record("c2")])
+
+    # Act
+    remaining_commits = list(commits)
+
+    # Assert
+    assert [commit.hash for commit in [first_commit] + remaining_commits] == ["c3", "c2", "c1"]
+    assert [commit.hash for commit in commit_store.iter_commits("test_repo")] == ["c4", "c3", "c2", "c1"]
+
+
+def test_extract_ticket_merge_info_from_commits__when_cache_ends_before_search_does__then_page_from_cached_tail(
+        devops_metrics_service, commit_store, requests_mock):
+    # Arrange
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master", json=_get_commit_page(["c3", "c2"]))
+    commit_store.replace_commits("test_repo", [_get_commit_record("c2")])
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/c2", json=_get_commit_page(["c2", "c1", "c0"]))
+
+    # Act
+    merge_info_map = devops_metrics_service.extract_ticket_merge_info_from_commits("test_repo", "unknown_hash")
+
+    # Assert
+    assert sorted(merge_info_map) == ["CV-0", "CV-1", "CV-2", "CV-3"]
+    assert [commit.hash for commit in commit_store.iter_commits("test_repo")] == ["c3", "c2", "c1", "c0"]
+    assert commit_store.has_reached_root("test_repo")
+
+
+def test_extract_ticket_merge_info_from_commits__when_scan_stops_before_cached_head__then_keep_cache_and_segment(
+        devops_metrics_service, commit_store, requests_mock):
+    # Arrange
+    commit_store.replace_commits("test_repo", [_get_commit_record("c0")], reached_root=True)
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master", json=_get_commit_page(["c3", "c2", "c1", "c0"]))
+
+    # Act
+    merge_info_map = devops_metrics_service.extract_ticket_merge_info_from_commits("test_repo", "c2")
+
+    # Assert
+    assert sorted(merge_info_map) == ["CV-3"]
+    assert [commit.hash for commit in commit_store.iter_commits("test_repo")] == ["c0"]
+    assert commit_store.has_reached_root("test_repo")
+    assert [commit.hash for commit in commit_store.get_segment("test_repo")] == ["c3", "c2"]
+
+
+def test_extract_ticket_merge_info_from_commits__when_segment_reached__then_page_gap_and_join_segment(
+        devops_metrics_service, commit_store, requests_mock):
+    # Arrange
+    commit_store.replace_commits("test_repo", [_get_commit_record("c0")], reached_root=True)
+    commit_store.replace_segment("test_repo", [_get_commit_record("c3"), _get_commit_record("c2")])
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master", json=_get_commit_page(["c4", "c3"]))
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/c2", json=_get_commit_page(["c2", "c1", "c0"]))
+
+    # Act
+    merge_info_map = devops_metrics_service.extract_ticket_merge_info_from_commits("test_repo", "unknown_hash")
+
+    # Assert
+    assert sorted(merge_info_map) == ["CV-0", "CV-1", "CV-2", "CV-3", "CV-4"]
+    assert requests_mock.call_count == 2
+    assert [commit.hash for commit in commit_store.iter_commits("test_repo")] == ["c4", "c3", "c2", "c1", "c0"]
+    assert commit_store.get_segment("test_repo") == []
+
+
+@freeze_time("2020, 3, 27")
+def test_evict_older_than__then_drop_everything_from_first_expired_commit(commit_store):
+    commit_store.replace_commits("test_repo", [_get_commit_record("c3", "2020-03-20T00:00:00+00:00"),
+                                               _get_commit_record("c2", "2019-01-01T00:00:00+00:00"),
+                                               _get_commit_record("c1", "2020-03-01T00:00:00+00:00"),
+                                               _get_commit_record("c0", "2018-01-01T00:00:00+00:00")],
+                                 reached_root=True)
+
+    evicted_count = commit_store.evict_older_than(30)
+
+    assert evicted_count == 3
+    assert [commit.hash for commit in commit_store.iter_commits("test_repo")] == ["c3"]
+    assert not commit_store.has_reached_root("test_repo")
+
+
+def test_rebuild__then_only_given_repository_is_cleared(commit_store):
+    commit_store.replace_commits("test_repo", [_get_commit_record("c1")])
+    commit_store.replace_commits("other_repo", [_get_commit_record("c2")])
+
+    commit_store.rebuild("test_repo")
+
+    assert commit_store.get_head("test_repo") is None
+    assert commit_store.get_head("other_repo") == "c2"
+
+
+def _get_commit_record(commit_hash: str, date: str = "2020-03-27T00:00:00+00:00"):
+    return CommitRecord(commit_hash, f"Some commit message (CV-{commit_hash[1:]})", parse_timestamp(date),
+                        "robin@batcave.org")
+
+
+def _get_commit_page(commit_hashes: list, next_url: str = None):
+    commit_page = {"values": [{"hash": commit_hash, "message": f"Some commit message (CV-{commit_hash[1:]})",
+                               "date": "2020-03-27T00:00:00+00:00", "author": {"raw": "Robin <robin@batcave.org>"}}
+                              for commit_hash in commit_hashes]}
+    if next_url is not None:
+        commit_page["next"] = next_url
+    return commit_page
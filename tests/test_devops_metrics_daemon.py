@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import pytest
+import requests
+from datetime import datetime
+from devops_metrics_client import send_deployment
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_daemon import DevopsMetricsDaemon
+from devops_metrics_info import CommitRecord
+from devops_metrics_instrumentation import Instrumentation
+from unittest.mock import DEFAULT
+
+DEPLOYMENT = {"project_name": "cvmweb", "project_version": "1.0.3", "deployed_instant": "2020-03-28",
+              "deployed_by_user_id": "batman"}
+
+
+@pytest.fixture
+def metrics_repo(mocker):
+    metrics_repo = mocker.Mock()
+    metrics_repo.is_app_version_already_deployed.return_value = False
+    metrics_repo.insert_devops_metrics_info.return_value = True
+    return metrics_repo
+
+
+@pytest.fixture
+def metrics_service(mocker):
+    metrics_service = mocker.Mock()
+    metrics_service.instrumentation = Instrumentation()
+    return metrics_service
+
+
+def _serve(daemon: DevopsMetricsDaemon):
+    server = daemon.create_server("127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def test_send_deployment__when_daemon_running__then_process_with_shared_service(metrics_repo, metrics_service):
+    # Arrange
+    logger = logging.getLogger(__name__)
+    daemon = DevopsMetricsDaemon(logger, metrics_repo, metrics_service, workers=2)
+    server, daemon_url = _serve(daemon)
+
+    # Act
+    results = [send_deployment(logger, daemon_url, dict(DEPLOYMENT, project_version=version), 10)
+               for version in ["1.0.3", "1.0.4"]]
+    server.shutdown()
+    server.server_close()
+
+    # Assert
+    assert results == ["inserted", "inserted"]
+    assert metrics_service.get_devops_metrics_information.call_count == 2
+    metrics_service.get_devops_metrics_information.assert_any_call("cv-management-web", "1.0.3", "2020-03-28",
+                                                                   "batman")
+
+
+def test_send_deployment__when_service_exits__then_report_failure(metrics_repo, metrics_service):
+    # Arrange
+    logger = logging.getLogger(__name__)
+    metrics_service.get_devops_metrics_information.side_effect = lambda *args: exit(1)
+    server, daemon_url = _serve(DevopsMetricsDaemon(logger, metrics_repo, metrics_service))
+
+    # Act
+    result = send_deployment(logger, daemon_url, DEPLOYMENT, 10)
+    server.shutdown()
+    server.server_close()
+
+    # Assert
+    assert result == "failed"
+
+
+def test_send_deployment__when_daemon_not_running__then_return_none_for_local_fallback(metrics_repo,
+                                                                                      metrics_service):
+    # Arrange
+    logger = logging.getLogger(__name__)
+    server, daemon_url = _serve(DevopsMetricsDaemon(logger, metrics_repo, metrics_service))
+    server.shutdown()
+    server.server_close()
+
+    # Act
+    result = send_deployment(logger, daemon_url, DEPLOYMENT, 10)
+
+    # Assert
+    assert result is None
+
+
+def test_submit__when_queue_full__then_reject_as_busy(metrics_repo, metrics_service):
+    # Arrange
+    release = threading.Event()
+    metrics_service.get_devops_metrics_information.side_effect = lambda *args: release.wait(10)
+    daemon = DevopsMetricsDaemon(logging.getLogger(__name__), metrics_repo, metrics_service, workers=1,
+                                 max_queued=0)
+    running = threading.Thread(target=daemon.submit, args=(DEPLOYMENT,))
+    running.start()
+    while metrics_service.get_devops_metrics_information.call_count == 0:
+        release.wait(0.01)
+
+    # Act
+    result = daemon.submit(dict(DEPLOYMENT, project_version="1.0.4"))
+    release.set()
+    running.join()
+
+    # Assert
+    assert result == "busy"
+
+
+def test_submit__when_same_version_submitted_twice__then_second_waits_and_lock_is_dropped(metrics_repo,
+                                                                                          metrics_service):
+    # Arrange
+    release = threading.Event()
+    metrics_service.get_devops_metrics_information.side_effect = lambda *args: release.wait(10) and DEFAULT
+    metrics_repo.is_app_version_already_deployed.side_effect = [False, True]
+    daemon = DevopsMetricsDaemon(logging.getLogger(__name__), metrics_repo, metrics_service, workers=2)
+    results = []
+    first = threading.Thread(target=lambda: results.append(daemon.submit(DEPLOYMENT)))
+    first.start()
+    while metrics_service.get_devops_metrics_information.call_count == 0:
+        release.wait(0.01)
+    second = threading.Thread(target=lambda: results.append(daemon.submit(DEPLOYMENT)))
+    second.start()
+
+    # Act
+    second.join(0.2)
+    waited_for_first = second.is_alive()
+    release.set()
+    first.join()
+    second.join()
+
+    # Assert
+    assert waited_for_first
+    assert results == ["inserted", "skipped"]
+    assert daemon._deployment_locks == {}
+
+
+def test_post_push__when_signed__then_ingest_into_service_commit_store(metrics_repo, metrics_service):
+    # Arrange
+    logger = logging.getLogger(__name__)
+    metrics_service.commit_store = CommitStore(logger, ":memory:")
+    metrics_service.commit_store.add_newer_commits("app_repo", [CommitRecord("c1", "", datetime(2020, 3, 1), "")])
+    body = json.dumps({"repository": {"full_name": "lovelandinnovations/app_repo"},
+                       "push": {"changes": [{"old": {"type": "branch", "name": "master", "target": {"hash": "c1"}},
+                                             "new": {"type": "branch", "name": "master", "target": {"hash": "c2"}},
+                                             "commits": [{"hash": "c2", "message": "(CV-2) pushed",
+                                                          "date": "2020-03-02T00:00:00+00:00",
+                                                          "author": {"raw": "Robin <robin@batcave.org>"}}]}]}}).encode()
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    server, daemon_url = _serve(DevopsMetricsDaemon(logger, metrics_repo, metrics_service,
+                                                    push_webhook_secret="secret"))
+
+    # Act
+    responses = [requests.post(daemon_url + "/push", data=body, headers={"X-Hub-Signature": header})
+                 for header in ["sha256=forged", signature]]
+    server.shutdown()
+    server.server_close()
+
+    # Assert
+    assert [response.status_code for response in responses] == [401, 200]
+    assert responses[1].json() == {"ingested_commits": 1, "skipped_changes": 0}
+    assert metrics_service.commit_store.get_head("app_repo") == "c2"
+
+
+def test_post_push__when_no_secret_configured__then_refuse_push(metrics_repo, metrics_service):
+    # Arrange
+    logger = logging.getLogger(__name__)
+    metrics_service.commit_store = CommitStore(logger, ":memory:")
+    metrics_service.commit_store.add_newer_commits("app_repo", [CommitRecord("c1", "", datetime(2020, 3, 1), "")])
+    body = json.dumps({"repository": {"full_name": "lovelandinnovations/app_repo"},
+                       "push": {"changes": [{"old": {"type": "branch", "name": "master", "target": {"hash": "c1"}},
+                                             "new": {"type": "branch", "name": "master", "target": {"hash": "c2"}},
+                                             "commits": [{"hash": "c2", "message": "(CV-2) made up",
+                                                          "date": "2020-03-02T00:00:00+00:00",
+                                                          "author": {"raw": "Robin <robin@batcave.org>"}}]}]}}).encode()
+    server, daemon_url = _serve(DevopsMetricsDaemon(logger, metrics_repo, metrics_service, push_webhook_secret=""))
+
+    # Act
+    response = requests.post(daemon_url + "/push", data=body)
+    server.shutdown()
+    server.server_close()
+
+    # Assert
+    assert response.status_code == 404
+    assert metrics_service.commit_store.get_head("app_repo") == "c1"
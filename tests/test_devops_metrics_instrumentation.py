@@ -0,0 +1,69 @@
+import json
+import logging
+import pstats
+from devops_metrics import main
+from devops_metrics_instrumentation import Instrumentation
+from devops_metrics_service import DevopsMetricsService
+from freezegun import freeze_time
+
+BITBUCKET_REPO_URL = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations/test_repo"
+
+
+def test_to_prometheus__then_write_summaries_and_counters_with_labels():
+    # Arrange
+    instrumentation = Instrumentation()
+    instrumentation.record_time("phase", 1.5, phase="jira")
+    instrumentation.record_time("phase", 0.5, phase="jira")
+    instrumentation.increment("http_requests", 3, host="api.bitbucket.org")
+
+    # Act
+    textfile = instrumentation.to_prometheus()
+
+    # Assert
+    assert textfile.splitlines() == [
+        "# TYPE devops_metrics_phase_seconds summary",
+        'devops_metrics_phase_seconds_sum{phase="jira"} 2.0',
+        'devops_metrics_phase_seconds_count{phase="jira"} 2',
+        "# TYPE devops_metrics_http_requests_total counter",
+        'devops_metrics_http_requests_total{host="api.bitbucket.org"} 3',
+    ]
+
+
+@freeze_time("2020, 3, 27")
+def test_extract_ticket_merge_info_from_commits__then_record_repo_scan_and_http_counts(requests_mock):
+    # Arrange
+    commit_page = {"values": [{"hash": "c1", "message": "(CV-1) change", "date": "2020-03-20T00:00:00+00:00",
+                               "author": {"raw": "Robin <robin@batcave.org>"}}]}
+    requests_mock.get(f"{BITBUCKET_REPO_URL}/commits/master", json=commit_page)
+    instrumentation = Instrumentation()
+    devops_metrics_service = DevopsMetricsService(instrumentation)
+
+    # Act
+    devops_metrics_service.extract_ticket_merge_info_from_commits("test_repo", "")
+
+    # Assert
+    assert instrumentation.get_counter("http_requests", host="api.bitbucket.org") == 1
+    assert instrumentation.get_counter("http_pages", host="api.bitbucket.org") == 1
+    assert instrumentation.get_counter("http_bytes", host="api.bitbucket.org") > 0
+    assert instrumentation.get_counter("commits_parsed", repository="test_repo") == 1
+    # the clock is frozen, so only check that the scan was timed
+    assert {"name": "repo_scan", "labels": {"repository": "test_repo"}, "count": 1, "seconds": 0.0} \
+        in instrumentation.to_dict()["timings"]
+
+
+def test_main__when_metrics_and_profile_out_given__then_write_both(mocker, tmp_path):
+    # Arrange
+    mocker.patch("devops_metrics.is_already_deployed", return_value=False)
+    process_new_deployment = mocker.patch("devops_metrics.process_new_deployment", return_value=True)
+    metrics_out = tmp_path / "metrics.json"
+    profile_out = tmp_path / "run.prof"
+
+    # Act
+    main(logging.getLogger(__name__), "app_repo", "1.0.3", "2020-03-27", "batman", str(metrics_out),
+         str(profile_out))
+
+    # Assert
+    metrics = json.loads(metrics_out.read_text())
+    assert process_new_deployment.call_count == 1
+    assert [timing["labels"] for timing in metrics["timings"]] == [{"phase": "total"}]
+    assert pstats.Stats(str(profile_out)).total_calls > 0
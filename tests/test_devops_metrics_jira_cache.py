@@ -0,0 +1,95 @@
+import logging
+import pytest
+import pytz
+from datetime import datetime
+from devops_metrics_jira_cache import JiraReleaseCache
+from devops_metrics_service import DevopsMetricsService
+
+
+# an issue as the search returns it with json_result
+def fake_issue(key: str, issue_type: str = "Story", updated: str = "2020-03-01T00:00:00.000+0000",
+               caused_by: str = None) -> dict:
+    issue_links = [{"type": {"name": "Relates"}, "outwardIssue": {"key": "CV-1"}}]
+    if caused_by is not None:
+        issue_links.append({"type": {"name": "Problem/Incident"}, "inwardIssue": {"key": caused_by}})
+    return {"key": key, "fields": {"issuetype": {"name": issue_type}, "created": "2020-02-20T00:00:00.000+0000",
+                                   "updated": updated, "issuelinks": issue_links}}
+
+
+def search_page(issues: list) -> dict:
+    return {"startAt": 0, "maxResults": 100, "total": len(issues), "issues": issues}
+
+
+@pytest.fixture
+def jira_client(mocker):
+    jira_client = mocker.Mock()
+    jira_client.search_issues.return_value = search_page([fake_issue("CV-22"),
+                                                          fake_issue("CV-23", "Bug", caused_by="CV-20")])
+    return jira_client
+
+
+@pytest.fixture
+def devops_metrics_service(jira_client):
+    service = DevopsMetricsService()
+    service._jira_client = jira_client
+    service.jira_release_cache = JiraReleaseCache(logging.getLogger(__name__), ":memory:", ttl_seconds=3600)
+    return service
+
+
+def test_get_released_tickets__then_convert_issues_to_dicts(devops_metrics_service):
+    released_tickets = devops_metrics_service.get_released_tickets("cv-management-web", "1.0.3")
+
+    assert released_tickets == [
+        {"ticket_id": "CV-22", "type": "Story", "created_datetime": datetime(2020, 2, 20, tzinfo=pytz.utc),
+         "caused_by": ""},
+        {"ticket_id": "CV-23", "type": "Bug", "created_datetime": datetime(2020, 2, 20, tzinfo=pytz.utc),
+         "caused_by": "CV-20"}
+    ]
+
+
+def test_get_released_tickets__when_build_variant_redeployed__then_no_jira_calls(devops_metrics_service,
+                                                                                  jira_client):
+    # Arrange
+    first_result = devops_metrics_service.get_released_tickets("cv-management-web", "1.0.3-build1")
+    jira_client.reset_mock()
+
+    # Act
+    second_result = devops_metrics_service.get_released_tickets("cv-management-web", "1.0.3-build2")
+
+    # Assert
+    assert second_result == first_result
+    assert jira_client.method_calls == []
+
+
+def test_get_released_tickets__when_cache_expired_and_issues_unchanged__then_only_check_updated(
+        devops_metrics_service, jira_client):
+    # Arrange
+    devops_metrics_service.jira_release_cache.ttl_seconds = 0
+    first_result = devops_metrics_service.get_released_tickets("cv-management-web", "1.0.3")
+    jira_client.reset_mock()
+
+    # Act
+    second_result = devops_metrics_service.get_released_tickets("cv-management-web", "1.0.3")
+
+    # Assert
+    assert second_result == first_result
+    assert jira_client.search_issues.call_count == 1
+    assert jira_client.search_issues.call_args.kwargs["fields"] == "updated"
+    jira_client.get_project_version_by_name.assert_not_called()
+
+
+def test_get_released_tickets__when_cache_expired_and_issue_updated__then_refetch(devops_metrics_service,
+                                                                                   jira_client):
+    # Arrange
+    devops_metrics_service.jira_release_cache.ttl_seconds = 0
+    devops_metrics_service.get_released_tickets("cv-management-web", "1.0.3")
+    jira_client.reset_mock()
+    jira_client.search_issues.return_value = search_page([fake_issue("CV-22", "Bug",
+                                                                     updated="2020-03-05T00:00:00.000+0000")])
+
+    # Act
+    released_tickets = devops_metrics_service.get_released_tickets("cv-management-web", "1.0.3")
+
+    # Assert
+    assert [ticket["type"] for ticket in released_tickets] == ["Bug"]
+    assert jira_client.search_issues.call_count == 2
@@ -0,0 +1,66 @@
+import logging
+import threading
+from devops_metrics_jira_search import JiraSearch
+from devops_metrics_service import DevopsMetricsService
+
+
+# Serves a release of ticket_count issues the way Jira's search endpoint pages them, capping maxResults
+class StubJiraClient:
+    def __init__(self, ticket_count: int, max_results_cap: int = 100) -> None:
+        self.max_results_cap = max_results_cap
+        self.search_calls = []
+        self._lock = threading.Lock()
+        self.issues = []
+        for index in range(ticket_count):
+            issue_links = [{"type": {"name": "Blocks"}, "outwardIssue": {"key": "CV-1"}}]
+            if index % 5 == 0:
+                issue_links.append({"type": {"name": "Problem/Incident"},
+                                    "inwardIssue": {"key": "CV-{}".format(index)}})
+            self.issues.append({"key": "CV-{}".format(1000 + index),
+                                "fields": {"issuetype": {"name": "Bug" if index % 5 == 0 else "Story"},
+                                           "created": "2020-02-20T00:00:00.000+0000",
+                                           "updated": "2020-03-01T00:00:00.000+0000", "issuelinks": issue_links}})
+
+    def get_project_version_by_name(self, project: str, version_name: str) -> dict:
+        return {"name": version_name}
+
+    def search_issues(self, jql_str: str, startAt: int = 0, maxResults: int = 50, fields: str = "*all",
+                      json_result: bool = False) -> dict:
+        with self._lock:
+            self.search_calls.append({"startAt": startAt, "fields": fields, "json_result": json_result})
+        max_results = min(maxResults, self.max_results_cap)
+        return {"startAt": startAt, "maxResults": max_results, "total": len(self.issues),
+                "issues": self.issues[startAt:startAt + max_results]}
+
+
+def test_get_released_tickets__when_500_tickets__then_fetch_every_page_once_with_projected_fields():
+    # Arrange
+    jira_client = StubJiraClient(500)
+    service = DevopsMetricsService()
+    service._jira_client = jira_client
+
+    # Act
+    released_tickets = service.get_released_tickets("cv-management-web", "1.0.3")
+
+    # Assert
+    assert [ticket["ticket_id"] for ticket in released_tickets] == [issue["key"] for issue in jira_client.issues]
+    assert sorted(call["startAt"] for call in jira_client.search_calls) == [0, 100, 200, 300, 400]
+    assert {call["fields"] for call in jira_client.search_calls} == {"issuetype,created,issuelinks,updated"}
+    assert all(call["json_result"] for call in jira_client.search_calls)
+    assert released_tickets[5]["caused_by"] == "CV-5"
+    assert sum(1 for ticket in released_tickets if ticket["caused_by"] != "") == 100
+    assert released_tickets[6]["caused_by"] == ""
+
+
+def test_search__when_jira_caps_page_size__then_page_by_returned_max_results():
+    # Arrange
+    jira_client = StubJiraClient(250, max_results_cap=50)
+    jira_search = JiraSearch(logging.getLogger(__name__), jira_client, page_size=1000, max_concurrent_requests=3)
+
+    # Act
+    issues = jira_search.search("project=CV AND fixVersion=cvmw-1.0.3 ORDER BY key", "updated")
+
+    # Assert
+    assert len(issues) == 250
+    assert len({issue["key"] for issue in issues}) == 250
+    assert len(jira_client.search_calls) == 5
@@ -0,0 +1,73 @@
+import pytz
+import threading
+from datetime import datetime
+from devops_metrics_pipeline import DevopsMetricsPipeline
+from devops_metrics_service import DevopsMetricsService
+from freezegun import freeze_time
+
+BITBUCKET_URL = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations"
+RELEASED_TICKETS = [{"ticket_id": ticket_id, "type": "Story", "created_datetime": datetime(2020, 2, 1, tzinfo=pytz.utc),
+                     "caused_by": ""} for ticket_id in ["CV-22", "CV-30", "CV-31"]]
+
+
+def _mock_repos(requests_mock) -> None:
+    commits_by_repo = {
+        "app_repo": [("2020-03-20T00:00:00+00:00", "CV-22 app change"), ("2020-03-10T00:00:00+00:00", "CV-30")],
+        "dep_domain": [("2020-03-25T00:00:00+00:00", "(CV-22) newer dependency change")],
+        "dep_output": [("2020-03-15T00:00:00+00:00", "CV-31 only in a dependency"),
+                       ("2020-03-12T00:00:00+00:00", "CV-30 dependency change")]
+    }
+    for repo, commits in commits_by_repo.items():
+        requests_mock.get(f"{BITBUCKET_URL}/{repo}/commits/master",
+                          json={"values": [{"date": date, "author": {"raw": "Robin <robin@batcave.org>"},
+                                            "message": message, "hash": f"{repo}-{index}"}
+                                           for index, (date, message) in enumerate(commits)]})
+    requests_mock.get(f"{BITBUCKET_URL}/app_repo/refs/tags",
+                      json={"values": [{"name": name, "target": {"hash": name}} for name in ["1.0.3", "1.0.2"]]})
+
+
+@freeze_time("2020, 3, 27")
+def test_run__then_result_matches_serial_service(mocker, requests_mock):
+    # Arrange
+    _mock_repos(requests_mock)
+    mocker.patch("devops_metrics_service.DevopsMetricsService.get_released_tickets", return_value=RELEASED_TICKETS)
+    mocker.patch("devops_metrics_service.DevopsMetricsService._get_repos_to_check",
+                 return_value=["dep_domain", "dep_output"])
+    deployed_instant = datetime(2020, 3, 28, tzinfo=pytz.utc)
+    devops_metrics_service = DevopsMetricsService()
+
+    # Act
+    serial_result = devops_metrics_service.get_devops_metrics_information("app_repo", "1.0.3", deployed_instant,
+                                                                           "batman")
+    devops_metrics_service.pipeline_mode = "async"
+    pipeline_result = devops_metrics_service.get_devops_metrics_information("app_repo", "1.0.3", deployed_instant,
+                                                                             "batman")
+
+    # Assert
+    assert pipeline_result.to_pretty_str() == serial_result.to_pretty_str()
+
+
+@freeze_time("2020, 3, 27")
+def test_run__then_jira_and_bitbucket_phases_overlap(mocker, requests_mock):
+    # Arrange
+    _mock_repos(requests_mock)
+    tags_requested = threading.Event()
+    original_get_last_release_hash = DevopsMetricsService.get_last_release_hash
+
+    def get_last_release_hash(service, repository, new_version):
+        tags_requested.set()
+        return original_get_last_release_hash(service, repository, new_version)
+
+    # Jira only answers once the tag lookup has started, which would never happen if the phases ran in order
+    mocker.patch("devops_metrics_service.DevopsMetricsService.get_released_tickets",
+                 side_effect=lambda *args: RELEASED_TICKETS if tags_requested.wait(timeout=5) else [])
+    mocker.patch("devops_metrics_service.DevopsMetricsService.get_last_release_hash", get_last_release_hash)
+    mocker.patch("devops_metrics_service.DevopsMetricsService._get_repos_to_check", return_value=["dep_domain"])
+    pipeline = DevopsMetricsPipeline(DevopsMetricsService())
+
+    # Act
+    metrics_info = pipeline.run("app_repo", "1.0.3", datetime(2020, 3, 28, tzinfo=pytz.utc), "batman")
+
+    # Assert
+    assert [ticket.ticket_id for ticket in metrics_info.deployed_tickets] == ["CV-22", "CV-30"]
+    assert set(pipeline.phase_timings) == {"jira", "previous_release", "scan:app_repo", "scan:dep_domain", "merge"}
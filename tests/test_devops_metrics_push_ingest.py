@@ -0,0 +1,69 @@
+import hashlib
+import hmac
+import logging
+import pytest
+import pytz
+from datetime import datetime
+from devops_metrics_commit_store import CommitStore
+from devops_metrics_info import CommitRecord
+from devops_metrics_push_ingest import PushIngester, is_valid_signature
+
+
+@pytest.fixture
+def commit_store():
+    commit_store = CommitStore(logging.getLogger(__name__), ":memory:")
+    commit_store.add_newer_commits("app_repo", [CommitRecord("c1", "CV-1 cached", datetime(2020, 3, 1, tzinfo=pytz.utc),
+                                                             "robin@batcave.org")])
+    yield commit_store
+    commit_store.close()
+
+
+def _get_push(old_hash: str, commit_hashes: list, truncated: bool = False) -> dict:
+    return {"repository": {"name": "App Repo", "full_name": "lovelandinnovations/app_repo"},
+            "push": {"changes": [{"old": {"type": "branch", "name": "master", "target": {"hash": old_hash}},
+                                  "new": {"type": "branch", "name": "master", "target": {"hash": commit_hashes[0]}},
+                                  "truncated": truncated, "forced": False,
+                                  "commits": [{"hash": commit_hash, "message": "(CV-{}) pushed".format(index),
+                                               "date": "2020-03-0{}T00:00:00+00:00".format(index + 2),
+                                               "author": {"raw": "Batman <batman@batcave.org>"}}
+                                              for index, commit_hash in enumerate(commit_hashes)]}]}}
+
+
+def test_ingest__when_push_continues_from_cached_head__then_store_commits_newest_first(commit_store):
+    # Act
+    summary = PushIngester(logging.getLogger(__name__), commit_store).ingest(_get_push("c1", ["c3", "c2"]))
+
+    # Assert
+    assert summary == {"ingested_commits": 2, "skipped_changes": 0}
+    commits = list(commit_store.iter_commits("app_repo"))
+    assert [commit.hash for commit in commits] == ["c3", "c2", "c1"]
+    assert commits[0].author_email == "batman@batcave.org"
+    assert commits[0].date == datetime(2020, 3, 2, tzinfo=pytz.utc)
+
+
+@pytest.mark.parametrize("push", [_get_push("c0", ["c3", "c2"]), _get_push("c1", ["c3", "c2"], truncated=True)])
+def test_ingest__when_gap_to_cached_head__then_skip_push(commit_store, push):
+    # Act
+    summary = PushIngester(logging.getLogger(__name__), commit_store).ingest(push)
+
+    # Assert
+    assert summary == {"ingested_commits": 0, "skipped_changes": 1}
+    assert commit_store.get_head("app_repo") == "c1"
+
+
+def test_ingest__when_other_branch__then_ignore_change(commit_store):
+    push = _get_push("c1", ["c2"])
+    push["push"]["changes"][0]["new"]["name"] = "feature/CV-2"
+
+    summary = PushIngester(logging.getLogger(__name__), commit_store).ingest(push)
+
+    assert summary == {"ingested_commits": 0, "skipped_changes": 0}
+
+
+def test_is_valid_signature__then_only_accept_matching_hmac():
+    body = b'{"push": {}}'
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+
+    assert is_valid_signature("secret", body, signature)
+    assert not is_valid_signature("other secret", body, signature)
+    assert not is_valid_signature("secret", body, None)
@@ -0,0 +1,129 @@
+import logging
+import re
+import pytest
+import pytz
+from datetime import datetime
+from devops_metrics_info import DevopsMetricsInfo, DeploymentInfo, DeployedTicket
+from devops_metrics_recompute import DevopsMetricsRecompute, _create_recompute_service, split_into_shards
+from freezegun import freeze_time
+
+BITBUCKET_URL = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations"
+
+
+@pytest.fixture
+def metrics_repo(mocker):
+    metrics_repo = mocker.Mock()
+    metrics_repo.get_deployed_versions.return_value = {
+        ("cv-management-web", "1.0.2"): ("deployment-2", datetime(2020, 3, 2, tzinfo=pytz.utc), "batman")}
+    metrics_repo.get_recompute_checkpoints.return_value = {("cv-management-web", "1.0.1")}
+    metrics_repo.swap_in_recompute.return_value = 3
+    return metrics_repo
+
+
+@pytest.fixture
+def metrics_service(mocker):
+    metrics_service = mocker.Mock()
+    metrics_service.get_release_tags.side_effect = lambda app_name: [
+        ("1.0.1", "2020-03-01T00:00:00+00:00"), ("1.0.2", "2020-03-02T00:00:00+00:00"),
+        ("1.0.3", "2020-03-03T00:00:00+00:00"), ("1.0.4", None)] if app_name == "cv-management-web" else [
+        ("2.0.0", "2020-03-05T00:00:00+00:00")]
+
+    def get_devops_metrics_information(app_name, app_version, deployed_instant, deployed_by_user_id, as_of=None):
+        assert as_of == deployed_instant
+        if app_version == "2.0.0" and metrics_service.fail_modelgen:
+            exit(1)
+        deployment_info = DeploymentInfo(app_name, app_version, deployed_instant, deployed_by_user_id)
+        return DevopsMetricsInfo(deployment_info, [DeployedTicket(deployment_info.id, app_name, "CV-22", "Story", "",
+                                                                  deployed_instant, deployed_instant, "robin", [])])
+
+    metrics_service.fail_modelgen = False
+    metrics_service.get_devops_metrics_information.side_effect = get_devops_metrics_information
+    return metrics_service
+
+
+def test_split_into_shards__then_keep_releases_contiguous_and_cover_all():
+    shards = split_into_shards(list(range(10)), 4)
+
+    assert shards == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    assert split_into_shards([], 4) == []
+
+
+def test_run__when_resumed__then_skip_checkpointed_releases_stage_in_batches_and_swap(metrics_repo,
+                                                                                        metrics_service):
+    # Act
+    summary = DevopsMetricsRecompute(logging.getLogger(__name__), metrics_repo, metrics_service, batch_size=2,
+                                     include_undeployed_tags=True).run("rules-v2", ["cv-management-web",
+                                                                                    "model-generator"])
+
+    # Assert
+    assert (summary["total"], summary["resumed"], summary["recomputed"], summary["failed"], summary["swapped"]) == \
+        (4, 1, 3, 0, 3)
+    staged_infos = [info for call in metrics_repo.insert_recompute_results.call_args_list for info in call.args[1]]
+    assert [(info.deployment_info.app_name, info.deployment_info.app_version) for info in staged_infos] == [
+        ("cv-management-web", "1.0.2"), ("cv-management-web", "1.0.3"), ("model-generator", "2.0.0")]
+    # a recorded deployment keeps its id and deploy details, a release that never was uses its tag date
+    assert staged_infos[0].deployment_info.id == "deployment-2"
+    assert staged_infos[0].deployed_tickets[0].deployment_id == "deployment-2"
+    assert staged_infos[0].deployment_info.deployed_by_user_id == "batman"
+    assert staged_infos[1].deployment_info.deployed_instant == datetime(2020, 3, 3, tzinfo=pytz.utc)
+    metrics_repo.swap_in_recompute.assert_called_once_with("rules-v2")
+    metrics_repo.clear_recompute.assert_not_called()
+
+
+def test_list_releases__by_default__then_only_recorded_deployments(metrics_repo, metrics_service):
+    releases = DevopsMetricsRecompute(logging.getLogger(__name__), metrics_repo, metrics_service) \
+        .list_releases(["cv-management-web", "model-generator"])
+
+    assert [(release["app_version"], release["deployment_id"]) for release in releases] == [("1.0.2", "deployment-2")]
+
+
+def test_run__when_a_release_fails__then_keep_staged_releases_and_do_not_swap(metrics_repo, metrics_service):
+    # Arrange
+    metrics_service.fail_modelgen = True
+
+    # Act
+    summary = DevopsMetricsRecompute(logging.getLogger(__name__), metrics_repo, metrics_service,
+                                     include_undeployed_tags=True).run("rules-v2", ["cv-management-web",
+                                                                                    "model-generator"], resume=False)
+
+    # Assert
+    assert (summary["recomputed"], summary["failed"], summary["swapped"]) == (3, 1, 0)
+    metrics_repo.clear_recompute.assert_called_once_with("rules-v2")
+    assert metrics_repo.insert_recompute_results.call_count == 3
+    metrics_repo.swap_in_recompute.assert_not_called()
+
+
+@freeze_time("2020, 3, 27")
+def test_run__when_recomputing_older_version_without_cache_db__then_scan_between_its_own_tags(mocker, requests_mock,
+                                                                                               monkeypatch):
+    # Arrange
+    monkeypatch.delenv("local_cache_db_path", raising=False)
+    app_repo = f"{BITBUCKET_URL}/cv-management-web"
+    requests_mock.get(f"{app_repo}/refs/tags", json={"values": [
+        {"name": f"1.0.{patch}", "target": {"hash": f"hash-1.0.{patch}", "date": f"2020-03-{patch:02d}T00:00:00Z"}}
+        for patch in range(10, 0, -1)]})
+    range_mock = requests_mock.get(f"{app_repo}/commits?include=hash-1.0.4&exclude=hash-1.0.2", json={"values": [
+        {"hash": "c4", "date": "2020-03-03T12:00:00+00:00", "message": "(CV-22) change",
+         "author": {"raw": "Robin <robin@batcave.org>"}}]})
+    requests_mock.get(re.compile(r".*/commits/master.*"), json={"values": []})
+    mocker.patch("devops_metrics_service.DevopsMetricsService.get_released_tickets", return_value=[
+        {"ticket_id": "CV-22", "type": "Story", "created_datetime": datetime(2020, 3, 1, tzinfo=pytz.utc),
+         "caused_by": ""}])
+    metrics_repo = mocker.Mock()
+    metrics_repo.get_deployed_versions.return_value = {
+        ("cv-management-web", "1.0.4"): ("deployment-4", datetime(2020, 3, 4, tzinfo=pytz.utc), "batman")}
+    metrics_repo.get_recompute_checkpoints.return_value = set()
+    metrics_service = _create_recompute_service()
+    metrics_service.pipeline_mode = "serial"
+
+    # Act
+    summary = DevopsMetricsRecompute(logging.getLogger(__name__), metrics_repo, metrics_service) \
+        .run("rules-v2", ["cv-management-web"])
+
+    # Assert
+    assert (summary["recomputed"], summary["failed"]) == (1, 0)
+    assert range_mock.call_count == 1
+    staged_info = metrics_repo.insert_recompute_results.call_args.args[1][0]
+    assert staged_info.deployment_info.app_version == "1.0.4"
+    assert [ticket.merged_instant for ticket in staged_info.deployed_tickets] == [
+        datetime(2020, 3, 3, 12, tzinfo=pytz.utc)]
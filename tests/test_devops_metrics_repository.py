@@ -0,0 +1,209 @@
+import logging
+import pytest
+import pytz
+from datetime import datetime
+from devops_metrics_info import DevopsMetricsInfo, DeploymentInfo, DeployedTicket
+from devops_metrics_instrumentation import Instrumentation
+from devops_metrics_repository import DevopsMetricsRepository
+
+
+class StubCursor:
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.fetch_result = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def execute(self, sql, params=None) -> None:
+        self.connection.statements.append(sql if isinstance(sql, str) else sql.decode())
+        self.fetch_result = self.connection.fetch_results.pop(0) if self.connection.fetch_results else None
+
+    def mogrify(self, template, args) -> bytes:
+        return ("(" + ",".join(repr(str(arg)) for arg in args) + ")").encode()
+
+    def fetchone(self):
+        return self.fetch_result
+
+    def fetchall(self):
+        return self.fetch_result or []
+
+
+class StubConnection:
+    def __init__(self, fetch_results: list) -> None:
+        self.encoding = "UTF8"
+        self.statements = []
+        self.fetch_results = fetch_results
+        self.commits = 0
+
+    def cursor(self) -> StubCursor:
+        return StubCursor(self)
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:
+        pass
+
+
+class StubPool:
+    def __init__(self, connection: StubConnection) -> None:
+        self.connection = connection
+        self.checked_out = 0
+
+    def getconn(self) -> StubConnection:
+        self.checked_out += 1
+        return self.connection
+
+    def putconn(self, connection, close=False) -> None:
+        self.checked_out -= 1
+
+
+@pytest.fixture
+def stub_pool(mocker):
+    stub_pool = StubPool(StubConnection(fetch_results=[]))
+    pool_class = mocker.patch("devops_metrics_repository.psycopg2.pool.ThreadedConnectionPool", return_value=stub_pool)
+    stub_pool.pool_class = pool_class
+    return stub_pool
+
+
+def _get_metrics_info(ticket_count: int) -> DevopsMetricsInfo:
+    deployment_info = DeploymentInfo("app_repo", "1.0.3", datetime(2020, 3, 28, tzinfo=pytz.utc), "batman")
+    deployed_tickets = [DeployedTicket(deployment_info.id, "app_repo", f"CV-{index}", "Story", "",
+                                       datetime(2020, 2, 20, tzinfo=pytz.utc), datetime(2020, 3, 1, tzinfo=pytz.utc),
+                                       "robin@batcave.org", ["app_repo"]) for index in range(ticket_count)]
+    return DevopsMetricsInfo(deployment_info, deployed_tickets)
+
+
+def test_insert_devops_metrics_info__then_insert_all_tickets_in_one_round_trip(stub_pool):
+    # Arrange
+    stub_pool.connection.fetch_results = [("deployment-id",)]
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__))
+
+    # Act
+    is_inserted = metrics_repo.insert_devops_metrics_info(_get_metrics_info(ticket_count=300))
+
+    # Assert
+    statements = stub_pool.connection.statements
+    assert is_inserted
+    assert len(statements) == 2
+    assert "ON CONFLICT (app_name, app_version) DO NOTHING" in statements[0]
+    assert statements[1].count("'CV-") == 300
+    assert stub_pool.connection.commits == 1
+    assert stub_pool.checked_out == 0
+
+
+def test_insert_devops_metrics_info__when_version_already_recorded__then_skip_tickets(stub_pool):
+    stub_pool.connection.fetch_results = [None]
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__))
+
+    is_inserted = metrics_repo.insert_devops_metrics_info(_get_metrics_info(ticket_count=3))
+
+    assert not is_inserted
+    assert len(stub_pool.connection.statements) == 1
+
+
+def test_is_app_version_already_deployed__then_reuse_pooled_connection(stub_pool):
+    stub_pool.connection.fetch_results = [(1,), None]
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__))
+
+    first_check = metrics_repo.is_app_version_already_deployed("app_repo", "1.0.3")
+    second_check = metrics_repo.is_app_version_already_deployed("app_repo", "1.0.4")
+
+    assert first_check and not second_check
+    assert stub_pool.pool_class.call_count == 1
+    assert stub_pool.checked_out == 0
+
+
+def test_insert_devops_metrics_info__then_count_db_round_trips(stub_pool):
+    stub_pool.connection.fetch_results = [(1,), ("deployment-id",)]
+    instrumentation = Instrumentation()
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__), instrumentation)
+    metrics_repo.ticket_insert_page_size = 100
+
+    metrics_repo.is_app_version_already_deployed("app_repo", "1.0.3")
+    metrics_repo.insert_devops_metrics_info(_get_metrics_info(ticket_count=250))
+
+    assert instrumentation.get_counter("db_round_trips", operation="already_deployed_check") == 2
+    assert instrumentation.get_counter("db_round_trips", operation="insert_deployment_info") == 1
+    assert instrumentation.get_counter("db_round_trips", operation="insert_deployed_tickets") == 3
+    assert instrumentation.get_counter("db_round_trips", operation="commit") == 1
+    assert instrumentation.get_seconds("db", operation="insert_devops_metrics_info") > 0
+
+
+def test_insert_devops_metrics_info__when_maintaining_rollups__then_upsert_day_and_week_in_same_transaction(
+        stub_pool):
+    # Arrange
+    stub_pool.connection.fetch_results = [("deployment-id",)]
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__))
+    metrics_repo.maintain_deployment_rollups = True
+
+    # Act
+    metrics_repo.insert_devops_metrics_info(_get_metrics_info(ticket_count=3))
+
+    # Assert
+    statements = stub_pool.connection.statements
+    assert len(statements) == 3
+    assert statements[2].startswith("INSERT INTO deployment_rollup")
+    assert "(VALUES ('day'), ('week'))" in statements[2]
+    assert "lead_time_gt_30d = rollup.lead_time_gt_30d + EXCLUDED.lead_time_gt_30d" in statements[2]
+    assert "merge_to_deploy_gt_30d = rollup.merge_to_deploy_gt_30d + EXCLUDED.merge_to_deploy_gt_30d" in statements[2]
+    assert statements[2].count("count(*) FILTER") == 12
+    assert stub_pool.connection.commits == 1
+
+
+def test_insert_devops_metrics_info__when_version_already_recorded__then_leave_rollups_alone(stub_pool):
+    stub_pool.connection.fetch_results = [None]
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__))
+    metrics_repo.maintain_deployment_rollups = True
+
+    metrics_repo.insert_devops_metrics_info(_get_metrics_info(ticket_count=3))
+
+    assert not any("deployment_rollup" in statement for statement in stub_pool.connection.statements)
+
+
+def test_insert_recompute_results__then_stage_deployments_tickets_and_checkpoints_in_one_transaction(stub_pool):
+    # Arrange
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__))
+
+    # Act
+    metrics_repo.insert_recompute_results("rules-v2", [_get_metrics_info(ticket_count=3),
+                                                       _get_metrics_info(ticket_count=2)])
+
+    # Assert
+    statements = stub_pool.connection.statements
+    assert [statement.split()[2] for statement in statements] == ["deployment_info_staging",
+                                                                  "deployed_ticket_staging", "recompute_checkpoint"]
+    assert statements[1].count("'CV-") == 5
+    assert statements[2].count("'rules-v2'") == 2
+    assert stub_pool.connection.commits == 1
+    assert stub_pool.checked_out == 0
+
+
+def test_swap_in_recompute__when_maintaining_rollups__then_replace_and_rebuild_rollups_in_one_transaction(
+        stub_pool):
+    # Arrange
+    stub_pool.connection.fetch_results = [None, None, None, None, None, None, [("d1",), ("d2",)]]
+    metrics_repo = DevopsMetricsRepository(logging.getLogger(__name__))
+    metrics_repo.maintain_deployment_rollups = True
+
+    # Act
+    metrics_repo.swap_in_recompute("rules-v2")
+
+    # Assert
+    statements = [" ".join(statement.split()) for statement in stub_pool.connection.statements]
+    assert statements[0].startswith("LOCK TABLE deployment_info, deployed_ticket")
+    assert statements[1].startswith("DELETE FROM deployed_ticket t")
+    assert statements[2].startswith("DELETE FROM deployment_info d")
+    assert statements[3].startswith("INSERT INTO deployment_info (id")
+    assert statements[4].startswith("INSERT INTO deployed_ticket (id")
+    assert statements[5].startswith("DELETE FROM deployment_rollup")
+    assert sum(statement.startswith("INSERT INTO deployment_rollup") for statement in statements) == 2
+    assert statements[-3:] == ["DELETE FROM deployed_ticket_staging WHERE run_id=%s",
+                               "DELETE FROM deployment_info_staging WHERE run_id=%s",
+                               "DELETE FROM recompute_checkpoint WHERE run_id=%s"]
+    assert stub_pool.connection.commits == 1
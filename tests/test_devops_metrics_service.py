@@ -171,6 +171,19 @@ def test_extract_ticket_merge_info_from_commits__when_message_having_multiple_ti
     assert merge_info_map == expected_merge_info_map
 
 
+def test_extract_ticket_merge_info_from_commits__when_author_has_no_email__then_use_raw_author(requests_mock):
+    repo = "test_repo"
+    commit: dict = _get_base_commit_response()
+    commit["values"][0]["author"]["raw"] = "robin"
+    commit["values"][0]["date"] = "2020-03-27T00:00:00Z"
+    requests_mock.get(f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{repo}/commits/master", json=commit)
+
+    merge_info_map = devops_metrics_service.extract_ticket_merge_info_from_commits(repo, "previous_release_hash")
+
+    assert merge_info_map["CV-22"] == {"date": datetime(2020, 3, 27, tzinfo=pytz.utc), "author": "robin",
+                                       "repositories": [repo]}
+
+
 def test__extract_ticket_merge_info_from_commits__when_commit_from_jenkins__then_ignore_commit(requests_mock):
     repo = "test_repo"
     author_email = "jenkins@someipaddress.com"
@@ -210,6 +223,98 @@ def test__extract_ticket_merge_info_from_commits__when_timeframe_reached_and_no_
     assert len(merge_info_map) == 0
 
 
+@freeze_time("2020, 3, 27")
+def test_get_ticket_merge_dates__when_scanning_concurrently__then_result_matches_serial_scan(requests_mock):
+    # Arrange
+    app_repo = "app_repo"
+    dependency_repos = ["dep_domain", "dep_persistence", "dep_output"]
+    commits_by_repo = {
+        app_repo: [("2020-03-20T00:00:00+00:00", "CV-22 app change"), ("2020-03-10T00:00:00+00:00", "CV-30")],
+        "dep_domain": [("2020-03-25T00:00:00+00:00", "(CV-22) newer dependency change")],
+        "dep_persistence": [("2020-03-01T00:00:00+00:00", "CV-22 older dependency change"),
+                            ("2020-02-28T00:00:00+00:00", "IQ-7 not in release")],
+        "dep_output": [("2020-03-15T00:00:00+00:00", "CV-31 only in a dependency"),
+                       ("2020-03-12T00:00:00+00:00", "CV-30 dependency change")]
+    }
+    for repo, commits in commits_by_repo.items():
+        requests_mock.get(f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{repo}/commits/master",
+                          json={"values": [{"date": date, "author": {"raw": "Robin <robin@batcave.org>"},
+                                            "message": message, "hash": f"{repo}-{index}"}
+                                           for index, (date, message) in enumerate(commits)]})
+    requests_mock.get(f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{app_repo}/refs/tags",
+                      json=_get_base_tag_response())
+    release_tickets = ["CV-22", "CV-30", "CV-31"]
+    serial_service = DevopsMetricsService()
+    concurrent_service = DevopsMetricsService()
+    concurrent_service.max_concurrent_repo_scans = 4
+    concurrent_service.bitbucket_client.max_requests_per_host = 2
+
+    # Act
+    serial_result = serial_service._get_ticket_merge_dates(app_repo, dependency_repos, "1.0.3", release_tickets)
+    concurrent_result = concurrent_service._get_ticket_merge_dates(app_repo, dependency_repos, "1.0.3",
+                                                                   release_tickets)
+
+    # Assert
+    assert concurrent_result == serial_result
+    assert concurrent_result["CV-22"]["repositories"] == ["dep_domain", app_repo, "dep_persistence"]
+    assert concurrent_result["CV-30"]["repositories"] == ["dep_output", app_repo]
+    assert concurrent_result["CV-31"]["repositories"] == ["dep_output"]
+    assert "IQ-7" not in concurrent_result
+
+
+@freeze_time("2020, 3, 27")
+def test_extract_ticket_merge_info_from_commits__when_all_release_tickets_found__then_stop_paging(requests_mock):
+    # Arrange
+    repo = "dep_domain"
+    commits_url = f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{repo}/commits/master"
+    first_page = _get_base_commit_response(commit_message="(CV-22) dependency change")
+    first_page["values"].append(dict(first_page["values"][0], date="2020-03-20 00:00:00+00:00", message="no ticket"))
+    first_page["next"] = f"{commits_url}?page=2"
+    requests_mock.get(commits_url, json=first_page)
+    requests_mock.get(f"{commits_url}?page=2", json=_get_base_commit_response(commit_message="CV-22 older change"))
+    scanning_service = DevopsMetricsService()
+    # counts exact page requests, so don't fetch ahead
+    scanning_service.commit_source.prefetch_pages = 0
+
+    # Act
+    merge_info_map = scanning_service.extract_ticket_merge_info_from_commits(
+        repo, "", {"CV-22"}, {"CV-22": datetime(2020, 3, 1, tzinfo=pytz.utc)})
+
+    # Assert
+    assert list(merge_info_map) == ["CV-22"]
+    assert requests_mock.call_count == 1
+    assert scanning_service.scan_stats[repo]["stop_reason"] == "all_release_tickets_found"
+    assert scanning_service.scan_stats[repo]["pages_fetched"] == 1
+
+
+@freeze_time("2020, 3, 27")
+def test_extract_ticket_merge_info_from_commits__when_older_than_pending_tickets__then_stop_and_estimate_skip(
+        requests_mock):
+    # Arrange
+    repo = "dep_domain"
+    commits_url = f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{repo}/commits/master"
+    first_page = _get_base_commit_response(commit_message="CV-22 change")
+    first_page["values"].append(dict(first_page["values"][0], date="2020-03-17 00:00:00+00:00", message="CV-1"))
+    first_page["next"] = f"{commits_url}?page=2"
+    requests_mock.get(commits_url, json=first_page)
+    requests_mock.get(f"{commits_url}?page=2", json=_get_base_commit_response(commit_message="CV-30"))
+    scanning_service = DevopsMetricsService()
+    scanning_service.commit_source.prefetch_pages = 0
+    scanning_service.git_search_timeframe_in_months = 3
+    ticket_created_dates = {"CV-22": datetime(2020, 3, 1, tzinfo=pytz.utc),
+                            "CV-30": datetime(2020, 3, 20, tzinfo=pytz.utc)}
+
+    # Act
+    merge_info_map = scanning_service.extract_ticket_merge_info_from_commits(repo, "", {"CV-22", "CV-30"},
+                                                                             ticket_created_dates)
+
+    # Assert
+    assert list(merge_info_map) == ["CV-22"]
+    assert requests_mock.call_count == 1
+    assert scanning_service.scan_stats[repo]["stop_reason"] == "older_than_release_tickets"
+    assert scanning_service.scan_stats[repo]["estimated_pages_skipped"] > 0
+
+
 def test_get_last_release_hash(requests_mock):
     repo = "test_repo"
     tags_response = _get_base_tag_response()
@@ -221,6 +326,20 @@ def test_get_last_release_hash(requests_mock):
     assert "last-release" == git_hash
 
 
+def test_get_last_release_hash__when_tags_cached_in_memory__then_only_request_tags_once(requests_mock):
+    repo = "test_repo"
+    requests_mock.get(f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{repo}/refs/tags",
+                      json=_get_base_tag_response())
+    caching_service = DevopsMetricsService()
+    caching_service.cache_tags_in_memory = True
+
+    first_hash = caching_service.get_last_release_hash(repo, "1.0.3")
+    second_hash = caching_service.get_last_release_hash(repo, "1.0.3")
+
+    assert first_hash == second_hash == "last-release"
+    assert requests_mock.call_count == 1
+
+
 def _get_base_commit_response(author_email: str = "robin@batcave.org",
                               commit_message: str = "Some commit message (CV-22)"):
     return {"values": [{"date": "2020-03-27 00:00:00+00:00",
@@ -231,6 +350,64 @@ def _get_base_commit_response(author_email: str = "robin@batcave.org",
                         "hash": "some_other_hash"}]}
 
 
+@freeze_time("2020, 3, 27")
+def test_scan_app_repo__when_range_mode__then_same_result_as_master_walk_in_fewer_pages(requests_mock):
+    # Arrange
+    repo = "app_repo"
+    repo_url = f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{repo}"
+    commits = [{"hash": f"c{index}", "date": f"2020-03-{10 + index:02d}T00:00:00+00:00", "message": f"CV-{index}",
+                "author": {"raw": "Robin <robin@batcave.org>"}} for index in range(6, 0, -1)]
+    master_url = f"{repo_url}/commits/master"
+    requests_mock.get(master_url, json={"values": commits[:2], "next": f"{master_url}?page=2"})
+    requests_mock.get(f"{master_url}?page=2", json={"values": commits[2:4], "next": f"{master_url}?page=3"})
+    requests_mock.get(f"{master_url}?page=3", json={"values": commits[4:]})
+    range_mock = requests_mock.get(f"{repo_url}/commits?include=c6&exclude=c2&pagelen=100",
+                                   json={"values": commits[:4]})
+    requests_mock.get(f"{repo_url}/refs/tags", json={"values": [{"name": "1.0.3", "target": {"hash": "c6"}},
+                                                                 {"name": "1.0.2", "target": {"hash": "c4"}},
+                                                                 {"name": "1.0.1", "target": {"hash": "c2"}}]})
+    walk_service = DevopsMetricsService()
+    range_service = DevopsMetricsService()
+    range_service.app_scan_mode = "range"
+    for scanning_service in [walk_service, range_service]:
+        scanning_service.commit_source.prefetch_pages = 0
+
+    # Act
+    walk_result = walk_service._extract_app_ticket_merge_info(repo, "1.0.3", {"CV-3", "CV-5", "CV-1"})
+    range_result = range_service._extract_app_ticket_merge_info(repo, "1.0.3", {"CV-3", "CV-5", "CV-1"})
+
+    # Assert
+    assert range_result == walk_result
+    assert list(range_result) == ["CV-5", "CV-3"]
+    assert range_mock.call_count == 1
+    assert range_service.scan_stats[repo]["pages_fetched"] == 1
+    assert walk_service.scan_stats[repo]["pages_fetched"] == 3
+
+
+@freeze_time("2021, 1, 1")
+def test_extract_ticket_merge_info_from_commits__when_as_of_given__then_skip_newer_commits_and_window_from_it(
+        requests_mock):
+    # Arrange
+    repo = "dep_domain"
+    requests_mock.get(f"https://api.bitbucket.org/2.0/repositories/lovelandinnovations/{repo}/commits/master",
+                      json={"values": [{"hash": f"c{index}", "date": date, "message": message,
+                                        "author": {"raw": "Robin <robin@batcave.org>"}}
+                                       for index, (date, message) in enumerate([
+                                           ("2020-06-01T00:00:00+00:00", "CV-22 later follow up"),
+                                           ("2020-03-10T00:00:00+00:00", "CV-22 dependency change"),
+                                           ("2019-11-01T00:00:00+00:00", "CV-30 before the window")])]})
+    scanning_service = DevopsMetricsService()
+    scanning_service.git_search_timeframe_in_months = 3
+
+    # Act
+    merge_info_map = scanning_service.extract_ticket_merge_info_from_commits(
+        repo, "", as_of=datetime(2020, 3, 28, tzinfo=pytz.utc))
+
+    # Assert
+    assert merge_info_map == {"CV-22": {"date": datetime(2020, 3, 10, tzinfo=pytz.utc), "author": "robin@batcave.org",
+                                        "repositories": [repo]}}
+
+
 def _get_base_tag_response():
     return {"values": [{"name": "1.0.3", "target": {"hash": "cur-release"}},
                        {"name": "1.0.2", "target": {"hash": "most_recent_last-release"}},
@@ -0,0 +1,59 @@
+import logging
+import pytest
+from devops_metrics_service import DevopsMetricsService
+from devops_metrics_tag_index import TagIndex
+
+TAGS_URL = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations/test_repo/refs/tags"
+
+
+@pytest.fixture
+def tag_index():
+    tag_index = TagIndex(logging.getLogger(__name__), ":memory:")
+    yield tag_index
+    tag_index.close()
+
+
+@pytest.fixture
+def devops_metrics_service(tag_index):
+    service = DevopsMetricsService()
+    service.tag_index = tag_index
+    # tests count the tag pages requested, so don't fetch ahead
+    service.commit_source.prefetch_pages = 0
+    return service
+
+
+def _get_tag(name: str) -> dict:
+    return {"name": name, "target": {"hash": f"hash-{name}", "date": "2020-03-27T00:00:00+00:00"}}
+
+
+def test_get_release_hash_before__then_bisect_semver_order(tag_index):
+    tag_index.add_tags("test_repo", [_get_tag(name) for name in ["1.10.0", "build-77", "1.9.2", "1.2.0", "1.9.10"]])
+
+    assert tag_index.get_versions("test_repo") == ["1.2.0", "1.9.2", "1.9.10", "1.10.0"]
+    assert tag_index.get_release_hash_before("test_repo", "1.10.0", 2) == "hash-1.9.2"
+    assert tag_index.get_release_hash_before("test_repo", "1.9.10", 1) == "hash-1.9.2"
+    assert tag_index.get_release_hash_before("test_repo", "1.2.0", 1) is None
+    # untagged versions are treated as the newest release
+    assert tag_index.get_release_hash_before("test_repo", "2.0.0-build3", 2) == "hash-1.9.2"
+    assert tag_index.get_release_hash("test_repo", "1.9.10") == "hash-1.9.10"
+
+
+def test_get_last_release_hash__when_indexed__then_only_page_until_last_seen_tag(devops_metrics_service,
+                                                                                  requests_mock):
+    # Arrange
+    requests_mock.get(TAGS_URL, json={"values": [_get_tag("1.0.2"), _get_tag("1.0.1")],
+                                      "next": f"{TAGS_URL}?page=2"})
+    requests_mock.get(f"{TAGS_URL}?page=2", json={"values": [_get_tag("1.0.0"), _get_tag("0.9.0")]})
+    first_hash = devops_metrics_service.get_last_release_hash("test_repo", "1.0.2")
+    requests_mock.reset_mock()
+    requests_mock.get(TAGS_URL, json={"values": [_get_tag("1.0.3"), _get_tag("1.0.2")],
+                                      "next": f"{TAGS_URL}?page=2"})
+
+    # Act
+    second_hash = devops_metrics_service.get_last_release_hash("test_repo", "1.0.3")
+
+    # Assert
+    assert first_hash == "hash-1.0.0"
+    assert second_hash == "hash-1.0.1"
+    assert requests_mock.call_count == 1
+    assert devops_metrics_service.tag_index.get_release_hash_before("test_repo", "1.0.1", 2) == "hash-0.9.0"
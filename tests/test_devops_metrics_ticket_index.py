@@ -0,0 +1,93 @@
+import logging
+import pytest
+import pytz
+from datetime import datetime
+from devops_metrics_info import CommitRecord
+from devops_metrics_service import DevopsMetricsService
+from devops_metrics_ticket_index import TicketIndex
+from freezegun import freeze_time
+
+BITBUCKET_URL = "https://api.bitbucket.org/2.0/repositories/lovelandinnovations"
+
+
+@pytest.fixture
+def ticket_index():
+    ticket_index = TicketIndex(logging.getLogger(__name__), ":memory:")
+    yield ticket_index
+    ticket_index.close()
+
+
+def _get_commit(commit_hash: str, day: int, author_email: str = "robin@batcave.org") -> CommitRecord:
+    return CommitRecord(commit_hash, "", datetime(2020, 3, day, tzinfo=pytz.utc), author_email)
+
+
+def _mock_commits(requests_mock, repo: str, commits: list) -> None:
+    requests_mock.get(f"{BITBUCKET_URL}/{repo}/commits/master",
+                      json={"values": [{"date": date, "author": {"raw": "Robin <robin@batcave.org>"},
+                                        "message": message, "hash": commit_hash}
+                                       for commit_hash, date, message in commits]})
+
+
+def test_get_merge_info__then_return_newest_merge_per_repo_since_cutoff(ticket_index):
+    # Arrange
+    ticket_index.add_commits("dep_domain", [_get_commit("c3", 20), _get_commit("c2", 10), _get_commit("c1", 1)],
+                             [["CV-1"], ["CV-1", "CV-2"], ["CV-3"]])
+    ticket_index.add_commits("dep_output", [_get_commit("d1", 15, "batman@batcave.org")], [["CV-2"]])
+
+    # Act
+    merge_info_by_repo = ticket_index.get_merge_info(["dep_domain", "dep_output"], ["CV-1", "CV-2", "CV-3"],
+                                                     since=datetime(2020, 3, 5, tzinfo=pytz.utc))
+
+    # Assert
+    assert merge_info_by_repo["dep_domain"] == {
+        "CV-1": {"date": datetime(2020, 3, 20, tzinfo=pytz.utc), "author": "robin@batcave.org",
+                 "repositories": ["dep_domain"]},
+        "CV-2": {"date": datetime(2020, 3, 10, tzinfo=pytz.utc), "author": "robin@batcave.org",
+                 "repositories": ["dep_domain"]}}
+    assert merge_info_by_repo["dep_output"]["CV-2"]["author"] == "batman@batcave.org"
+    assert ticket_index.get_indexed_head("dep_domain") == "c3"
+
+
+@freeze_time("2020, 3, 27")
+def test_compact__then_drop_old_merges(ticket_index):
+    ticket_index.add_commits("dep_domain", [_get_commit("c2", 20), _get_commit("c1", 1)], [["CV-1"], ["CV-2"]])
+
+    removed = ticket_index.compact(max_age_days=10)
+
+    assert removed == 1
+    assert list(ticket_index.get_merge_info(["dep_domain"], ["CV-1", "CV-2"])["dep_domain"]) == ["CV-1"]
+
+
+@freeze_time("2020, 3, 27")
+def test_get_ticket_merge_dates__when_using_ticket_index__then_match_scan_and_only_read_new_commits(
+        ticket_index, requests_mock):
+    # Arrange
+    app_repo = "app_repo"
+    dependency_repos = ["dep_domain", "dep_output"]
+    _mock_commits(requests_mock, app_repo, [("a1", "2020-03-20T00:00:00+00:00", "CV-22 app change")])
+    _mock_commits(requests_mock, "dep_domain", [("d2", "2020-03-25T00:00:00+00:00", "(CV-22) dependency change"),
+                                                ("d1", "2020-03-01T00:00:00+00:00", "CV-31 older change")])
+    _mock_commits(requests_mock, "dep_output", [("o1", "2020-03-15T00:00:00+00:00", "CV-31 output change"),
+                                                ("o0", "2019-11-01T00:00:00+00:00", "CV-22 outside timeframe")])
+    requests_mock.get(f"{BITBUCKET_URL}/{app_repo}/refs/tags",
+                      json={"values": [{"name": "1.0.3", "target": {"hash": "a1"}},
+                                       {"name": "1.0.2", "target": {"hash": "a0"}},
+                                       {"name": "1.0.1", "target": {"hash": "a0"}}]})
+    release_tickets = ["CV-22", "CV-31"]
+    scanning_service = DevopsMetricsService()
+    indexed_service = DevopsMetricsService()
+    indexed_service.ticket_index = ticket_index
+
+    # Act
+    scan_result = scanning_service._get_ticket_merge_dates(app_repo, dependency_repos, "1.0.3", release_tickets)
+    indexed_result = indexed_service._get_ticket_merge_dates(app_repo, dependency_repos, "1.0.3", release_tickets)
+    _mock_commits(requests_mock, "dep_domain", [("d3", "2020-03-26T00:00:00+00:00", "CV-31 new change"),
+                                                ("d2", "2020-03-25T00:00:00+00:00", "(CV-22) dependency change")])
+    indexed_service.refresh_ticket_index("dep_domain")
+
+    # Assert
+    assert indexed_result == scan_result
+    assert indexed_result["CV-22"]["repositories"] == ["dep_domain", app_repo]
+    assert ticket_index.get_indexed_head("dep_domain") == "d3"
+    assert ticket_index.get_merge_info(["dep_domain"], ["CV-31"])["dep_domain"]["CV-31"]["date"] == \
+        datetime(2020, 3, 26, tzinfo=pytz.utc)
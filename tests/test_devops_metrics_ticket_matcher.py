@@ -0,0 +1,28 @@
+import re
+from devops_metrics_ticket_matcher import TicketMatcher
+
+ticket_matcher = TicketMatcher(["CV", "IMGING", "IQ"])
+
+
+def _find_tickets_with_regex_per_project(message: str) -> list:
+    commit_tickets = []
+    for jira_project_str in ["CV", "IMGING", "IQ"]:
+        commit_tickets.extend(re.findall(r"[-\(\s\/]?(" + jira_project_str + r"\-[0-9]+)[-\)\s\/]?", message))
+    return commit_tickets
+
+
+def test_find_tickets__then_match_regex_per_project_results():
+    messages = ["CV-2 Some commit message (CV-22, IQ-10) IMGING-11", "feature/CV-101-some-branch",
+                "Merged in bugfix/IQ-3/CV-4 (pull request #12)", "no ticket here", "XCV-5", "CV-6CV-7", "CV-"]
+
+    for message in messages:
+        assert sorted(ticket_matcher.find_tickets(message)) == sorted(_find_tickets_with_regex_per_project(message))
+
+
+def test_find_tickets__then_match_whole_ticket_numbers():
+    assert ticket_matcher.find_tickets("CV-2 CV-22 CV-222 IQ-22") == ["CV-2", "CV-22", "CV-222", "IQ-22"]
+
+
+def test_find_tickets_in_batch__then_return_tickets_per_message():
+    assert ticket_matcher.find_tickets_in_batch(["CV-1", "nothing", "IQ-2 (IMGING-3)"]) == \
+           [["CV-1"], [], ["IQ-2", "IMGING-3"]]